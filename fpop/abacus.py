@@ -1,5 +1,21 @@
 from fpop.prep_fp import PrepFp
 from fpop.run_fp import RunFp
+from fpop.utils.kpoints import make_kspacing_kpoints_mesh
+from fpop.utils.labels import (
+    LabelWriter,
+    LABELS_DIR,
+)
+from fpop.utils.shared_files import (
+    SHARED_FILES_DIR,
+    record_shared_files,
+)
+from fpop.utils.input_files import (
+    read_file,
+    read_file_bytes,
+    file_content,
+    file_content_bytes,
+    ref_files,
+)
 import sys, subprocess, os, shutil,re
 from pathlib import Path
 from dflow.utils import run_command
@@ -246,37 +262,57 @@ MASS_DICT = {
     "Hs": 277,
 }
 
-def get_pporbdpks_from_stru(stru: str= "STRU"):
+# the directory of the pp/orb files shared by the tasks in the pp_orb_dir mode of PrepAbacus
+ABACUS_PP_ORB_DIR = "pp_orb"
+
+ABACUS_STRU_KEY_WORD = [
+    "ATOMIC_SPECIES",
+    "NUMERICAL_ORBITAL",
+    "LATTICE_CONSTANT",
+    "LATTICE_VECTORS",
+    "ATOMIC_POSITIONS",
+    "NUMERICAL_DESCRIPTOR",
+]
+
+def read_stru_blocks(stru: Union[str,Path] = "STRU") -> Dict[str, List[str]]:
+    """Split a STRU file into its blocks in one pass.
+
+    Parameters
+    ----------
+    stru : str or Path
+        The path of the STRU file.
+
+    Returns
+    -------
+    Dict[str, List[str]]
+        The lines of each block in ABACUS_STRU_KEY_WORD found in the file,
+        keyed by the keyword. The blank lines are skipped. If a keyword
+        appears more than once, the first block is kept.
+    """
+    blocks = {}
+    block = None
+    with open(stru) as f1:
+        for line in f1:
+            if line.strip() == "":
+                continue
+            key = line.split('#')[0].strip()
+            if key in ABACUS_STRU_KEY_WORD:
+                block = [] if key not in blocks else None
+                if block is not None:
+                    blocks[key] = block
+            elif block is not None:
+                block.append(line)
+    return blocks
+
+def get_pporbdpks_from_stru(stru: Union[str,Path] = "STRU"):
     "read the label, pp, orb, cell, coord, deepks-descriptor"
-    ABACUS_STRU_KEY_WORD = [
-        "ATOMIC_SPECIES",
-        "NUMERICAL_ORBITAL",
-        "LATTICE_CONSTANT",
-        "LATTICE_VECTORS",
-        "ATOMIC_POSITIONS",
-        "NUMERICAL_DESCRIPTOR",
-    ]
     if not os.path.isfile(stru):
         return {}
-    with open(stru) as f1: lines = f1.readlines()      
-    def get_block(keyname):
-        block = []
-        for i,line in enumerate(lines):
-            if line.strip() == "": continue
-            elif line.split('#')[0].strip() == keyname:
-                for ij in range(i+1,len(lines)):
-                    if lines[ij].strip() == "": continue
-                    elif lines[ij].strip() in ABACUS_STRU_KEY_WORD:
-                        return block
-                    else:
-                        block.append(lines[ij])
-                return block
-        return None
-    
-    atomic_species = get_block("ATOMIC_SPECIES")
-    numerical_orbital = get_block("NUMERICAL_ORBITAL")
-    dpks = get_block("NUMERICAL_DESCRIPTOR")
-    dpks = None if dpks == None else dpks[0].strip()
+    blocks = read_stru_blocks(stru)
+    atomic_species = blocks.get("ATOMIC_SPECIES")
+    numerical_orbital = blocks.get("NUMERICAL_ORBITAL")
+    dpks = blocks.get("NUMERICAL_DESCRIPTOR")
+    dpks = dpks[0].strip() if dpks else None
     
     #read species
     pp = []
@@ -302,7 +338,88 @@ def get_pporbdpks_from_stru(stru: str= "STRU"):
             "mass": mass,
             "pp":pp,
             "orb":orb,
-            "dpks":dpks,}
+            "dpks":dpks,
+            "blocks":blocks,}
+
+
+def make_abacus_kpt(kpoints: List[int], kgamma: bool = True) -> str:
+    "The KPT of an automatic k-mesh, gamma-centered or Monkhorst-Pack"
+    return "K_POINTS\n0\n%s\n%d %d %d 0 0 0\n" % ("Gamma" if kgamma else "MP", kpoints[0], kpoints[1], kpoints[2])
+
+
+def make_stru(
+        data : Dict[str, Any],
+        pp_file : List[str],
+        numerical_orbital : Optional[List[str]] = None,
+        numerical_descriptor : Optional[str] = None,
+        mass : Optional[List[float]] = None,
+        frame_idx : int = 0,
+) -> str:
+    r"""Render the STRU of a frame of a system.
+
+    The text is the same as written by `dpdata.System.to('abacus/stru')`
+    with the same arguments, but rendered directly from the arrays of the
+    system. The elements of zero atoms are skipped.
+
+    Parameters
+    ----------
+    data : Dict
+        The data of a dpdata.System, without `move` or `spins`.
+    pp_file : List[str]
+        The pseudopotential file of each element in data["atom_names"].
+    numerical_orbital : List[str], optional
+        The orbital file of each element in data["atom_names"].
+    numerical_descriptor : str, optional
+        The deepks descriptor file.
+    mass : List[float], optional
+        The mass of each element in data["atom_names"].
+    frame_idx : int
+        The index of the frame.
+
+    Returns
+    -------
+    stru : str
+        The STRU of the frame.
+    """
+    from dpdata.unit import LengthConversion
+    atom_names = data["atom_names"]
+    atom_numbs = data["atom_numbs"]
+    for files, name in [(pp_file, "pp_file"), (numerical_orbital, "numerical_orbital")]:
+        if files is not None and len(files) != len(atom_names):
+            raise ValueError(f"{name} length is not equal to the number of atom types")
+    elements = [ii for ii in range(len(atom_names)) if atom_numbs[ii] != 0]
+
+    head = "ATOMIC_SPECIES\n"
+    for ii in elements:
+        head += atom_names[ii] + " "
+        head += f"{mass[ii]:.3f} " if mass is not None else "1 "
+        head += pp_file[ii] + "\n"
+    head += "\n"
+    if numerical_orbital is not None:
+        head += "NUMERICAL_ORBITAL\n"
+        head += "".join([numerical_orbital[ii] + "\n" for ii in elements])
+        head += "\n"
+    if numerical_descriptor is not None:
+        head += f"NUMERICAL_DESCRIPTOR\n{numerical_descriptor}\n\n"
+    head += "LATTICE_CONSTANT\n"
+    head += str(1 / LengthConversion("bohr", "angstrom").value()) + "\n\n"
+
+    # the atoms are listed by the elements, keeping the original order in an element
+    atom_types = np.asarray(data["atom_types"])
+    sort_idx = np.concatenate([np.nonzero(atom_types == ii)[0] for ii in elements] + [np.zeros(0, dtype=int)])
+    positions = "ATOMIC_POSITIONS\n"
+    positions += "Cartesian    # Cartesian(Unit is LATTICE_CONSTANT)\n"
+    for ii in elements:
+        positions += atom_names[ii] + "\n"
+        positions += "0.0\n"
+        positions += str(atom_numbs[ii]) + "\n"
+        positions += "%.12f %.12f %.12f 1 1 1\n" * atom_numbs[ii]
+    cell = np.asarray(data["cells"][frame_idx])
+    coord = np.asarray(data["coords"][frame_idx])[sort_idx].reshape(-1)
+    lattice = "LATTICE_VECTORS\n"
+    lattice += "".join(["".join([str(jj) + " " for jj in ii]) + "\n" for ii in cell])
+    lattice += "\n"
+    return head + lattice + positions % tuple(coord.tolist())
 
 
 class AbacusInputs():
@@ -314,7 +431,10 @@ class AbacusInputs():
             kpt_file: Optional[Union[str,Path]] = None,
             orb_files: Optional[Dict[str, Union[str,Path]]] = None,
             deepks_descriptor: Optional[Union[str,Path]] = None,
-            deepks_model: Optional[Union[str,Path]] = None
+            deepks_model: Optional[Union[str,Path]] = None,
+            reference: bool = False,
+            kspacing: Optional[Union[float,List[float]]] = None,
+            kgamma: bool = True,
     ):     
         """The input information of an ABACUS job except for STRU.
 
@@ -337,7 +457,22 @@ class AbacusInputs():
             The deepks descriptor file, by default None.
         deepks_model : str, optional
             The deepks model file, by default None.
+        reference : bool, optional
+            Keep the pp, orbital and deepks files by reference instead of by content,
+            by default False. The files given by `ref_files` should be passed to the
+            prep step as the `input_files` artifact, where they are loaded when used.
+        kspacing : float or List[float], optional
+            The spacing of k-point sampling, in 1/Angstrom as KSPACING of VASP. If given,
+            the KPT of each frame is generated from its cell instead of `kpt_file`.
+            If it is a list of three numbers, it specifies the kspacing of each direction.
+        kgamma : bool, optional
+            If the k-mesh generated by `kspacing` includes the gamma point, by default True.
         """        
+        if kspacing is not None and kpt_file is not None:
+            raise ValueError("kspacing and kpt_file can not be given at the same time")
+        self.kspacing = kspacing
+        self.kgamma = kgamma
+        self.reference = reference
         self.input_file = input_file
         self._input = AbacusInputs.read_inputf(self.input_file)
 
@@ -345,8 +480,8 @@ class AbacusInputs():
         self._mass = element_mass if element_mass != None else {}
         self._kpt_file = None if kpt_file == None else Path(kpt_file).read_text()
         self._orb_files = {} if orb_files == None else self._read_dict_file(orb_files)
-        self._deepks_descriptor = None if deepks_descriptor == None else (os.path.split(deepks_descriptor)[1], Path(deepks_descriptor).read_text())
-        self._deepks_model = None if deepks_model == None else (os.path.split(deepks_model)[1], Path(deepks_model).read_bytes())
+        self._deepks_descriptor = None if deepks_descriptor == None else (os.path.split(deepks_descriptor)[1], read_file(deepks_descriptor, self.reference))
+        self._deepks_model = None if deepks_model == None else (os.path.split(deepks_model)[1], read_file_bytes(deepks_model, self.reference))
 
     def _read_dict_file(self,input_dict,out_dict=None):
         # input_dict is a dict whose value is a file.
@@ -355,7 +490,7 @@ class AbacusInputs():
         if not out_dict:
             out_dict = {}
         for k,v in input_dict.items():
-            out_dict[k] = (os.path.split(v)[1],Path(v).read_text())
+            out_dict[k] = (os.path.split(v)[1],read_file(v, self.reference))
         return out_dict
 
     def set_input(self, key:str, value:Any):
@@ -375,25 +510,41 @@ class AbacusInputs():
         self._read_dict_file({key:value},self._orb_files)
     
     def set_deepks_descriptor(self, value:str):
-        self._deepks_descriptor = (os.path.split(value)[1], Path(value).read_text())
+        self._deepks_descriptor = (os.path.split(value)[1], read_file(value, self.reference))
     
     def set_deepks_model(self, value:str):
-        self._deepks_model = (os.path.split(value)[1], Path(value).read_bytes())
+        self._deepks_model = (os.path.split(value)[1], read_file_bytes(value, self.reference))
+
+    def ref_files(self) -> List[Path]:
+        r"""The files kept by reference, to be given as the `input_files` artifact."""
+        return ref_files(self)
 
     def get_input(self):
         return self._input
     
     def get_pp(self):
-        return self._pp_files
+        return {kk : (vv[0], file_content(vv[1])) for kk, vv in self._pp_files.items()}
     
     def get_orb(self):
-        return self._orb_files
+        return {kk : (vv[0], file_content(vv[1])) for kk, vv in self._orb_files.items()}
     
     def get_deepks_descriptor(self):
-        return self._deepks_descriptor
+        if self._deepks_descriptor is None:
+            return None
+        return (self._deepks_descriptor[0], file_content(self._deepks_descriptor[1]))
     
     def get_deepks_model(self):
-        return self._deepks_model
+        if self._deepks_model is None:
+            return None
+        return (self._deepks_model[0], file_content_bytes(self._deepks_model[1]))
+
+    def get_file_names(self) -> List[str]:
+        """The names of the pp, orbital and deepks files, their contents are not read."""
+        files = [ii[0] for ii in self._pp_files.values()] + [ii[0] for ii in self._orb_files.values()]
+        for ii in [self._deepks_descriptor, self._deepks_model]:
+            if ii is not None:
+                files.append(ii[0])
+        return files
 
     @staticmethod
     def read_inputf(inputf: Union[str,Path]) -> dict:
@@ -423,23 +574,80 @@ class AbacusInputs():
                     input_context[sline[0].lower().strip()] = sline[1].strip() 
         return input_context    
 
-    def write_input(self,inputf :str = "INPUT"):
+    def write_input(self,inputf :str = "INPUT", extra_input: Optional[Dict[str,Any]] = None):
+        """Write INPUT.
+
+        Parameters
+        ----------
+        inputf : str
+            INPUT file name
+        extra_input : Dict[str, Any], optional
+            The parameters that overwrite the template for this INPUT only.
+        """
+        input_context = dict(self._input)
+        if extra_input:
+            input_context.update({k.strip().lower(): v for k,v in extra_input.items()})
         with open(inputf,'w') as f1:
             f1.write("INPUT_PARAMETERS\n")
-            for k,v in self._input.items():
+            for k,v in input_context.items():
                 f1.write("%s %s\n" % (str(k),str(v)))
     
-    def write_kpt(self,kptf = "KPT"):
-        if self._kpt_file:
+    def write_kpt(self,kptf = "KPT", box: Optional[np.ndarray] = None):
+        """Write KPT. If `kspacing` is set, the KPT is generated from the cell `box`,
+        otherwise the `kpt_file` is written.
+        """
+        if self.kspacing is not None:
+            if box is None:
+                raise ValueError("the cell is needed to write KPT from kspacing")
+            Path(kptf).write_text(self.make_kpt(box))
+        elif self._kpt_file:
             Path(kptf).write_text(self._kpt_file)
 
-    def write_pporb(self,element_list : List[str]):
+    def make_kpt(self, box: np.ndarray) -> str:
+        """The KPT of a cell generated from `kspacing`.
+        The KPT of the last cell is memoized, so consecutive frames of a fixed 
+        cell do not generate the k-mesh again.
+        """
+        box = np.asarray(box, dtype=float)
+        key = (box.tobytes(), str(self.kspacing), self.kgamma)
+        last = getattr(self, "_last_kpt", None)
+        if last is None or last[0] != key:
+            last = (key, self.make_kpt_batch(box[None])[0])
+            self._last_kpt = last
+        return last[1]
+
+    def make_kpt_batch(self, cells: np.ndarray) -> List[str]:
+        """The KPT of a batch of cells of shape (nframes, 3, 3) generated from `kspacing`.
+        The text is generated once for each distinct k-mesh.
+        """
+        if not hasattr(self, "_kpt_cache"):
+            self._kpt_cache = {}
+        ret = []
+        for kp in map(tuple, make_kspacing_kpoints_mesh(cells, self.kspacing).tolist()):
+            key = kp + (bool(self.kgamma),)
+            if key not in self._kpt_cache:
+                self._kpt_cache[key] = make_abacus_kpt(list(kp), self.kgamma)
+            ret.append(self._kpt_cache[key])
+        return ret
+
+    def __getstate__(self):
+        # the memoized KPT are not serialized with the inputs
+        state = self.__dict__.copy()
+        state.pop("_last_kpt", None)
+        state.pop("_kpt_cache", None)
+        return state
+
+    def write_pporb(self,element_list : List[str], target_dir: Optional[Union[str,Path]] = None, write: bool = True):
         """Based on element list, write the pp/orb files, and return a list of the filename. 
 
         Parameters
         ----------
         element_list : List[str]
             a list of element name
+        target_dir : str, optional
+            The directory where the files are written, by default the current directory.
+        write : bool
+            Write the files. If False, only the file names are returned.
 
         Returns
         -------
@@ -449,13 +657,18 @@ class AbacusInputs():
         need_orb = False
         if self._input.get("basis_type","pw").lower() in ["lcao","lcao_in_pw"]:
             need_orb = True
+        target_dir = Path(target_dir) if target_dir is not None else Path(".")
+        if write:
+            target_dir.mkdir(parents=True, exist_ok=True)
         pp,orb = [],[]
         for ielement in element_list:
             if ielement in self._pp_files:
-                Path(self._pp_files[ielement][0]).write_text(self._pp_files[ielement][1])
+                if write:
+                    (target_dir/self._pp_files[ielement][0]).write_text(file_content(self._pp_files[ielement][1]))
                 pp.append(self._pp_files[ielement][0])
             if need_orb and ielement in self._orb_files:
-                Path(self._orb_files[ielement][0]).write_text(self._orb_files[ielement][1]) 
+                if write:
+                    (target_dir/self._orb_files[ielement][0]).write_text(file_content(self._orb_files[ielement][1]))
                 orb.append(self._orb_files[ielement][0])
 
         if not orb: 
@@ -463,10 +676,18 @@ class AbacusInputs():
 
         return [pp,orb]     
 
-    def write_deepks(self):
+    def write_deepks(self, target_dir: Optional[Union[str,Path]] = None, write_descriptor: bool = True):
         """Check if INPUT is a deepks job, if yes, will return the deepks descriptor file name, 
         else will return None.
 
+        Parameters
+        ----------
+        target_dir : str, optional
+            The directory where the descriptor file is written, by default the current directory.
+            The model file is always written to the current directory.
+        write_descriptor : bool
+            Write the descriptor file. If False, only the file name is returned.
+
         Returns
         -------
         str
@@ -482,13 +703,16 @@ class AbacusInputs():
         if need_descriptor:
             assert(self._deepks_descriptor != None)
             descriptor_file = self._deepks_descriptor[0]
-            Path(descriptor_file).write_text(self._deepks_descriptor[1])
+            if write_descriptor:
+                target_dir = Path(target_dir) if target_dir is not None else Path(".")
+                target_dir.mkdir(parents=True, exist_ok=True)
+                (target_dir/descriptor_file).write_text(file_content(self._deepks_descriptor[1]))
         else:
             descriptor_file = None
 
         if need_model:
             assert(self._deepks_model != None)
-            Path(self._deepks_model[0]).write_bytes(self._deepks_model[1])
+            Path(self._deepks_model[0]).write_bytes(file_content_bytes(self._deepks_model[1]))
 
         return descriptor_file
         
@@ -539,20 +763,167 @@ class PrepAbacus(PrepFp):
         """
 
         element_list = conf_frame['atom_names']
-        pp, orb = inputs.write_pporb(element_list)
-        dpks = inputs.write_deepks()
+        pp_orb_dir = bool(prepare_image_config and prepare_image_config.get("pp_orb_dir", False))
+        # in the pp_orb_dir mode, the pp/orb/descriptor files are written once by prep_shared
+        pp, orb = inputs.write_pporb(element_list, write=not pp_orb_dir)
+        dpks = inputs.write_deepks(write_descriptor=not pp_orb_dir)
         mass = inputs.get_mass(element_list)
-        conf_frame.to('abacus/stru', 'STRU', pp_file=pp,numerical_orbital=orb,numerical_descriptor=dpks,mass=mass)
+        if conf_frame.data.get("move", None) is not None or conf_frame.data.get("spins", None) is not None:
+            conf_frame.to('abacus/stru', 'STRU', pp_file=pp,numerical_orbital=orb,numerical_descriptor=dpks,mass=mass)
+        else:
+            Path('STRU').write_text(make_stru(conf_frame.data, pp, orb, dpks, mass))
         
-        inputs.write_input("INPUT")
-        inputs.write_kpt("KPT")
+        extra_input = None
+        if pp_orb_dir:
+            extra_input = {"pseudo_dir" : "./%s/" % ABACUS_PP_ORB_DIR}
+            if orb or dpks:
+                extra_input["orbital_dir"] = "./%s/" % ABACUS_PP_ORB_DIR
+            record_shared_files({ABACUS_PP_ORB_DIR : ABACUS_PP_ORB_DIR})
+        inputs.write_input("INPUT", extra_input)
+        inputs.write_kpt("KPT", conf_frame['cells'][0])
 
         if optional_artifact:
             for file_name, file_path in optional_artifact.items():
                 content = file_path.read_text()
                 Path(file_name).write_text(content)
+
+    def prep_shared(
+            self,
+            inputs: AbacusInputs,
+            prepare_image_config: Optional[Dict] = None,
+            optional_input: Optional[Dict] = None,
+            optional_artifact: Optional[Dict] = None,
+    ):
+        r"""When the key "pp_orb_dir" of `prepare_image_config` is True, the pp, orbital
+        and deepks descriptor files are written once to the directory `ABACUS_PP_ORB_DIR`
+        of the pool of shared files, and the INPUT of the tasks points `pseudo_dir` and
+        `orbital_dir` to it.
+        """
+        if not (prepare_image_config and prepare_image_config.get("pp_orb_dir", False)):
+            return
+        target_dir = Path(SHARED_FILES_DIR) / ABACUS_PP_ORB_DIR
+        element_list = list(dict.fromkeys(list(inputs.get_pp().keys()) + list(inputs.get_orb().keys())))
+        inputs.write_pporb(element_list, target_dir)
+        descriptor = inputs.get_deepks_descriptor()
+        if descriptor is not None:
+            (target_dir/descriptor[0]).write_text(descriptor[1])
+
+    def shared_files(
+            self,
+            inputs: AbacusInputs,
+            optional_artifact: Optional[Dict] = None,
+    ) -> List[str]:
+        r"""The pp, orbital and deepks files and the files of optional_artifact are shared by the tasks."""
+        return inputs.get_file_names() + super().shared_files(inputs, optional_artifact)
        
 
+def _float_row(words, start, n):
+    # the n floats from words[start:], None if the words are not such a row
+    if len(words) != start + n:
+        return None
+    try:
+        return [float(ii) for ii in words[start:]]
+    except ValueError:
+        return None
+
+def _read_table(f, row, max_skip=10):
+    # the rows following a header, the first row is within max_skip lines
+    ret = []
+    for ii, line in enumerate(f):
+        vv = row(line.split())
+        if vv is not None:
+            ret.append(vv)
+        elif ret or ii >= max_skip:
+            break
+    return ret
+
+def read_abacus_scf_log(
+        fname : Union[str, Path],
+) -> Dict[str, Any]:
+    r"""Read the energy, forces and stress from running_scf.log in one pass.
+
+    The log is read line by line and only the last block of each quantity
+    is kept.
+
+    Parameters
+    ----------
+    fname : str or Path
+        The log, e.g. OUT.ABACUS/running_scf.log.
+
+    Returns
+    -------
+    labels : Dict
+        With keys "energy" (eV), "force" (eV/Angstrom, None if not printed),
+        "stress" (kBar, None if not printed) and "converged".
+    """
+    energy, force, stress, converged = None, None, None, False
+    atom_row = re.compile(r"^[A-Z][a-z]?\d+$")
+    with open(fname) as f:
+        for line in f:
+            if "final etot is" in line or "FINAL_ETOT_IS" in line or "TOTAL ENERGY" in line:
+                energy = float(line.split()[-2])
+                converged = True
+            elif "convergence has NOT been achieved" in line or "convergence has not been achieved" in line:
+                converged = False
+            elif "TOTAL-FORCE" in line:
+                force = _read_table(f, lambda ww: _float_row(ww, 1, 3) if ww and atom_row.match(ww[0]) else None)
+            elif "TOTAL-STRESS" in line:
+                stress = _read_table(f, lambda ww: _float_row(ww, 0, 3))
+    return {
+        "energy" : energy,
+        "force" : np.array(force) if force else None,
+        "stress" : np.array(stress) if stress else None,
+        "converged" : converged,
+    }
+
+
+def extract_abacus_labels(
+        task_dir : Union[str, Path],
+        path : Union[str, Path],
+        convergence_check : bool = True,
+) -> int:
+    r"""Extract the labels of an ABACUS scf task to the deepmd/npy layout in `path`.
+
+    The structure is read from the STRU and the labels from
+    OUT.${suffix}/running_scf.log, see `read_abacus_scf_log`.
+
+    Parameters
+    ----------
+    task_dir : str or Path
+        The directory where the task runs.
+    path : str or Path
+        The directory of the labels.
+    convergence_check : bool
+        Skip the frame if the SCF does not converge.
+
+    Returns
+    -------
+    nframes : int
+        The number of frames extracted.
+    """
+    import dpdata
+    from dpdata.unit import PressureConversion
+    task_dir = Path(task_dir)
+    input_param = AbacusInputs.read_inputf(task_dir / "INPUT")
+    if input_param.get("calculation", "scf") != "scf":
+        raise ValueError("only the labels of scf calculation are extracted, got %s" % input_param["calculation"])
+    log = task_dir / ("OUT.%s" % input_param.get("suffix", "ABACUS")) / "running_scf.log"
+    labels = read_abacus_scf_log(log)
+    if labels["energy"] is None:
+        raise ValueError(f"cannot find the energy in {log}")
+    if labels["force"] is None:
+        raise ValueError(f"cannot find the forces in {log}")
+    conf = dpdata.System(str(task_dir / input_param.get("stru_file", "STRU")), fmt="abacus/stru")
+    cell = conf["cells"][0]
+    virial = None
+    if labels["stress"] is not None:
+        virial = labels["stress"] * PressureConversion("kbar", "eV/angstrom^3").value() * abs(np.linalg.det(cell))
+    with LabelWriter(path, conf["atom_names"], conf["atom_types"]) as writer:
+        if labels["converged"] or not convergence_check:
+            writer.append(cell, conf["coords"][0], labels["energy"], labels["force"], virial)
+        return writer.close()
+
+
 class RunAbacus(RunFp):
     def input_files(self,task_path) -> List[str]:
         r'''The mandatory input files to run an abacus task.
@@ -562,37 +933,41 @@ class RunAbacus(RunFp):
             A list of madatory input files names.
         '''
         
-        cwd = os.getcwd()
-        os.chdir(task_path)
-
+        task_path = Path(task_path)
         files = ["INPUT","STRU"]
-        if os.path.isfile("KPT"):
+        if (task_path/"KPT").is_file():
             files.append("KPT")
             
+        #read INPUT
+        input = AbacusInputs.read_inputf(task_path/"INPUT")
+        pseudo_dir = input.get("pseudo_dir", "")
+        orbital_dir = input.get("orbital_dir", "")
+
         files_tmp = []
         #read STRU
-        stru_data = get_pporbdpks_from_stru("STRU")
-        if stru_data != None:
+        stru_data = get_pporbdpks_from_stru(task_path/"STRU")
+        if stru_data:
             orb_files = stru_data["orb"]
             pp_files = stru_data["pp"]
             dpks_descriptor = stru_data["dpks"]
 
-            files_tmp += pp_files
-            if orb_files: files_tmp += orb_files
-            if dpks_descriptor: files_tmp += [dpks_descriptor]
+            files_tmp += [os.path.join(pseudo_dir, ii) for ii in pp_files]
+            if orb_files: files_tmp += [os.path.join(orbital_dir, ii) for ii in orb_files]
+            if dpks_descriptor: files_tmp += [os.path.join(orbital_dir, dpks_descriptor)]
 
-        #read INPUT
-        input = AbacusInputs.read_inputf("INPUT")
         if "deepks_model" in input: files_tmp += [input["deepks_model"]]
 
         for ii in files_tmp:
-            if os.path.isfile(ii):
-                files.append(ii)
+            if (task_path/ii).is_file():
+                parts = Path(os.path.normpath(ii)).parts
+                if not os.path.isabs(ii) and len(parts) > 1 and parts[0] != "..":
+                    # the files in pseudo_dir or orbital_dir are staged by the directory
+                    ii = parts[0]
+                if ii not in files:
+                    files.append(ii)
             else:
                 print("ERROR: file %s is not found" % ii)
 
-        os.chdir(cwd)
-
         return files
 
     def run_task(
@@ -617,8 +992,21 @@ class RunAbacus(RunFp):
             {
               "command": "source /opt/intel/oneapi/setvars.sh && mpirun -n 16 abacus"
             }
+            Or "launcher" builds the command line that fits the cpus of the pod,
+            see `RunFp.engine_command`.
         optional_input:
-            The parameters developers need in runtime.
+            The parameters developers need in runtime. The keys used by RunAbacus:
+            {
+              "backward_filter": ["running_*.log", "STRU_*"],
+              "backward_compress": {"method": "gzip", "threshold": 1048576},
+              "extract_labels": True
+            }
+            "backward_filter" are the glob patterns of the files retained from the
+            directories in backward_list, e.g. OUT.ABACUS, and "backward_compress" is
+            the compression of the backward files, see `RunFp.collect_backward`.
+            If "extract_labels" is True, the energy, forces and stress of the scf
+            calculation are extracted to `labels` in the backward directory in the
+            deepmd/npy format.
         
         Returns
         -------
@@ -626,17 +1014,10 @@ class RunAbacus(RunFp):
             The directory name which containers the files users need.
         '''
         
-        if run_image_config:
-            command = run_image_config["command"]
-        else:
-            command = "abacus"
-        # run abacus
-        command = " ".join([command, ">", log_name])
-        kwargs = {"try_bash": True, "shell": True}
-        if run_image_config:
-            kwargs.update(run_image_config)
-            kwargs.pop("command", None)
-        ret, out, err = run_command(command, raise_error=False, **kwargs) # type: ignore
+        # run abacus, bound to a cpu slot if the tasks run concurrently in a pod
+        kwargs = self.run_command_kwargs(run_image_config)
+        with self.engine_command(run_image_config, log_name, "abacus") as command:
+            ret, out, err = run_command(command, raise_error=False, **kwargs) # type: ignore
         if ret != 0:
             raise TransientError(
                 "abacus failed\n", "out msg", out, "\n", "err msg", err, "\n"
@@ -645,19 +1026,20 @@ class RunAbacus(RunFp):
             raise TransientError(
                 "abacus failed , we could not check the exact cause . Please check log file ."
             )
+        if optional_input is None:
+            optional_input = {}
         os.makedirs(Path(backward_dir_name))
-        shutil.copyfile(log_name,Path(backward_dir_name)/log_name)
-        for ii in backward_list:
+        self.collect_backward(
+            [log_name] + backward_list, backward_dir_name,
+            patterns=optional_input.get("backward_filter"),
+            compress=optional_input.get("backward_compress"),
+        )
+        if optional_input.get("extract_labels", False):
             try:
-                shutil.copyfile(ii,Path(backward_dir_name)/ii)
-            except:
-                shutil.copytree(ii,Path(backward_dir_name)/ii)
+                extract_abacus_labels(".", Path(backward_dir_name)/LABELS_DIR)
+            except Exception as e:
+                raise FatalError(f"failed to extract the labels from running_scf.log: {e}")
         return backward_dir_name
 
     def check_run_success(self,log_name):
-        with open(log_name,"r") as f:
-            lines = f.readlines()
-        if "SEE INFORMATION IN" in lines[-1]:
-            return True
-        else:
-            return False
+        return self.check_tail(log_name, "SEE INFORMATION IN", last_line=True)
@@ -1,7 +1,15 @@
 from fpop.prep_fp import PrepFp
 from fpop.run_fp import RunFp
+from fpop.utils.labels import (
+    LabelWriter,
+    LABELS_DIR,
+)
+from fpop.utils.input_files import (
+    read_file,
+    file_content,
+    ref_files,
+)
 import dpdata, sys, subprocess, os, shutil
-from ase.io import read, write
 from pathlib import Path
 from dflow.utils import run_command
 from typing import (
@@ -14,6 +22,11 @@ from typing import (
     Union,
 )
 import numpy as np
+from dpdata.unit import (
+    EnergyConversion,
+    LengthConversion,
+    PressureConversion,
+)
 from dargs import (
     dargs, 
     Argument, 
@@ -31,7 +44,7 @@ from dflow.python import (
 )
 
 class Cp2kInputs:
-    def __init__(self, inp_file: str):
+    def __init__(self, inp_file: str, reference: bool = False):
         """
         Initialize the Cp2kInputs class.
 
@@ -39,7 +52,12 @@ class Cp2kInputs:
         ----------
         inp_file : str
             The path to the user-submitted CP2K input file.
+        reference : bool, optional
+            Keep the input file by reference instead of by content. The files given
+            by `ref_files` should be passed to the prep step as the `input_files`
+            artifact, where they are loaded when used.
         """
+        self.reference = reference
         self.inp_file_from_file(inp_file)
 
     @property
@@ -47,7 +65,7 @@ class Cp2kInputs:
         """
         Return the template content of the input file.
         """
-        return self._inp_template
+        return file_content(self._inp_template)
 
     def inp_file_from_file(self, fname: str):
         """
@@ -58,7 +76,13 @@ class Cp2kInputs:
         fname : str
             The path to the input file.
         """
-        self._inp_template = Path(fname).read_text()
+        self._inp_template = read_file(fname, self.reference)
+
+    def ref_files(self) -> List[Path]:
+        """
+        The files kept by reference, to be given as the `input_files` artifact.
+        """
+        return ref_files(self)
 
     @staticmethod
     def args():
@@ -66,10 +90,67 @@ class Cp2kInputs:
         Define the arguments required by the Cp2kInputs class.
         """
         doc_inp_file = "The path to the user-submitted CP2K input file."
+        doc_reference = "Keep the input file by reference, it is shipped to the prep step by the `input_files` artifact."
         return [
             Argument("inp_file", str, optional=False, doc=doc_inp_file),
+            Argument("reference", bool, optional=True, default=False, doc=doc_reference),
         ]
 
+def make_coord(
+        data : Dict[str, Any],
+        frame_idx : int = 0,
+) -> str:
+    r"""Render the atomic coordinates (coord.xyz) of a frame of a system.
+
+    Each line holds the element and the cartesian coordinates of one atom,
+    in the xyz format without the header lines. The atoms are sorted by
+    their types, keeping the original order in a type, as in the POSCAR.
+
+    Parameters
+    ----------
+    data : Dict
+        The data of a dpdata.System.
+    frame_idx : int
+        The index of the frame.
+
+    Returns
+    -------
+    coord : str
+        The coordinates of the frame.
+    """
+    atom_types = np.asarray(data["atom_types"])
+    sort_idx = np.lexsort((np.arange(len(atom_types)), atom_types))
+    coord_fmt = "".join([
+        "%-2s %%16.8f %%16.8f %%16.8f\n" % data["atom_names"][tt]
+        for tt in atom_types[sort_idx]
+    ])
+    coord = np.asarray(data["coords"][frame_idx])[sort_idx].reshape(-1)
+    return coord_fmt % tuple(coord.tolist())
+
+
+def make_cell_parameter(
+        data : Dict[str, Any],
+        frame_idx : int = 0,
+) -> str:
+    r"""Render the cell vectors (CELL_PARAMETER) of a frame of a system.
+
+    Parameters
+    ----------
+    data : Dict
+        The data of a dpdata.System.
+    frame_idx : int
+        The index of the frame.
+
+    Returns
+    -------
+    cell_parameter : str
+        The cell vectors of the frame.
+    """
+    cell_fmt = "".join(["%s %%14.8f %%14.8f %%14.8f\n" % ii for ii in "ABC"])
+    cell = np.asarray(data["cells"][frame_idx]).reshape(-1)
+    return cell_fmt % tuple(cell.tolist())
+
+
 class PrepCp2k(PrepFp):
     def prep_task(
             self,
@@ -95,25 +176,10 @@ class PrepCp2k(PrepFp):
         optional_artifact: Dict[str, Path], optional
             Other files that users or developers need.
         """
-        # Generate POSCAR file from the configuration frame
-        conf_frame.to('vasp/poscar', 'POSCAR')
-
-        # Read the structure from the POSCAR file and write to a temporary XYZ file
-        atoms = read('POSCAR')
-        write('temp.xyz', atoms)
-
-        # Read the temporary XYZ file, remove the first two lines, and write to coord.xyz
-        with open('temp.xyz', 'r') as f:
-            lines = f.readlines()[2:]  # Remove the first two lines
-        with open('coord.xyz', 'w') as f:
-            f.writelines(lines)
-
-        # Generate CELL_PARAMETER file
-        cell_params = conf_frame['cells'][0]
-        with open('CELL_PARAMETER', 'w') as file:
-            file.write(f"A {cell_params[0,0]:14.8f} {cell_params[0,1]:14.8f} {cell_params[0,2]:14.8f}\n")
-            file.write(f"B {cell_params[1,0]:14.8f} {cell_params[1,1]:14.8f} {cell_params[1,2]:14.8f}\n")
-            file.write(f"C {cell_params[2,0]:14.8f} {cell_params[2,1]:14.8f} {cell_params[2,2]:14.8f}\n")
+        # Render the coordinate and cell files from the arrays of the frame,
+        # one frame per task as POSCAR and STRU, no temporary file is written
+        Path('coord.xyz').write_text(make_coord(conf_frame.data))
+        Path('CELL_PARAMETER').write_text(make_cell_parameter(conf_frame.data))
 
         # Write the CP2K input file content
         Path('input.inp').write_text(inputs.inp_template)
@@ -124,6 +190,144 @@ class PrepCp2k(PrepFp):
                 content = file_path.read_text()
                 Path(file_name).write_text(content)
 
+    def shared_files(
+            self,
+            inputs: Cp2kInputs,
+            optional_artifact: Optional[Dict] = None,
+    ) -> List[str]:
+        r"""input.inp and the files of optional_artifact are shared by the tasks."""
+        return ["input.inp"] + super().shared_files(inputs, optional_artifact)
+
+
+# the units of the CP2K output to Angstrom and eV
+_HARTREE_TO_EV = EnergyConversion("hartree", "eV").value()
+_BOHR_TO_ANG = LengthConversion("bohr", "angstrom").value()
+_EV_A3_TO_GPA = PressureConversion("eV/angstrom^3", "GPa").value()
+
+def read_cp2k_output(
+        fname : Union[str, Path],
+) -> Dict[str, Any]:
+    r"""Read the labels of the last force evaluation from a CP2K output in one pass.
+
+    The output is read line by line and only the last block of each
+    quantity is kept. Both the formats before and after CP2K 2023, e.g.
+    `ATOMIC FORCES in [a.u.]` and `FORCES| Atomic forces`, are recognized.
+    The forces and the stress tensor are printed only if `PRINT%FORCES` and
+    `STRESS_TENSOR` are set in the input.
+
+    Parameters
+    ----------
+    fname : str or Path
+        The CP2K output (the log of the run).
+
+    Returns
+    -------
+    labels : Dict
+        With keys "atom_names", "atom_types", "cell", "coord", "energy",
+        "force", "virial" (None if the stress tensor is not printed) and
+        "converged" (whether the last SCF run converged), in Angstrom and eV.
+    """
+    elements : Optional[List[str]] = None
+    coord : Optional[List[List[float]]] = None
+    cell : List[Optional[List[float]]] = [None] * 3
+    energy, force, stress = None, None, None
+    converged = False
+    with open(fname) as f:
+        for line in f:
+            words = line.split()
+            if not words:
+                continue
+            if words[0] == "CELL|" and len(words) >= 7 and words[1] == "Vector" and words[2] in "abc":
+                cell["abc".index(words[2])] = [float(ii) for ii in words[4:7]]
+            elif "ATOMIC COORDINATES IN" in line.upper():
+                for line in f:
+                    if "Element" in line:
+                        break
+                elements, coord = [], []
+                for line in f:
+                    ww = line.split()
+                    if not ww:
+                        if coord:
+                            break
+                        continue
+                    elements.append(ww[2])
+                    coord.append([float(ii) for ii in ww[4:7]])
+            elif words[0] == "ENERGY|" and "FORCE_EVAL" in line:
+                energy = float(words[-1]) * _HARTREE_TO_EV
+            elif "SCF run converged" in line:
+                converged = True
+            elif "SCF run NOT converged" in line:
+                converged = False
+            elif "ATOMIC FORCES in" in line:
+                force = []
+                for line in f:
+                    if "SUM OF ATOMIC FORCES" in line:
+                        break
+                    ww = line.split()
+                    if len(ww) >= 6 and ww[0].isdigit():
+                        force.append([float(ii) for ii in ww[3:6]])
+            elif words[0] == "FORCES|":
+                if "Atomic forces" in line:
+                    force = []
+                elif force is not None and len(words) >= 5 and words[1].isdigit():
+                    force.append([float(ii) for ii in words[2:5]])
+            elif "STRESS TENSOR [GPA]" in line.upper():
+                stress = []
+                for line in f:
+                    ww = line.split()
+                    if ww and ww[0] == "STRESS|":
+                        ww = ww[1:]
+                    if len(ww) == 4 and ww[0].lower() in ["x", "y", "z"]:
+                        stress.append([float(ii) for ii in ww[1:4]])
+                        if len(stress) == 3:
+                            break
+    if elements is None or coord is None:
+        raise ValueError(f"cannot find the atomic coordinates in {fname}")
+    if energy is None:
+        raise ValueError(f"cannot find the energy in {fname}")
+    if not force:
+        raise ValueError(f"cannot find the forces in {fname}")
+    if any([ii is None for ii in cell]):
+        raise ValueError(f"cannot find the cell vectors in {fname}")
+    box = np.array(cell)
+    atom_names = list(dict.fromkeys(elements))
+    virial = None
+    if stress is not None and len(stress) == 3:
+        virial = np.array(stress) * np.linalg.det(box) / _EV_A3_TO_GPA
+    return {
+        "atom_names" : atom_names,
+        "atom_types" : np.array([atom_names.index(ii) for ii in elements]),
+        "cell" : box,
+        "coord" : np.array(coord),
+        "energy" : energy,
+        "force" : np.array(force) * _HARTREE_TO_EV / _BOHR_TO_ANG,
+        "virial" : virial,
+        "converged" : converged,
+    }
+
+
+def extract_cp2k_labels(
+        fname : Union[str, Path],
+        path : Union[str, Path],
+        convergence_check : bool = True,
+) -> int:
+    r"""Extract the labels of a CP2K output to the deepmd/npy layout in `path`, see `read_cp2k_output`.
+
+    Returns
+    -------
+    nframes : int
+        The number of frames extracted, 0 if the SCF does not converge and
+        `convergence_check` is True.
+    """
+    labels = read_cp2k_output(fname)
+    with LabelWriter(path, labels["atom_names"], labels["atom_types"]) as writer:
+        if labels["converged"] or not convergence_check:
+            writer.append(labels["cell"], labels["coord"], labels["energy"], labels["force"], labels["virial"])
+        return writer.close()
+
+
+# the number of bytes read from the end of the CP2K output to check the success
+CP2K_TAIL_BYTES = 1 << 20
 
 class RunCp2k(RunFp):
     def input_files(self, task_path) -> List[str]:
@@ -161,34 +365,30 @@ class RunCp2k(RunFp):
             {
               "command": "source /opt/intel/oneapi/setvars.sh && mpirun -n 64 /opt/cp2k/bin/cp2k.popt"
             }
+            Or "launcher" builds the command line that fits the cpus of the pod,
+            see `RunFp.engine_command`.
         optional_input : Dict, optional
             The parameters developers need in runtime. For example:
             {
                 "conf_format": "cp2k/input"
             }
-        
+            If "extract_labels" is True, the energy, forces, stress and the
+            geometry are extracted from the log to `labels` in the backward
+            directory in the deepmd/npy format.
+            "backward_filter" are the glob patterns of the files retained from
+            the directories in backward_list, and "backward_compress" is the
+            compression of the backward files, see `RunFp.collect_backward`.
+
         Returns
         -------
         backward_dir_name : str
             The directory name which contains the files users need.
         """
-        # Get the run command
-        if run_image_config:
-            command = run_image_config.get("command")
-            if not command:
-                raise ValueError("Command not specified in run_image_config")
-        else:
-            raise ValueError("run_image_config is missing")
-        
-        # Run CP2K command and write output to log file
-        command = " ".join([command, ">", log_name])
-        kwargs = {"try_bash": True, "shell": True}
-        if run_image_config:
-            kwargs.update(run_image_config)
-            kwargs.pop("command", None)
-        
-        # Execute command
-        ret, out, err = run_command(command, raise_error=False, **kwargs)  # type: ignore
+        # Run CP2K command and write output to log file, the command is
+        # bound to a cpu slot if the tasks run concurrently in a pod
+        kwargs = self.run_command_kwargs(run_image_config)
+        with self.engine_command(run_image_config, log_name) as command:
+            ret, out, err = run_command(command, raise_error=False, **kwargs)  # type: ignore
         if ret != 0:
             raise TransientError(
                 "cp2k failed\n", "out msg", out, "\n", "err msg", err, "\n"
@@ -200,14 +400,20 @@ class RunCp2k(RunFp):
                 "cp2k failed, we could not check the exact cause. Please check the log file."
             )
         
-        # Create output directory and copy log file
+        if optional_input is None:
+            optional_input = {}
+        # Create output directory and collect the log and backward files
         os.makedirs(Path(backward_dir_name))
-        shutil.copyfile(log_name, Path(backward_dir_name) / log_name)
-        for ii in backward_list:
+        self.collect_backward(
+            [log_name] + backward_list, backward_dir_name,
+            patterns=optional_input.get("backward_filter"),
+            compress=optional_input.get("backward_compress"),
+        )
+        if optional_input.get("extract_labels", False):
             try:
-                shutil.copyfile(ii, Path(backward_dir_name) / ii)
-            except:
-                shutil.copytree(ii, Path(backward_dir_name) / ii)
+                extract_cp2k_labels(log_name, Path(backward_dir_name)/LABELS_DIR)
+            except Exception as e:
+                raise FatalError(f"failed to extract the labels from {log_name}: {e}")
         
         return backward_dir_name
     
@@ -220,6 +426,5 @@ class RunCp2k(RunFp):
         success : bool
             True if the task ran successfully with warnings line, False otherwise.
         """
-        with open(log_name, "r") as f:
-            lines = f.readlines()
-        return any("The number of warnings for this run is" in line for line in lines)
+        # the warnings line is followed by the timing report and the references
+        return self.check_tail(log_name, "The number of warnings for this run is", max_bytes=CP2K_TAIL_BYTES)
@@ -1,6 +1,7 @@
 from abc import ABC,abstractmethod
 import os
 from pathlib import Path
+from itertools import islice
 from dflow.utils import set_directory
 from dflow.python import (
     PythonOPTemplate,
@@ -11,6 +12,7 @@ from dflow.python import (
     TransientError,
     FatalError,
     BigParameter,
+    Parameter,
 )
 from typing import (
     Any,
@@ -21,6 +23,26 @@ from typing import (
     Optional,
     Union,
 )
+from fpop.utils.frame_stream import (
+    iter_frames,
+    get_frame_info,
+    DEFAULT_CHUNK_SIZE,
+)
+from fpop.utils.shared_files import (
+    pool_files,
+    SHARED_FILES_DIR,
+)
+from fpop.utils.task_archive import (
+    pack_tasks,
+    task_archive_name,
+)
+from fpop.utils.task_manifest import (
+    write_task_manifest,
+    task_manifest_name,
+    TASK_MANIFEST_DIR,
+)
+from fpop.utils.input_files import register_input_files
+import numpy as np
 
 class PrepFp(OP, ABC):
     r"""Prepares the working directories for first-principles (FP) tasks.
@@ -41,7 +63,17 @@ class PrepFp(OP, ABC):
             "confs" : Artifact(List[Path]),
             "prep_image_config" : BigParameter(dict,default={}),
             "optional_input" : BigParameter(dict,default={}),
-            "optional_artifact" : Artifact(Dict[str,Path],optional=True)
+            "optional_artifact" : Artifact(Dict[str,Path],optional=True),
+            "input_files" : Artifact(List[Path],optional=True),
+            "shard_index" : Parameter(int,default=0),
+            "n_shards" : Parameter(int,default=1),
+            "shard_balance" : Parameter(str,default="frames"),
+            "pack_size" : Parameter(int,default=0),
+            "list_task_names" : Parameter(bool,default=True),
+            "write_manifest" : Parameter(bool,default=False),
+            "task_name_width" : Parameter(int,default=6),
+            "task_bucket_size" : Parameter(int,default=0),
+            "group_size" : Parameter(int,default=0),
         })
 
     @classmethod
@@ -49,6 +81,10 @@ class PrepFp(OP, ABC):
         return OPIOSign({
             "task_names": List[str],
             "task_paths" : Artifact(List[Path]),
+            "n_tasks" : int,
+            "shared_files" : Artifact(List[Path],optional=True),
+            "task_manifest" : Artifact(List[Path],optional=True),
+            "task_groups" : List[dict],
         })
 
     @abstractmethod
@@ -83,6 +119,41 @@ class PrepFp(OP, ABC):
         """
         pass
 
+    def shared_files(
+            self,
+            inputs: Any,
+            optional_artifact: Optional[Dict] = None,
+    ) -> List[str]:
+        r"""The names of the files written by `prep_task` that are the same for all tasks.
+
+        When the key "shared_files" of `prep_image_config` is True, these
+        files are stored once in a content-addressed pool instead of in each
+        task directory. By default the files of `optional_artifact`.
+
+        Returns
+        -------
+        files: List[str]
+            A list of file names in the task directory.
+        """
+        return list(optional_artifact.keys()) if optional_artifact else []
+
+    def prep_shared(
+            self,
+            inputs: Any,
+            prepare_image_config: Optional[Dict] = None,
+            optional_input: Optional[Dict] = None,
+            optional_artifact: Optional[Dict] = None,
+    ):
+        r"""Prepare the files shared by all the tasks before the tasks are prepared.
+
+        It is called once in the working directory of the op. The files or
+        directories written to `SHARED_FILES_DIR` are output in `shared_files`
+        and are available to `RunFp` under the names recorded in the manifest
+        of the task, see `fpop.utils.shared_files.record_shared_files`.
+        By default nothing is prepared.
+        """
+        pass
+
     @OP.exec_sign_check
     def execute(
             self,
@@ -96,6 +167,9 @@ class PrepFp(OP, ABC):
             Input dict with components:
 
             - `prep_image_config` : (`dict`) It defines the parameters of the process of preparing FP tasks.
+                                The key "n_parallel" sets the number of processes used to prepare the tasks, by default 1.
+                                The key "chunk_size" sets the number of frames read from `confs` at once, by default 1000.
+                                The key "shared_files" stores the files given by `shared_files` once in a content-addressed pool instead of copying them to every task, by default False.
             - `inputs` : (`object`) The class object handels all other input files of the task. For example, pseudopotential file, k-point file and so on.
             - `type_map` : (`List[str]`) The list of elements.
             - `confs` : (`Artifact(List[Path])`) Configurations for the FP tasks. Stored in folders as formats which can be read by dpdata.System. 
@@ -107,6 +181,16 @@ class PrepFp(OP, ABC):
                                 optional_input["vasp/poscar"] is the format of the configurations that users give.
                                 Other keys in optional_input are defined by different developers.
             - `optional_artifact` : (` Artifact(Dict[str,Path])`) Other files that users or developers need.The using method of this part are defined by different developers.For example, in vasp part, all the files which are given in optional_artifact will be copied to the working directory.
+            - `input_files` : (`Artifact(List[Path])`) The files kept by reference in `inputs`, e.g. `inputs.ref_files()` of the Inputs created with `reference=True`. They are loaded by the digests of their contents when the tasks are prepared.
+            - `shard_index` : (`int`) The index of the shard prepared by this op, by default 0.
+            - `n_shards` : (`int`) The frames of `confs` are split into `n_shards` contiguous shards and only the frames of shard `shard_index` are prepared. The tasks are named by their global index, so the names are unique across the shards. By default 1.
+            - `shard_balance` : (`str`) Balance the shards by "frames" (the number of frames) or "atoms" (the number of atoms), by default "frames".
+            - `list_task_names` : (`bool`) Output the names of the tasks in `task_names`. If False, `task_names` is empty and the names are only given by `task_manifest`, which keeps the size of the workflow independent of the number of tasks. Then `write_manifest` should be True. By default True.
+            - `write_manifest` : (`bool`) Write the names of the tasks to a manifest in the directory `fpop.utils.task_manifest.TASK_MANIFEST_DIR`, output as `task_manifest`. By default False.
+            - `task_name_width` : (`int`) The number of digits of the index in the task names, by default 6, e.g. "task.000012".
+            - `task_bucket_size` : (`int`) If positive, the task directories are nested in bucket directories of `task_bucket_size` tasks, e.g. "bucket.000000/task.000012". By default 0, the task directories are flat.
+            - `group_size` : (`int`) If positive, the tasks are split into groups of at most `group_size` tasks and the groups are output as `task_groups`. The groups do not cross the shards. By default 0.
+            - `pack_size` : (`int`) If positive, the tasks are packed into zip archives of `pack_size` tasks, the archive `k` holds the tasks of global index `[k*pack_size, (k+1)*pack_size)`. The shards are aligned to the archives. By default 0, the tasks are not packed.
 
         Returns
         -------
@@ -115,37 +199,120 @@ class PrepFp(OP, ABC):
 
             - `task_names`: (`List[str]`) The name of tasks. Will be used as the identities of the tasks. The names of different tasks are different.
             - `task_paths`: (`Artifact(List[Path])`) The parepared working paths of the tasks. Contains all input files needed to start the FP. The order fo the Paths should be consistent with `op["task_names"]`
+                If `pack_size` is positive, the archives of the tasks, in the order of the archive index.
+            - `n_tasks`: (`int`) The number of tasks prepared by this op.
+            - `task_groups`: (`List[dict]`) The groups of tasks, each is a dict with the global index of the first task ("start") and the number of tasks ("count"). Empty if `group_size` is not positive.
+            - `task_manifest`: (`Artifact(List[Path])`) The manifest of the names of the tasks, see `fpop.utils.task_manifest`. Empty unless `write_manifest` is True.
+            - `shared_files`: (`Artifact(List[Path])`) The files in the pool of shared files, named by the sha256 digests of their contents, and the entries written by `prep_shared`. Empty unless "shared_files" of `prep_image_config` is True or `prep_shared` writes to the pool.
         """
-        import dpdata
-
         inputs = op_in['inputs']
         confs = op_in['confs']
         type_map = op_in['type_map']
         prepare_image_config = op_in["prep_image_config"]
         optional_artifact = op_in["optional_artifact"]
         optional_input = op_in["optional_input"]
+        input_files = op_in["input_files"]
+        register_input_files(input_files)
         try:
             conf_format = optional_input["conf_format"]
         except:
             conf_format = "deepmd/npy"
 
+        if not op_in["list_task_names"] and not op_in["write_manifest"]:
+            raise FatalError("the task names should be listed in task_names or written to the task manifest")
+
+        n_parallel = int(prepare_image_config.get("n_parallel", 1)) if prepare_image_config else 1
+        chunk_size = int(prepare_image_config.get("chunk_size", DEFAULT_CHUNK_SIZE)) if prepare_image_config else DEFAULT_CHUNK_SIZE
+
+        n_shards = op_in["n_shards"]
+        pack_size = op_in["pack_size"]
+        if n_shards > 1:
+            frame_info = [get_frame_info(system, conf_format) for system in confs]
+            begin, end = _shard_range(frame_info, op_in["shard_index"], n_shards, op_in["shard_balance"], max(pack_size, 1))
+        else:
+            frame_info = None
+            begin, end = 0, None
+
+        self.prep_shared(inputs, prepare_image_config, optional_input, optional_artifact)
+
+        task_layout = (op_in["task_name_width"], op_in["task_bucket_size"])
         task_names = []
         task_paths = []
 
-        #System
-        counter = 0
-        # loop over list of System
-        for system in confs:
-            ss = dpdata.System(system, fmt=conf_format, labeled=False)
-            for ff in range(ss.get_nframes()):
-                nn, pp = self._exec_one_frame(counter, inputs, ss[ff], prepare_image_config, optional_input, optional_artifact)
+        # the frames are streamed from confs, at most `chunk_size` frames are held in memory
+        frames = _iter_conf_frames(confs, conf_format, chunk_size, frame_info, begin, end)
+        if n_parallel > 1:
+            # the tasks are distributed to a pool of processes. the indexes
+            # are assigned before dispatching and `map` keeps the order, so
+            # the task names and paths are the same as in the serial mode.
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(
+                max_workers=n_parallel,
+                initializer=_init_prep_worker,
+                initargs=(self, inputs, prepare_image_config, optional_input, optional_artifact, task_layout, input_files),
+            ) as executor:
+                while True:
+                    batch = list(islice(frames, chunk_size))
+                    if not batch:
+                        break
+                    chunksize = max(1, len(batch) // (4 * n_parallel))
+                    for nn, pp in executor.map(_prep_worker_exec, batch, chunksize=chunksize):
+                        task_names.append(nn)
+                        task_paths.append(pp)
+        else:
+            for counter, conf_frame in frames:
+                nn, pp = self._exec_one_frame(counter, inputs, conf_frame, prepare_image_config, optional_input, optional_artifact, task_layout)
                 task_names.append(nn)
                 task_paths.append(pp)
-                counter += 1
+
+        archive_index = None
+        if pack_size > 0:
+            # the shards are aligned to the archives, so the tasks of an
+            # archive are always prepared by the same shard.
+            archive_index = list(range(begin // pack_size, (begin + len(task_paths) + pack_size - 1) // pack_size))
+            task_paths = [
+                pack_tasks(task_paths[ii*pack_size-begin:(ii+1)*pack_size-begin], task_archive_name(ii))
+                for ii in archive_index
+            ]
+
+        n_tasks = len(task_names)
+        group_size = op_in["group_size"]
+        task_groups = []
+        if group_size > 0:
+            task_groups = [
+                {"start" : ii, "count" : min(group_size, begin + n_tasks - ii)}
+                for ii in range(begin, begin + n_tasks, group_size)
+            ]
+        task_manifest = []
+        if op_in["write_manifest"]:
+            Path(TASK_MANIFEST_DIR).mkdir(exist_ok=True)
+            task_manifest = [write_task_manifest(task_names, Path(TASK_MANIFEST_DIR) / task_manifest_name(begin), begin)]
+        if not op_in["list_task_names"]:
+            task_names = []
+
+        if n_shards > 1 and self.slices.get("task_names") is not None:
+            # running as one slice of the sharded prep. the outputs are
+            # stacked in the order of the global task indexes, so that the
+            # merged task_names/task_paths are flat lists of all the tasks.
+            global_index = list(range(begin, begin + n_tasks))
+            self.slices = {
+                **self.slices,
+                "task_names" : global_index[:len(task_names)],
+                "task_paths" : global_index if archive_index is None else archive_index,
+                "task_groups" : [ii["start"] for ii in task_groups],
+            }
+
+        shared_files = []
+        if Path(SHARED_FILES_DIR).is_dir():
+            shared_files = sorted(Path(SHARED_FILES_DIR).iterdir())
 
         return OPIO({
             'task_names' : task_names,
             'task_paths' : task_paths,
+            'n_tasks' : n_tasks,
+            'shared_files' : shared_files,
+            'task_manifest' : task_manifest,
+            'task_groups' : task_groups,
         })
 
 
@@ -157,9 +324,78 @@ class PrepFp(OP, ABC):
             prepare_image_config = None,
             optional_input = None,
             optional_artifact = None,
+            task_layout = (6, 0),
     ) -> Tuple[str, Path]:
-        task_name = 'task.' + '%06d' % idx
-        task_path = Path(task_name)
+        task_name, task_path = _task_name_path(idx, *task_layout)
+        pool_dir = None
+        if prepare_image_config and prepare_image_config.get("shared_files", False):
+            pool_dir = Path(SHARED_FILES_DIR).absolute()
         with set_directory(task_path,mkdir=True):
             self.prep_task(conf_frame, inputs, prepare_image_config, optional_input, optional_artifact)
+            if pool_dir is not None:
+                pool_files(self.shared_files(inputs, optional_artifact), pool_dir)
         return task_name, task_path
+
+
+def _task_name_path(idx, width=6, bucket_size=0):
+    # the name of the task of global index idx, and the path of its
+    # directory, nested in a bucket directory if bucket_size > 0.
+    task_name = 'task.' + '%0*d' % (width, idx)
+    if bucket_size > 0:
+        return task_name, Path('bucket.%06d' % (idx // bucket_size)) / task_name
+    return task_name, Path(task_name)
+
+def _iter_conf_frames(confs, conf_format, chunk_size, frame_info=None, begin=0, end=None):
+    # enumerate the frames [begin, end) of all the systems in confs.
+    # frame_info, the number of frames of each system, is only needed
+    # to skip the systems out of the range.
+    counter = 0
+    for ii, system in enumerate(confs):
+        if end is not None and counter >= end:
+            break
+        if frame_info is not None:
+            nframes = frame_info[ii][0]
+            if counter + nframes <= begin:
+                counter += nframes
+                continue
+        start = max(begin - counter, 0)
+        stop = None if end is None else end - counter
+        counter += start
+        for conf_frame in iter_frames(system, conf_format, chunk_size, start, stop):
+            yield counter, conf_frame
+            counter += 1
+
+def _shard_range(frame_info, shard_index, n_shards, balance="frames", align=1):
+    # the range of global frame indexes [begin, end) of a shard. the
+    # shards are contiguous and balanced by the number of frames or atoms.
+    # the boundaries between the shards are multiples of align.
+    if balance == "frames":
+        weights = np.concatenate([np.ones(nf) for nf, na in frame_info] + [np.zeros(0)])
+    elif balance == "atoms":
+        weights = np.concatenate([np.full(nf, na) for nf, na in frame_info] + [np.zeros(0)])
+    else:
+        raise FatalError(f"unknown shard balance {balance}, should be frames or atoms")
+    cum_weights = np.cumsum(weights)
+    total = cum_weights[-1] if len(cum_weights) > 0 else 0.
+    begin = int(np.searchsorted(cum_weights, total * shard_index / n_shards, side="right"))
+    end = int(np.searchsorted(cum_weights, total * (shard_index + 1) / n_shards, side="right"))
+    begin = begin // align * align
+    end = end // align * align
+    if shard_index == n_shards - 1:
+        end = len(cum_weights)
+    return begin, end
+
+# the state of the worker processes used by `PrepFp.execute` in parallel mode.
+# it is set once per worker by the pool initializer, so that the op and the
+# (possibly large) inputs are not pickled for every frame.
+_prep_worker_state = None
+
+def _init_prep_worker(op, inputs, prepare_image_config, optional_input, optional_artifact, task_layout=(6, 0), input_files=None):
+    global _prep_worker_state
+    register_input_files(input_files)
+    _prep_worker_state = (op, inputs, prepare_image_config, optional_input, optional_artifact, task_layout)
+
+def _prep_worker_exec(idx_frame):
+    op, inputs, prepare_image_config, optional_input, optional_artifact, task_layout = _prep_worker_state # type: ignore
+    idx, conf_frame = idx_frame
+    return op._exec_one_frame(idx, inputs, conf_frame, prepare_image_config, optional_input, optional_artifact, task_layout)
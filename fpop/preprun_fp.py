@@ -14,7 +14,9 @@ from dflow import (
     argo_range,
     argo_len,
     argo_sequence,
+    argo_sum,
 )
+from dflow.io import ArgoVar
 from dflow.python import(
     PythonOPTemplate,
     OP,
@@ -46,6 +48,15 @@ class PrepRunFp(Steps):
         run_slice_config : Optional[dict] = None,
         run_step_config : Optional[dict] = None,
         upload_python_packages : Optional[Union[List[Path], List[str]]] = None,
+        prep_shards : int = 1,
+        prep_shard_balance : str = "frames",
+        prep_pack_size : int = 0,
+        task_manifest : bool = False,
+        task_name_width : int = 6,
+        task_bucket_size : int = 0,
+        run_group_size : int = 0,
+        run_batch_size : int = 0,
+        run_batch_pool_size : int = 1,
     ):
         self._input_parameters = {
             "inputs" : InputParameter(),
@@ -60,6 +71,7 @@ class PrepRunFp(Steps):
         self._input_artifacts = {
             "confs" : InputArtifact(),
             "optional_artifact" : InputArtifact(optional=True), 
+            "input_files" : InputArtifact(optional=True),
         }
         self._output_artifacts = {
             "backward_dirs" : OutputArtifact(),
@@ -77,7 +89,9 @@ class PrepRunFp(Steps):
         )
 
         self._keys = ['prep-fp','run-fp']
-        self.step_keys = {'prep-fp':'prep-fp','run-fp':'run-fp-{{item}}'}
+        self.step_keys = {'prep-fp':'prep-fp','run-fp':'run-fp-{{item}}','run-fp-group':'run-fp-group-{{item.start}}'}
+        if prep_shards > 1:
+            self.step_keys['prep-fp'] = 'prep-fp-{{item}}'
 
         self = _prep_run_fp(
             self,
@@ -92,6 +106,15 @@ class PrepRunFp(Steps):
             run_slice_config,
             run_step_config,
             upload_python_packages = upload_python_packages,
+            prep_shards = prep_shards,
+            prep_shard_balance = prep_shard_balance,
+            prep_pack_size = prep_pack_size,
+            task_manifest = task_manifest,
+            task_name_width = task_name_width,
+            task_bucket_size = task_bucket_size,
+            run_group_size = run_group_size,
+            run_batch_size = run_batch_size,
+            run_batch_pool_size = run_batch_pool_size,
         )
 
     @property
@@ -123,6 +146,15 @@ def _prep_run_fp(
         run_slice_config : Optional[dict] = None,
         run_step_config : Optional[dict] = None,
         upload_python_packages : Optional[Union[List[Path], List[str]]] = None,
+        prep_shards : int = 1,
+        prep_shard_balance : str = "frames",
+        prep_pack_size : int = 0,
+        task_manifest : bool = False,
+        task_name_width : int = 6,
+        task_bucket_size : int = 0,
+        run_group_size : int = 0,
+        run_batch_size : int = 0,
+        run_batch_pool_size : int = 1,
 ):
     if not prep_template_config: prep_template_config = {}
     if not prep_step_config: prep_step_config = {}
@@ -138,26 +170,65 @@ def _prep_run_fp(
     else:
         run_executor = None
 
+    prep_parameters = {
+        "prep_image_config" : prep_run_steps.inputs.parameters["prep_image_config"],
+        "inputs" : prep_run_steps.inputs.parameters["inputs"],
+        "type_map" : prep_run_steps.inputs.parameters["type_map"],
+        "optional_input" : prep_run_steps.inputs.parameters["optional_input"],
+    }
+    if prep_pack_size > 0:
+        prep_parameters["pack_size"] = prep_pack_size
+    if task_name_width != 6:
+        prep_parameters["task_name_width"] = task_name_width
+    if task_bucket_size > 0:
+        prep_parameters["task_bucket_size"] = task_bucket_size
+    if run_group_size > 0:
+        prep_parameters["group_size"] = run_group_size
+        # each group reads the names of its tasks from the manifest, the
+        # list of all the task names is not passed to every group.
+        task_manifest = True
+    if task_manifest:
+        # the task names are passed to run-fp by the manifest artifact,
+        # not by a parameter that grows with the number of tasks.
+        prep_parameters["list_task_names"] = False
+        prep_parameters["write_manifest"] = True
+    if prep_shards > 1:
+        # the frames of confs are split into prep_shards parallel prep
+        # steps. the outputs of the shards are stacked by the global task
+        # index, so run-fp sees the same flat lists as in the unsharded case.
+        prep_slices = Slices(
+            output_parameter = ["task_names", "n_tasks", "task_groups"],
+            output_artifact = ["task_paths", "shared_files", "task_manifest"],
+        )
+        prep_parameters.update({
+            "shard_index" : "{{item}}",
+            "n_shards" : prep_shards,
+            "shard_balance" : prep_shard_balance,
+        })
+        # fanned out by the arguments of the step, with_param is only given to the sharded step
+        prep_step_config = {**prep_step_config, "with_param" : argo_range(prep_shards)}
+    else:
+        prep_slices = None
+
     prep_fp = Step(
         'prep-fp' , 
         template=PythonOPTemplate(
             prep_op,
+            slices = prep_slices,
             output_artifact_archive={
-                "task_paths": None
+                "task_paths": None,
+                "shared_files": None,
+                "task_manifest": None,
             },
             python_packages = upload_python_packages, # type: ignore
             image = prep_image,
             **prep_template_config,
         ),
-        parameters={
-            "prep_image_config" : prep_run_steps.inputs.parameters["prep_image_config"],
-            "inputs" : prep_run_steps.inputs.parameters["inputs"],
-            "type_map" : prep_run_steps.inputs.parameters["type_map"],
-            "optional_input" : prep_run_steps.inputs.parameters["optional_input"],
-        },
+        parameters=prep_parameters,
         artifacts={
             "confs" : prep_run_steps.inputs.artifacts['confs'],
             "optional_artifact" : prep_run_steps.inputs.artifacts['optional_artifact'],
+            "input_files" : prep_run_steps.inputs.artifacts['input_files'],
         },
         key = step_keys['prep-fp'],
         executor = prep_executor,
@@ -165,38 +236,148 @@ def _prep_run_fp(
     )
     prep_run_steps.add(prep_fp)
 
+    if prep_shards > 1:
+        n_tasks = argo_sum(prep_fp.outputs.parameters["n_tasks"])
+    elif task_manifest:
+        n_tasks = prep_fp.outputs.parameters["n_tasks"]
+    else:
+        n_tasks = argo_len(prep_fp.outputs.parameters["task_names"])
+
+    if run_batch_size > 0 and (task_manifest or prep_pack_size > 0 or run_group_size > 0):
+        raise ValueError("run_batch_size is not supported with task_manifest, prep_pack_size or run_group_size")
+    if run_group_size > 0 and prep_shards > 1:
+        # the groups output by the shards are stacked as a list per shard,
+        # which cannot be fanned out as one flat list of groups.
+        raise ValueError("run_group_size is not supported with prep_shards")
+    if run_batch_size > 0:
+        # each run-fp pod runs a batch of run_batch_size tasks in one
+        # process, run_batch_pool_size of them at a time. the artifacts
+        # that are not sliced, e.g. shared_files, are downloaded once.
+        run_slice_config = {
+            **run_slice_config,
+            "group_size" : run_batch_size,
+            "pool_size" : run_batch_pool_size,
+        }
+
+    run_template = PythonOPTemplate(
+        run_op,
+        slices = Slices(
+            "int('{{item}}')",
+            input_parameter = ["task_name"] if not task_manifest else [],
+            input_artifact = ["task_path"] if prep_pack_size <= 0 else [],
+            output_artifact = ["backward_dir"] if run_group_size <= 0 else [],
+            **run_slice_config,
+        ),
+        python_packages = upload_python_packages, # type: ignore
+        image = run_image,
+        **run_template_config,
+    )
+    if prep_pack_size > 0:
+        # the tasks are packed in archives of prep_pack_size tasks, each
+        # slice takes the archive that holds its task.
+        run_template.add_slices(Slices(
+            "int('{{item}}') // %d" % prep_pack_size,
+            input_artifact = ["task_path"],
+        ))
+
+    if run_group_size > 0:
+        # the outputs are stacked again by run-fp-group, whose slice is
+        # appended to this one as "<task>.<group>", so it is the plain index.
+        run_template.add_slices(Slices(
+            "{{item}}",
+            output_artifact = ["backward_dir"],
+        ))
+
+    run_parameters = {
+        "run_image_config" : prep_run_steps.inputs.parameters["run_image_config"],
+        "backward_list" : prep_run_steps.inputs.parameters["backward_list"],
+        "log_name" : prep_run_steps.inputs.parameters["log_name"],
+        "backward_dir_name" : prep_run_steps.inputs.parameters["backward_dir_name"],
+        "optional_input" : prep_run_steps.inputs.parameters["optional_input"],
+    }
+    run_artifacts = {
+        "task_path" : prep_fp.outputs.artifacts['task_paths'],
+        "optional_artifact" : prep_run_steps.inputs.artifacts["optional_artifact"],
+        "shared_files" : prep_fp.outputs.artifacts["shared_files"],
+    }
+    if task_manifest:
+        run_parameters["task_index"] = "{{item}}"
+        run_artifacts["task_manifest"] = prep_fp.outputs.artifacts["task_manifest"]
+    else:
+        run_parameters["task_name"] = prep_fp.outputs.parameters["task_names"]
+    sequence_format = '%%0%dd' % task_name_width
+
+    if run_group_size <= 0:
+        run_fp = Step(
+            'run-fp',
+            template=run_template,
+            parameters=run_parameters,
+            artifacts=run_artifacts,
+            with_sequence=argo_sequence(n_tasks, format=sequence_format), # type: ignore
+            key = step_keys['run-fp'],
+            executor = run_executor,
+            **run_step_config,
+        )
+        prep_run_steps.add(run_fp)
+        prep_run_steps.outputs.artifacts["backward_dirs"]._from = run_fp.outputs.artifacts["backward_dir"]
+        return
+
+    # two-level fan-out: the groups of tasks given by prep-fp are fanned
+    # out first, and each group fans out the run-fp slices of its tasks,
+    # so no single step is expanded to all the tasks. the item of the
+    # outer step is a group, the task index is only given to the inner one.
+    group_parameters = {kk : vv for kk, vv in run_parameters.items() if kk != "task_index"}
+    run_group = Steps(
+        name = prep_run_steps.name + '-run-fp-group',
+        inputs = Inputs(
+            parameters = {
+                **{kk : InputParameter() for kk in group_parameters},
+                "group_start" : InputParameter(type=int),
+                "group_count" : InputParameter(type=int),
+            },
+            artifacts = {kk : InputArtifact(optional=(kk != "task_path")) for kk in run_artifacts},
+        ),
+        outputs = Outputs(
+            artifacts = {"backward_dirs" : OutputArtifact()},
+        ),
+    )
     run_fp = Step(
         'run-fp',
-        template=PythonOPTemplate(
-            run_op,
-            slices = Slices(
-                "int('{{item}}')",
-                input_parameter = ["task_name"],
-                input_artifact = ["task_path"],
-                output_artifact = ["backward_dir"],
-                **run_slice_config,
-            ),
-            python_packages = upload_python_packages, # type: ignore
-            image = run_image,
-            **run_template_config,
-        ),
+        template=run_template,
         parameters={
-            "run_image_config" : prep_run_steps.inputs.parameters["run_image_config"],
-            "task_name" : prep_fp.outputs.parameters["task_names"],
-            "backward_list" : prep_run_steps.inputs.parameters["backward_list"],
-            "log_name" : prep_run_steps.inputs.parameters["log_name"],
-            "backward_dir_name" : prep_run_steps.inputs.parameters["backward_dir_name"],
-            "optional_input" : prep_run_steps.inputs.parameters["optional_input"],
-        },
-        artifacts={
-            "task_path" : prep_fp.outputs.artifacts['task_paths'],
-            "optional_artifact" : prep_run_steps.inputs.artifacts["optional_artifact"],
+            **{kk : run_group.inputs.parameters[kk] for kk in group_parameters},
+            **({"task_index" : "{{item}}"} if task_manifest else {}),
         },
-        with_sequence=argo_sequence(argo_len(prep_fp.outputs.parameters["task_names"]), format='%06d'),
+        artifacts={kk : run_group.inputs.artifacts[kk] for kk in run_artifacts},
+        # the group is given by expressions of the inputs, which are cast to
+        # int, the inputs themselves are strings in the debug mode.
+        with_sequence=argo_sequence(
+            ArgoVar(run_group.inputs.parameters["group_count"].expr),
+            ArgoVar(run_group.inputs.parameters["group_start"].expr),
+            format=sequence_format,
+        ), # type: ignore
         key = step_keys['run-fp'],
         executor = run_executor,
         **run_step_config,
     )
-    prep_run_steps.add(run_fp)
+    run_group.add(run_fp)
+    run_group.outputs.artifacts["backward_dirs"]._from = run_fp.outputs.artifacts["backward_dir"]
 
-    prep_run_steps.outputs.artifacts["backward_dirs"]._from = run_fp.outputs.artifacts["backward_dir"]
+    run_fp_group = Step(
+        'run-fp-group',
+        template=run_group,
+        parameters={
+            **group_parameters,
+            "group_start" : "{{item.start}}",
+            "group_count" : "{{item.count}}",
+        },
+        artifacts=run_artifacts,
+        with_param=prep_fp.outputs.parameters["task_groups"],
+        slices=Slices(
+            "{{item.start}}",
+            output_artifact = ["backward_dirs"],
+        ),
+        key = step_keys['run-fp-group'],
+    )
+    prep_run_steps.add(run_fp_group)
+    prep_run_steps.outputs.artifacts["backward_dirs"]._from = run_fp_group.outputs.artifacts["backward_dirs"]
@@ -19,7 +19,8 @@ from dflow import (
     OutputArtifact,
     ShellOPTemplate
 )
-import os, json, shutil
+import os, json, shutil, glob, fnmatch, tempfile
+from contextlib import contextmanager
 from pathlib import Path
 from typing import (
     Any,
@@ -27,10 +28,57 @@ from typing import (
     List,
     Set,
     Dict,
+    Iterator,
     Optional,
     Union,
 )
 import numpy as np
+from fpop.utils.shared_files import (
+    resolve_shared_files,
+    cache_shared_file,
+)
+from fpop.utils.task_archive import extract_task
+from fpop.utils.task_manifest import read_task_name
+from fpop.utils.cpu_binding import (
+    CPU_BINDING_KEY,
+    bind_cpus,
+)
+from fpop.utils.launcher import (
+    LAUNCHER_KEY,
+    make_launch_command,
+)
+from fpop.utils.compression import (
+    COMPRESS_SUFFIX,
+    compress_config,
+    compress_file,
+    record_compressed,
+)
+
+# the keys of run_image_config used by RunFp, the others are passed to run_command
+RUN_IMAGE_CONFIG_KEYS = ["command", LAUNCHER_KEY, CPU_BINDING_KEY]
+# the cache of the shared files in the scratch directory, reused by the tasks run in a pod
+SCRATCH_SHARED_DIR = ".shared_files"
+# the number of bytes read from the end of an output file by `RunFp.check_tail`
+DEFAULT_TAIL_BYTES = 1 << 16
+
+def link_or_copy(
+    src : Union[str, Path],
+    dst : Union[str, Path],
+) -> Path:
+    r'''Hard link `src` to `dst`, or copy it if the link fails.
+
+    A symbolic link `src` is resolved, the target is linked. An existing
+    `dst` is replaced.
+    '''
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(os.path.realpath(src), dst)
+    except OSError:
+        # e.g. across devices, or not supported by the filesystem
+        shutil.copyfile(src, dst)
+    return Path(dst)
+
 
 class RunFp(OP, ABC):
     r'''Execute a first-principles (FP) task.
@@ -43,14 +91,17 @@ class RunFp(OP, ABC):
     def get_input_sign(cls):
         return OPIOSign(
             {
-                "task_name": str,
+                "task_name": Parameter(str,default=''),
+                "task_index": Parameter(str,default=''),
+                "task_manifest": Artifact(List[Path],optional=True),
                 "task_path": Artifact(Path),
                 "backward_list": List[str],
                 "log_name": Parameter(str,default='log'),
                 "backward_dir_name": Parameter(str,default='backward_dir'),
                 "run_image_config": BigParameter(dict,default={}),
                 "optional_artifact": Artifact(Dict[str,Path],optional=True),
-                "optional_input": BigParameter(dict,default={})
+                "optional_input": BigParameter(dict,default={}),
+                "shared_files": Artifact(List[Path],optional=True),
             }
         )
 
@@ -71,6 +122,238 @@ class RunFp(OP, ABC):
         '''
         return os.listdir(task_path)
 
+    @staticmethod
+    def run_command_kwargs(
+        run_image_config : Optional[Dict] = None,
+    ) -> Dict:
+        r'''The keyword args of `run_command` to run the engine, given by the
+        keys of run_image_config other than `RUN_IMAGE_CONFIG_KEYS`.
+        '''
+        kwargs = {"try_bash": True, "shell": True}
+        if run_image_config:
+            kwargs.update({kk : vv for kk, vv in run_image_config.items() if kk not in RUN_IMAGE_CONFIG_KEYS})
+        return kwargs
+
+    @staticmethod
+    @contextmanager
+    def engine_command(
+        run_image_config : Optional[Dict],
+        log_name : str,
+        default_command : Optional[str] = None,
+    ) -> Iterator[str]:
+        r'''The command to run the engine, with the output redirected to the log.
+
+        The command line is built from run_image_config["launcher"] if given
+        (see `fpop.utils.launcher.make_launch_command`), where the ranks and
+        threads fit the cpus available at runtime. Otherwise it is
+        run_image_config["command"] or `default_command`. If
+        run_image_config["cpu_binding"] is given, the command is bound to a
+        cpu slot for the duration of the context, and the launcher fits the
+        cpus of the slot (see `fpop.utils.cpu_binding.bind_cpus`).
+
+        Parameters
+        ----------
+        run_image_config:
+            The runtime configuration of the task.
+        log_name:
+            The name of log file.
+        default_command:
+            The command if neither the launcher nor the command is given.
+        '''
+        run_image_config = run_image_config or {}
+        spec = run_image_config.get(LAUNCHER_KEY)
+        command = run_image_config.get("command") or default_command
+        if spec:
+            def _build(cpus):
+                return " ".join([make_launch_command(spec, len(cpus) if cpus else None), ">", log_name])
+        elif command:
+            base_command = command
+            def _build(cpus):
+                return " ".join([base_command, ">", log_name])
+        else:
+            raise ValueError("command or launcher should be given in run_image_config")
+        with bind_cpus(_build, run_image_config.get(CPU_BINDING_KEY)) as cmd:
+            yield cmd
+
+    @staticmethod
+    def read_tail(
+        fname : Union[str, Path],
+        max_bytes : int = DEFAULT_TAIL_BYTES,
+    ) -> List[str]:
+        r'''Read the last lines of a file, at most `max_bytes` bytes from its end.
+
+        Parameters
+        ----------
+        fname:
+            The name of the file.
+        max_bytes:
+            The maximum number of bytes read. The first line is dropped if it
+            is cut by the bound.
+
+        Returns
+        -------
+        lines: List[str]
+            The lines, with the line breaks kept as `readlines()`.
+        '''
+        with open(fname, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            start = max(0, size - max_bytes)
+            f.seek(start)
+            tail = f.read()
+        lines = tail.decode(errors="replace").splitlines(keepends=True)
+        if start > 0 and lines:
+            lines = lines[1:]
+        return lines
+
+    @staticmethod
+    def check_tail(
+        fname : Union[str, Path],
+        signatures : Union[str, List[str]],
+        last_line : bool = False,
+        max_bytes : int = DEFAULT_TAIL_BYTES,
+    ) -> bool:
+        r'''Check if one of the signatures appears at the end of a file.
+
+        Only the last `max_bytes` bytes of the file are read, so the check
+        does not depend on the size of the output.
+
+        Parameters
+        ----------
+        fname:
+            The name of the file.
+        signatures:
+            The signature(s) of a successful task.
+        last_line:
+            Only search the last line of the file.
+        max_bytes:
+            The maximum number of bytes read from the end of the file.
+
+        Returns
+        -------
+        success: bool
+            True if a signature is found, False otherwise or if the file does not exist.
+        '''
+        if isinstance(signatures, str):
+            signatures = [signatures]
+        if not os.path.isfile(fname):
+            return False
+        lines = RunFp.read_tail(fname, max_bytes)
+        if last_line:
+            lines = lines[-1:]
+        return any(ss in line for line in lines for ss in signatures)
+
+    @staticmethod
+    def collect_backward(
+        backward_list : List[str],
+        backward_dir_name : Union[str, Path],
+        patterns : Optional[List[str]] = None,
+        link : bool = True,
+        compress : Optional[Union[str, Dict]] = None,
+    ):
+        r'''Collect the output files the users need to the backward directory.
+
+        The files are hard linked to the backward directory, so no data is
+        duplicated. They are copied if the link fails, e.g. when the backward
+        directory is on another device. If `compress` is given, the files not
+        smaller than the threshold are compressed to the backward directory in
+        a stream instead, named with the suffix of the method (e.g. OUTCAR.gz).
+        They are read by `fpop.utils.compression.open_backward`, and recorded
+        in a manifest in the backward directory, so that only they are
+        decompressed by `fpop.utils.compression.decompress_dir`.
+
+        Parameters
+        ----------
+        backward_list:
+            The output files or directories. Glob patterns, e.g. "OUT.*", are
+            expanded, and the entries are collected under the same relative path.
+        backward_dir_name:
+            The backward directory.
+        patterns:
+            Only the files matching one of the glob patterns are retained from
+            the directories, matched against the name of a file or its path
+            relative to the directory, e.g. ["running_*.log", "STRU_*"]. All the
+            files are retained if it is not given.
+        link:
+            Hard link the files if possible, otherwise always copy them.
+        compress:
+            The compression of the files, see `fpop.utils.compression.compress_config`,
+            e.g. {"method": "zstd", "threshold": 1048576}.
+        '''
+        def _retained(fname, rel):
+            return not patterns or any(fnmatch.fnmatch(fname, pp) or fnmatch.fnmatch(rel, pp) for pp in patterns)
+        transfer_file = link_or_copy if link else shutil.copyfile
+        compress = compress_config(compress)
+        compressed = []
+        def collect_file(src, dst):
+            if compress is not None and os.path.getsize(src) >= compress["threshold"]:
+                compressed.append(compress_file(src, str(dst) + COMPRESS_SUFFIX[compress["method"]], compress["method"], compress["level"]))
+                return compressed[-1]
+            return transfer_file(src, dst)
+        def collect_dir(src, dst):
+            # merged into an existing dst, e.g. collected by a previous try
+            for root, dirs, files in os.walk(src, followlinks=True):
+                rel_root = Path(root).relative_to(src)
+                (Path(dst) / rel_root).mkdir(parents=True, exist_ok=True)
+                for ff in sorted(files):
+                    if _retained(ff, (rel_root / ff).as_posix()):
+                        collect_file(os.path.join(root, ff), Path(dst) / rel_root / ff)
+        for ii in backward_list:
+            names = sorted(glob.glob(ii)) if glob.has_magic(ii) else [ii]
+            for nn in names:
+                target = Path(backward_dir_name) / nn
+                target.parent.mkdir(parents=True, exist_ok=True)
+                if os.path.isdir(nn):
+                    collect_dir(nn, target)
+                else:
+                    collect_file(nn, target)
+        if compressed:
+            # only the recorded files are decompressed by `fpop.utils.compression.decompress_dir`
+            record_compressed(backward_dir_name, compressed)
+
+    @staticmethod
+    def stage_inputs(
+        input_files : List[Tuple[str, Path]],
+        opt_input_files : List[Tuple[str, Path]],
+        copy : bool = False,
+        shared_files : Optional[List[Path]] = None,
+        cache_dir : Optional[Union[str, Path]] = None,
+    ):
+        r'''Stage the input files of a task to the current directory.
+
+        Parameters
+        ----------
+        input_files:
+            The names and the paths of the mandatory input files.
+        opt_input_files:
+            The names and the paths of the optional input files, skipped if they do not exist.
+        copy:
+            Copy the files instead of linking them, e.g. to a local scratch directory.
+        shared_files:
+            The absolute paths of the pool of shared files. When the files are copied, the files of the
+            pool are copied once to `cache_dir` and linked from there, so they are
+            reused by the following tasks in the same pod.
+        cache_dir:
+            The directory of the cached shared files.
+        '''
+        for iname, ii in input_files:
+            if not os.path.exists(ii):
+                raise FatalError(f"cannot file file/directory {ii}")
+        pool = set([Path(ii).resolve() for ii in (shared_files or [])]) if cache_dir else set()
+        for iname, ii in input_files + [(nn, pp) for nn, pp in opt_input_files if os.path.exists(pp)]:
+            if not copy:
+                Path(iname).symlink_to(ii)
+            elif cache_dir is not None and Path(ii).resolve() in pool:
+                cached = cache_shared_file(ii, cache_dir).absolute()
+                if cached.is_dir():
+                    Path(iname).symlink_to(cached)
+                else:
+                    link_or_copy(cached, iname)
+            elif os.path.isdir(ii):
+                shutil.copytree(ii, iname)
+            else:
+                shutil.copyfile(ii, iname)
+
     @abstractmethod
     def run_task(
         self,
@@ -116,12 +399,14 @@ class RunFp(OP, ABC):
         ----------
         op_in : dict
             Input dict with components:
-            - `task_name`: (`str`) The name of task.
-            - `task_path`: (`Artifact(Path)`) The path that contains all input files prepareed by `PrepFp`.
+            - `task_name`: (`str`) The name of task. If not given, it is read from `task_manifest`.
+            - `task_index`: (`str`) The global index of the task in `task_manifest`, e.g. "000012".
+            - `task_manifest`: (`Artifact(List[Path])`) The manifests of the task names output by `PrepFp`.
+            - `task_path`: (`Artifact(Path)`) The path that contains all input files prepareed by `PrepFp`. Or the archive that packs the task, then only the task `task_name` is extracted from it.
             - `backward_list`: (`List[str]`) The output files the users need.
             - `log_name`: (`str`) The name of log file.
             - `backward_dir_name`: (`str`) The name of the directory which contains the backward files.
-            - `run_image_config`: (`dict`) It defines the runtime configuration of the FP task.
+            - `run_image_config`: (`dict`) It defines the runtime configuration of the FP task. run_image_config["launcher"] builds the command line that fits the cpus of the pod, see `RunFp.engine_command`. run_image_config["cpu_binding"] binds the tasks run concurrently in a pod, e.g. a batch of tasks run by a pool, to disjoint sets of cpus or NUMA nodes, see `fpop.utils.cpu_binding.bind_cpus`.
             - `optional_artifact` : (`Artifact(Dict[str,Path])`) Other files that users or developers need.Other files that users or developers need.The using method of this part are defined by different developers.For example, in vasp part, all the files which are given in optional_artifact will be copied to the working directory.
             - `optional_input` : (`dict`) Other parameters the developers or users may need.For example:
                                 {
@@ -129,6 +414,8 @@ class RunFp(OP, ABC):
                                 }
                                 optional_input["vasp/poscar"] is the format of the configurations that users give.
                                 Other keys in optional_input are defined by different developers.
+                                If optional_input["scratch_dir"] is given, e.g. a tmpfs or a local disk, the input files are copied to a temporary directory in it and the task runs there. Only the backward directory is moved to the working directory `task_name`, and the temporary directory is removed whether the task succeeds or not. The log of a failed task is kept in the working directory. The files in `shared_files` are copied once to the scratch directory and reused by the tasks run in the same pod, e.g. a batch of tasks.
+            - `shared_files`: (`Artifact(List[Path])`) The pool of shared files output by `PrepFp`. The files of the task that are stored in the pool are linked under their original names before the task runs.
         Returns
         -------
             Output dict with components:
@@ -146,28 +433,63 @@ class RunFp(OP, ABC):
         backward_list = op_in["backward_list"]
         optional_input = op_in["optional_input"]
         task_name = op_in["task_name"]
+        if not task_name:
+            if not op_in["task_manifest"] or not op_in["task_index"]:
+                raise FatalError("task_name or task_manifest and task_index should be given")
+            task_name = read_task_name(op_in["task_manifest"], int(op_in["task_index"]))
         task_path = op_in["task_path"]
+        if Path(task_path).is_file():
+            # the tasks are packed by PrepFp
+            task_path = extract_task(task_path, task_name, "unpacked_inputs")
+        # the files stored in the pool of shared files are linked back to a staged task directory
+        task_path = resolve_shared_files(task_path, op_in["shared_files"], Path("staged_inputs") / task_name)
         input_files = self.input_files(task_path)
-        input_files = [(Path(task_path) / ii).resolve() for ii in input_files]
+        # the names are kept, the pooled shared files are named by their digests
+        input_files = [(Path(ii).name, (Path(task_path) / ii).resolve()) for ii in input_files]
         work_dir = Path(task_name)
         opt_input_files = []
         if op_in["optional_artifact"]:
             for ss,vv in op_in["optional_artifact"].items():
                 opt_input_files.append(ss)
-        opt_input_files = [(Path(task_path) / ii).resolve() for ii in opt_input_files]
-
-        with set_directory(work_dir,mkdir=True):
-            # link input files
-            for ii in input_files:
-                if not os.path.exists(ii):
-                    raise FatalError(f"cannot file file/directory {ii}")
-                iname = ii.name
-                Path(iname).symlink_to(ii)
-            for ii in opt_input_files:
-                if os.path.exists(ii):
-                    iname = ii.name
-                    Path(iname).symlink_to(ii)
-            backward_dir_name = self.run_task(backward_dir_name,log_name,backward_list,run_image_config,optional_input)
+        opt_input_files = [(Path(ii).name, (Path(task_path) / ii).resolve()) for ii in opt_input_files]
+
+        scratch_dir = optional_input.get("scratch_dir") if optional_input else None
+        if not scratch_dir:
+            with set_directory(work_dir,mkdir=True):
+                self.stage_inputs(input_files, opt_input_files)
+                backward_dir_name = self.run_task(backward_dir_name,log_name,backward_list,run_image_config,optional_input)
+        else:
+            # the task runs in the scratch directory, only the backward directory is moved back
+            out_dir = work_dir.absolute()
+            out_dir.mkdir(parents=True, exist_ok=True)
+            scratch_dir = Path(scratch_dir).absolute()
+            scratch_dir.mkdir(parents=True, exist_ok=True)
+            run_dir = Path(tempfile.mkdtemp(prefix=Path(task_name).name + ".", dir=scratch_dir))
+            shared_files = [Path(ii).resolve() for ii in (op_in["shared_files"] or [])]
+            try:
+                with set_directory(run_dir):
+                    self.stage_inputs(
+                        input_files, opt_input_files, copy=True,
+                        shared_files=shared_files,
+                        cache_dir=scratch_dir / SCRATCH_SHARED_DIR,
+                    )
+                    try:
+                        backward_dir_name = self.run_task(backward_dir_name,log_name,backward_list,run_image_config,optional_input)
+                    except:
+                        # keep the log of the failed task
+                        if os.path.isfile(log_name):
+                            shutil.copyfile(log_name, out_dir / log_name)
+                        raise
+                # replace the backward directory left by a previous try, a
+                # move into an existing directory would nest it
+                target = out_dir / backward_dir_name
+                if target.is_dir() and not target.is_symlink():
+                    shutil.rmtree(target)
+                elif os.path.lexists(target):
+                    os.remove(target)
+                shutil.move(str(run_dir / backward_dir_name), str(target))
+            finally:
+                shutil.rmtree(run_dir, ignore_errors=True)
 
         return OPIO(
             {
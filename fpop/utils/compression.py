@@ -0,0 +1,239 @@
+import os, io, shutil, gzip
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    IO,
+    List,
+    Optional,
+    Union,
+)
+
+# the suffixes of the compressed files
+COMPRESS_SUFFIX = {
+    "gzip" : ".gz",
+    "zstd" : ".zst",
+}
+# the files smaller than the threshold (in bytes) are not compressed by default
+DEFAULT_COMPRESS_THRESHOLD = 1 << 20
+# the size of the chunks streamed through the compressor
+_CHUNK_SIZE = 1 << 20
+# the manifest of the files compressed in a backward directory, see `record_compressed`
+COMPRESSED_MANIFEST = ".compressed_files"
+
+def _zstandard():
+    try:
+        import zstandard # type: ignore
+    except ImportError:
+        raise ImportError("the zstd compression requires the zstandard package, install it by `pip install zstandard`")
+    return zstandard
+
+
+def compress_config(
+        config : Optional[Union[str, Dict[str, Any]]],
+) -> Optional[Dict[str, Any]]:
+    r"""Normalize the configuration of the compression.
+
+    Parameters
+    ----------
+    config : str or Dict, optional
+        The method ("gzip" or "zstd"), or a dict with keys "method",
+        "threshold" (in bytes, the smaller files are not compressed) and
+        "level" (the compression level of the method). None means no
+        compression.
+
+    Returns
+    -------
+    config : Dict, optional
+        The dict with all the keys.
+    """
+    if not config:
+        return None
+    if isinstance(config, str):
+        config = {"method" : config}
+    method = config.get("method", "gzip")
+    if method not in COMPRESS_SUFFIX:
+        raise ValueError(f"unknown compression method {method}, should be one of {list(COMPRESS_SUFFIX.keys())}")
+    return {
+        "method" : method,
+        "threshold" : config.get("threshold", DEFAULT_COMPRESS_THRESHOLD),
+        "level" : config.get("level", None),
+    }
+
+
+def compress_file(
+        src : Union[str, Path],
+        dst : Union[str, Path],
+        method : str = "gzip",
+        level : Optional[int] = None,
+) -> Path:
+    r"""Compress `src` to `dst` in a stream, the content is never loaded at once.
+
+    Parameters
+    ----------
+    src : str or Path
+        The file to compress.
+    dst : str or Path
+        The compressed file.
+    method : str
+        "gzip" or "zstd".
+    level : int, optional
+        The compression level, the default of the method if not given.
+
+    Returns
+    -------
+    dst : Path
+        The compressed file.
+    """
+    with open(src, "rb") as fin:
+        if method == "gzip":
+            with gzip.open(dst, "wb", compresslevel=6 if level is None else level) as fout:
+                shutil.copyfileobj(fin, fout, _CHUNK_SIZE)
+        elif method == "zstd":
+            zstandard = _zstandard()
+            cctx = zstandard.ZstdCompressor(level=3 if level is None else level)
+            with open(dst, "wb") as fout:
+                cctx.copy_stream(fin, fout, read_size=_CHUNK_SIZE, write_size=_CHUNK_SIZE)
+        else:
+            raise ValueError(f"unknown compression method {method}")
+    return Path(dst)
+
+
+def compressed_name(
+        fname : Union[str, Path],
+) -> Optional[Path]:
+    r"""The compressed file of `fname` if it exists, e.g. OUTCAR.gz of OUTCAR."""
+    for suffix in COMPRESS_SUFFIX.values():
+        cname = Path(str(fname) + suffix)
+        if cname.is_file():
+            return cname
+    return None
+
+
+def open_backward(
+        fname : Union[str, Path],
+        mode : str = "rb",
+) -> Union[gzip.GzipFile, IO]:
+    r"""Open a backward file for reading, decompressed transparently.
+
+    If `fname` does not exist, its compressed file, e.g. `fname.gz` or
+    `fname.zst`, is opened. A file with the suffix of a compression method
+    is also decompressed.
+
+    Parameters
+    ----------
+    fname : str or Path
+        The name of the file, without the suffix of the compression.
+    mode : str
+        "rb" or "r".
+
+    Returns
+    -------
+    f : file object
+        The decompressed stream.
+    """
+    if mode not in ["r", "rb"]:
+        raise ValueError(f"the backward files are opened for reading, got mode {mode}")
+    fname = Path(fname)
+    if not fname.is_file():
+        cname = compressed_name(fname)
+        if cname is None:
+            raise FileNotFoundError(f"cannot find {fname} or its compressed file")
+        fname = cname
+    if fname.suffix == COMPRESS_SUFFIX["gzip"]:
+        return gzip.open(fname, "rt" if mode == "r" else "rb")
+    if fname.suffix == COMPRESS_SUFFIX["zstd"]:
+        zstandard = _zstandard()
+        f = zstandard.open(fname, "rb")
+        if mode == "r":
+            return io.TextIOWrapper(f)
+        return f
+    return open(fname, mode)
+
+
+def decompress_file(
+        fname : Union[str, Path],
+        dst : Optional[Union[str, Path]] = None,
+        remove : bool = True,
+) -> Path:
+    r"""Decompress a file written by `compress_file` in a stream.
+
+    Parameters
+    ----------
+    fname : str or Path
+        The compressed file.
+    dst : str or Path, optional
+        The decompressed file, `fname` without the suffix if not given.
+    remove : bool
+        Remove the compressed file.
+
+    Returns
+    -------
+    dst : Path
+        The decompressed file.
+    """
+    fname = Path(fname)
+    if dst is None:
+        dst = fname.with_suffix("")
+    with open_backward(fname) as fin, open(dst, "wb") as fout:
+        shutil.copyfileobj(fin, fout, _CHUNK_SIZE)
+    if remove:
+        os.remove(fname)
+    return Path(dst)
+
+
+def record_compressed(
+        path : Union[str, Path],
+        files : List[Union[str, Path]],
+) -> Path:
+    r"""Record the compressed files of a backward directory, see `decompress_dir`.
+
+    The paths relative to `path` are appended to the manifest
+    `COMPRESSED_MANIFEST` in `path`, one per line.
+
+    Parameters
+    ----------
+    path : str or Path
+        The backward directory.
+    files : List
+        The compressed files in `path`.
+
+    Returns
+    -------
+    manifest : Path
+        The manifest.
+    """
+    manifest = Path(path) / COMPRESSED_MANIFEST
+    with open(manifest, "a") as f:
+        for ff in files:
+            f.write(Path(os.path.relpath(ff, path)).as_posix() + "\n")
+    return manifest
+
+
+def decompress_dir(
+        path : Union[str, Path],
+        remove : bool = True,
+) -> List[Path]:
+    r"""Decompress the files compressed by `RunFp.collect_backward` in a backward directory in place.
+
+    Only the files recorded in the manifest by `record_compressed` are
+    decompressed, other compressed files in the directory are kept as they
+    are. The manifest is removed with the compressed files.
+
+    Returns
+    -------
+    files : List[Path]
+        The decompressed files.
+    """
+    manifest = Path(path) / COMPRESSED_MANIFEST
+    if not manifest.is_file():
+        return []
+    ret = []
+    for ff in sorted(set([ii for ii in manifest.read_text().splitlines() if ii])):
+        fname = Path(path) / ff
+        # a file of a previous try may have been collected again
+        if fname.is_file():
+            ret.append(decompress_file(fname, remove=remove))
+    if remove:
+        os.remove(manifest)
+    return ret
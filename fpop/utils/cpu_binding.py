@@ -0,0 +1,263 @@
+import os, time, shlex, fcntl, tempfile
+import numpy as np
+from contextlib import contextmanager
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Union,
+)
+
+# the key of the cpu binding in run_image_config, not passed to run_command
+CPU_BINDING_KEY = "cpu_binding"
+# the methods to bind a command to a cpu slot
+CPU_BINDING_METHODS = ["taskset", "numactl", "none"]
+# the directory of the lock files of the slots, shared by the tasks run in a pod
+DEFAULT_CPU_SLOTS_DIR = os.path.join(tempfile.gettempdir(), "fpop_cpu_slots")
+# the interval (in seconds) to poll the slots when all of them are taken
+_POLL_INTERVAL = 1.
+# the sysfs directory of the NUMA nodes
+NUMA_NODES_DIR = "/sys/devices/system/node"
+
+def format_cpu_list(
+        cpus : List[int],
+) -> str:
+    r"""Format cpus in the list format of taskset, e.g. [0, 1, 2, 5] -> "0-2,5"."""
+    ranges = []
+    for cc in sorted(cpus):
+        if ranges and cc == ranges[-1][1] + 1:
+            ranges[-1][1] = cc
+        else:
+            ranges.append([cc, cc])
+    return ",".join(["%d" % ii if ii == jj else "%d-%d" % (ii, jj) for ii, jj in ranges])
+
+
+def parse_cpu_list(
+        cpu_list : str,
+) -> List[int]:
+    r"""Parse a cpu list, e.g. "0-2,5" -> [0, 1, 2, 5]."""
+    cpus = []
+    for ii in cpu_list.strip().split(","):
+        if not ii:
+            continue
+        if "-" in ii:
+            start, end = ii.split("-")
+            cpus += list(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(ii))
+    return cpus
+
+
+def numa_nodes(
+        nodes_dir : Union[str, Path] = NUMA_NODES_DIR,
+) -> Dict[int, List[int]]:
+    r"""The cpus of each NUMA node that the process may run on, read from sysfs.
+
+    The cpus of a node are intersected with the affinity of the process,
+    e.g. limited by the cpuset of the container, and the nodes without such
+    cpus are dropped. One node 0 with all the cpus if not available.
+
+    Parameters
+    ----------
+    nodes_dir : str or Path
+        The sysfs directory of the NUMA nodes.
+
+    Returns
+    -------
+    nodes : Dict[int, List[int]]
+        The cpus of each node, by the index of the node.
+    """
+    affinity = os.sched_getaffinity(0)
+    nodes = sorted(
+        Path(nodes_dir).glob("node[0-9]*"),
+        key=lambda pp: int(pp.name[4:]),
+    )
+    ret = {}
+    for nn in nodes:
+        if (nn / "cpulist").is_file():
+            cpus = [ii for ii in parse_cpu_list((nn / "cpulist").read_text()) if ii in affinity]
+            if cpus:
+                ret[int(nn.name[4:])] = cpus
+    if not ret:
+        ret = {0 : sorted(affinity)}
+    return ret
+
+
+def cpu_slots(
+        nslots : int,
+        cpus : Optional[List[int]] = None,
+) -> List[List[int]]:
+    r"""Split the cpus into `nslots` disjoint contiguous slots.
+
+    Parameters
+    ----------
+    nslots : int
+        The number of slots.
+    cpus : List[int], optional
+        The cpus, the cpus that the process may run on if not given.
+
+    Returns
+    -------
+    slots : List[List[int]]
+        The cpus of each slot.
+    """
+    if cpus is None:
+        cpus = sorted(os.sched_getaffinity(0))
+    if nslots < 1 or nslots > len(cpus):
+        raise ValueError(f"cannot split {len(cpus)} cpus into {nslots} slots")
+    return [list(ii) for ii in np.array_split(np.array(cpus, dtype=int), nslots)]
+
+
+class CpuSlot():
+    def __init__(
+            self,
+            index : int,
+            cpus : List[int],
+            numa_node : Optional[int] = None,
+    ):
+        r"""A set of cpus that one task runs on.
+
+        Parameters
+        ----------
+        index : int
+            The index of the slot.
+        cpus : List[int]
+            The cpus of the slot.
+        numa_node : int, optional
+            The NUMA node of the slot, if the slots are NUMA nodes.
+        """
+        self.index = index
+        self.cpus = cpus
+        self.numa_node = numa_node
+
+    def pin(
+            self,
+            command : str,
+            method : str = "taskset",
+    ) -> str:
+        r"""Bind a shell command to the slot.
+
+        The placeholders "{cpus}" (the cpu list, e.g. "0-15"), "{ncpus}" and
+        "{numa_node}" in the command are replaced, so that e.g. the binding
+        flags of mpirun can be given in the command. The command is then run
+        by `taskset` or `numactl` in a bash, unless `method` is "none".
+        """
+        cpu_list = format_cpu_list(self.cpus)
+        command = command.replace("{cpus}", cpu_list).replace("{ncpus}", str(len(self.cpus)))
+        if self.numa_node is not None:
+            command = command.replace("{numa_node}", str(self.numa_node))
+        if method == "taskset":
+            return "taskset -c %s bash -c %s" % (cpu_list, shlex.quote(command))
+        elif method == "numactl":
+            if self.numa_node is None:
+                return "numactl --physcpubind=%s bash -c %s" % (cpu_list, shlex.quote(command))
+            return "numactl --cpunodebind=%d --membind=%d bash -c %s" % (self.numa_node, self.numa_node, shlex.quote(command))
+        elif method == "none":
+            return command
+        raise ValueError(f"unknown cpu binding method {method}, should be one of {CPU_BINDING_METHODS}")
+
+
+@contextmanager
+def acquire_cpu_slot(
+        slots : List[CpuSlot],
+        lock_dir : Union[str, Path] = DEFAULT_CPU_SLOTS_DIR,
+        timeout : Optional[float] = None,
+) -> Iterator[CpuSlot]:
+    r"""Take a free slot for the duration of the context.
+
+    The slots are taken by locking files in `lock_dir`, so the tasks run
+    concurrently in a pod, e.g. by the pool of a batch of tasks, never share
+    a slot. If all the slots are taken, wait until one is released.
+
+    Parameters
+    ----------
+    slots : List[CpuSlot]
+        The slots.
+    lock_dir : str or Path
+        The directory of the lock files, shared by the concurrent tasks.
+    timeout : float, optional
+        Raise TimeoutError if no slot is free after `timeout` seconds.
+    """
+    lock_dir = Path(lock_dir)
+    lock_dir.mkdir(parents=True, exist_ok=True)
+    start = time.monotonic()
+    while True:
+        for slot in slots:
+            f = open(lock_dir / ("slot.%d.lock" % slot.index), "w")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                continue
+            try:
+                yield slot
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+                f.close()
+            return
+        if timeout is not None and time.monotonic() - start > timeout:
+            raise TimeoutError(f"no free cpu slot in {lock_dir} after {timeout} seconds")
+        time.sleep(_POLL_INTERVAL)
+
+
+def make_cpu_slots(
+        config : Dict[str, Any],
+) -> List[CpuSlot]:
+    r"""The cpu slots defined by the cpu binding config, see `bind_cpus`."""
+    method = config.get("method", "taskset")
+    if method not in CPU_BINDING_METHODS:
+        raise ValueError(f"unknown cpu binding method {method}, should be one of {CPU_BINDING_METHODS}")
+    if config.get("numa", False):
+        nodes = list(numa_nodes().items())
+        nslots = config.get("slots", len(nodes))
+        if nslots > len(nodes):
+            raise ValueError(f"cannot bind {nslots} slots to {len(nodes)} NUMA nodes")
+        return [CpuSlot(ii, nodes[ii][1], nodes[ii][0]) for ii in range(nslots)]
+    if "slots" not in config:
+        raise ValueError("the number of slots should be given in the cpu binding config")
+    cpus = config.get("cpus")
+    if isinstance(cpus, str):
+        cpus = parse_cpu_list(cpus)
+    return [CpuSlot(ii, cc) for ii, cc in enumerate(cpu_slots(config["slots"], cpus))]
+
+
+@contextmanager
+def bind_cpus(
+        command : Union[str, Callable[[Optional[List[int]]], str]],
+        config : Optional[Dict[str, Any]],
+) -> Iterator[str]:
+    r"""Bind a command to a free cpu slot for the duration of the context.
+
+    Parameters
+    ----------
+    command : str or Callable
+        The shell command, or a function that builds the command from the
+        cpus of the slot (None if the command is not bound), e.g. to fit the
+        number of MPI ranks to the slot.
+    config : Dict, optional
+        The cpu binding, `run_image_config["cpu_binding"]`, with keys
+        - "slots": The number of concurrent tasks in a pod, each runs on a disjoint set of cpus. Typically the pool size of the batch of tasks.
+        - "cpus": The cpus split into the slots, e.g. "0-127". All the cpus that the process may run on if not given.
+        - "numa": Each slot is a NUMA node, with the cpus of the node that the process may run on (see `numa_nodes`). "slots" defaults to the number of such NUMA nodes.
+        - "method": "taskset" (default), "numactl" or "none". With "none" the command is not wrapped, the binding is done by the placeholders "{cpus}", "{ncpus}" and "{numa_node}" in the command, e.g. the flags of mpirun.
+        - "lock_dir": The directory of the lock files of the slots.
+        - "timeout": The seconds to wait for a free slot.
+        The command is unchanged if not given.
+
+    Yields
+    ------
+    command : str
+        The command bound to the slot.
+    """
+    if not config:
+        yield command(None) if callable(command) else command
+        return
+    slots = make_cpu_slots(config)
+    with acquire_cpu_slot(slots, config.get("lock_dir", DEFAULT_CPU_SLOTS_DIR), config.get("timeout")) as slot:
+        if callable(command):
+            command = command(slot.cpus)
+        yield slot.pin(command, config.get("method", "taskset"))
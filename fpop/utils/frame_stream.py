@@ -0,0 +1,252 @@
+import os, glob
+import numpy as np
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+# number of frames read from the disk at once
+DEFAULT_CHUNK_SIZE = 1000
+
+def iter_frames(
+        system : Union[str, Path],
+        fmt : str = "deepmd/npy",
+        chunk_size : int = DEFAULT_CHUNK_SIZE,
+        start : int = 0,
+        stop : Optional[int] = None,
+):
+    r"""Iterate over the frames of a configuration without loading the whole system.
+
+    The `deepmd/npy` and `deepmd/hdf5` formats are read in chunks of
+    `chunk_size` frames. The `.npy` files are memory-mapped, so only the
+    frames of the current chunk are held in memory. Other formats are
+    loaded by `dpdata.System` and sliced frame by frame.
+
+    Parameters
+    ----------
+    system : str or Path
+        The path to the configuration.
+    fmt : str
+        The format of the configuration, the same as `dpdata.System`.
+    chunk_size : int
+        The number of frames read at once.
+    start : int
+        The index of the first frame to yield.
+    stop : int, optional
+        The frames from index `stop` on are not yielded. By default all the
+        frames after `start` are yielded.
+
+    Yields
+    ------
+    conf_frame : dpdata.System
+        One frame of configuration in the dpdata format.
+    """
+    import dpdata
+
+    if fmt in ["deepmd/npy", "deepmd/comp"]:
+        chunks = _iter_deepmd_npy_chunks(str(system), chunk_size, start, stop)
+    elif fmt == "deepmd/hdf5":
+        chunks = _iter_deepmd_hdf5_chunks(str(system), chunk_size, start, stop)
+    else:
+        ss = dpdata.System(system, fmt=fmt, labeled=False)
+        nframes = ss.get_nframes()
+        stop = nframes if stop is None else min(stop, nframes)
+        for ff in range(start, stop):
+            yield ss[ff]
+        return
+
+    for type_data, cells, coords in chunks:
+        for ff in range(coords.shape[0]):
+            data = {
+                "atom_names" : list(type_data["atom_names"]),
+                "atom_numbs" : list(type_data["atom_numbs"]),
+                "atom_types" : type_data["atom_types"],
+                "orig" : np.zeros(3),
+                "cells" : cells[ff:ff+1],
+                "coords" : coords[ff:ff+1],
+            }
+            if type_data.get("nopbc", False):
+                data["nopbc"] = True
+            yield dpdata.System(data=data)
+
+
+def get_frame_info(
+        system : Union[str, Path],
+        fmt : str = "deepmd/npy",
+) -> Tuple[int, int]:
+    r"""Get the number of frames and the number of atoms of a configuration.
+
+    For the `deepmd/npy` and `deepmd/hdf5` formats only the metadata of the
+    arrays are read.
+
+    Parameters
+    ----------
+    system : str or Path
+        The path to the configuration.
+    fmt : str
+        The format of the configuration, the same as `dpdata.System`.
+
+    Returns
+    -------
+    nframes : int
+        The number of frames.
+    natoms : int
+        The number of atoms.
+    """
+    if fmt in ["deepmd/npy", "deepmd/comp"]:
+        folder = str(system)
+        natoms = np.loadtxt(os.path.join(folder, "type.raw"), ndmin=1).size
+        nframes = 0
+        for set_dir in sorted(glob.glob(os.path.join(folder, "set.*"))):
+            coords = np.load(os.path.join(set_dir, "coord.npy"), mmap_mode="r")
+            nframes += coords.shape[0]
+        return nframes, natoms
+    elif fmt == "deepmd/hdf5":
+        import h5py
+        ss = str(system).split("#")
+        with h5py.File(ss[0], "r") as f:
+            g = _h5_group(f, ss[1] if len(ss) > 1 else "")
+            natoms = len(_h5_dataset(g, "type.raw"))
+            nframes = sum([
+                len(_h5_dataset(_h5_group(g, kk), "coord.npy"))
+                for kk in g.keys() if kk.startswith("set.")
+            ])
+        return nframes, natoms
+    else:
+        import dpdata
+        ss = dpdata.System(system, fmt=fmt, labeled=False)
+        return ss.get_nframes(), ss.get_natoms()
+
+
+def _set_range(
+        offset : int,
+        nframes : int,
+        start : int,
+        stop : Optional[int],
+) -> Tuple[int, int]:
+    # the range of the frames in a set (the frames [offset, offset+nframes)
+    # of the system) that falls in [start, stop)
+    begin = min(max(start - offset, 0), nframes)
+    end = nframes if stop is None else min(max(stop - offset, 0), nframes)
+    return begin, max(begin, end)
+
+
+def _make_type_data(
+        atom_types : np.ndarray,
+        type_map : Optional[List[str]],
+) -> Dict[str, Any]:
+    # the same rules as dpdata: use type_map.raw if given, otherwise
+    # make artificial names
+    atom_types = np.asarray(atom_types).reshape(-1).astype(int)
+    if type_map is None:
+        type_map = ["Type_%d" % ii for ii in range(np.max(atom_types) + 1)]
+    atom_numbs = [int(np.count_nonzero(atom_types == ii)) for ii in range(len(type_map))]
+    return {
+        "atom_names" : type_map,
+        "atom_numbs" : atom_numbs,
+        "atom_types" : atom_types,
+    }
+
+
+def _iter_deepmd_npy_chunks(
+        folder : str,
+        chunk_size : int,
+        start : int = 0,
+        stop : Optional[int] = None,
+) -> Iterator[Tuple[Dict[str, Any], np.ndarray, np.ndarray]]:
+    atom_types = np.loadtxt(os.path.join(folder, "type.raw"), ndmin=1)
+    type_map = None
+    if os.path.isfile(os.path.join(folder, "type_map.raw")):
+        type_map = Path(os.path.join(folder, "type_map.raw")).read_text().split()
+    type_data = _make_type_data(atom_types, type_map)
+    nopbc = os.path.isfile(os.path.join(folder, "nopbc"))
+    type_data["nopbc"] = nopbc
+    natoms = type_data["atom_types"].size
+
+    offset = 0
+    for set_dir in sorted(glob.glob(os.path.join(folder, "set.*"))):
+        if stop is not None and offset >= stop:
+            break
+        coords = np.load(os.path.join(set_dir, "coord.npy"), mmap_mode="r")
+        coords = coords.reshape([-1, natoms, 3])
+        nframes = coords.shape[0]
+        begin, end = _set_range(offset, nframes, start, stop)
+        offset += nframes
+        if begin == end:
+            continue
+        if nopbc:
+            cells = None
+        else:
+            cells = np.load(os.path.join(set_dir, "box.npy"), mmap_mode="r")
+            cells = cells.reshape([nframes, 3, 3])
+        for ii in range(begin, end, chunk_size):
+            jj = min(ii + chunk_size, end)
+            chunk_coords = np.array(coords[ii:jj])
+            if cells is None:
+                chunk_cells = np.zeros((jj - ii, 3, 3))
+            else:
+                chunk_cells = np.array(cells[ii:jj])
+            yield type_data, chunk_cells, chunk_coords
+
+
+def _h5_group(f, name : str):
+    # the group `name` of an opened hdf5 file, the file itself if no name
+    import h5py
+    g = f[name] if name else f
+    assert isinstance(g, h5py.Group), f"{name} is not a group"
+    return g
+
+
+def _h5_dataset(g, name : str):
+    import h5py
+    d = g[name]
+    assert isinstance(d, h5py.Dataset), f"{name} is not a dataset"
+    return d
+
+
+def _iter_deepmd_hdf5_chunks(
+        file_name : str,
+        chunk_size : int,
+        start : int = 0,
+        stop : Optional[int] = None,
+) -> Iterator[Tuple[Dict[str, Any], np.ndarray, np.ndarray]]:
+    import h5py
+
+    ss = file_name.split("#")
+    group_name = ss[1] if len(ss) > 1 else ""
+    with h5py.File(ss[0], "r") as f:
+        g = _h5_group(f, group_name)
+        type_map = None
+        if "type_map.raw" in g.keys():
+            type_map = list(np.char.decode(np.asarray(_h5_dataset(g, "type_map.raw")[:])))
+        type_data = _make_type_data(np.asarray(_h5_dataset(g, "type.raw")[:]), type_map)
+        nopbc = "nopbc" in g.keys()
+        type_data["nopbc"] = nopbc
+        natoms = type_data["atom_types"].size
+
+        offset = 0
+        for set_name in sorted([kk for kk in g.keys() if kk.startswith("set.")]):
+            if stop is not None and offset >= stop:
+                break
+            set_group = _h5_group(g, set_name)
+            coords = _h5_dataset(set_group, "coord.npy")
+            nframes = coords.shape[0]
+            begin, end = _set_range(offset, nframes, start, stop)
+            offset += nframes
+            if begin == end:
+                continue
+            cells = None if nopbc else _h5_dataset(set_group, "box.npy")
+            for ii in range(begin, end, chunk_size):
+                jj = min(ii + chunk_size, end)
+                chunk_coords = np.reshape(np.asarray(coords[ii:jj]), [jj - ii, natoms, 3])
+                if cells is None:
+                    chunk_cells = np.zeros((jj - ii, 3, 3))
+                else:
+                    chunk_cells = np.reshape(np.asarray(cells[ii:jj]), [jj - ii, 3, 3])
+                yield type_data, chunk_cells, chunk_coords
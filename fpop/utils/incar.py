@@ -0,0 +1,153 @@
+import math, re
+import numpy as np
+from typing import (
+    Any,
+    Dict,
+    List,
+)
+
+# the tags set by the tuner, they change the parallelization and the
+# real space projection only, never the physics of the calculation
+INCAR_TUNING_TAGS = ["NCORE", "KPAR", "LREAL"]
+# the tags that the tuned tags give way to, e.g. NCORE is not set if NPAR is
+_CONFLICT_TAGS = {
+    "NCORE" : ["NCORE", "NPAR"],
+    "KPAR" : ["KPAR"],
+    "LREAL" : ["LREAL"],
+}
+# the systems of at least this many atoms use LREAL = Auto by default, as
+# recommended by the VASP manual for the systems of more than 20 atoms
+DEFAULT_LREAL_NATOMS = 20
+# the minimal number of cores of a k-point group by default
+DEFAULT_MIN_CORES_PER_KPAR = 4
+
+def incar_tags(
+        incar : str,
+) -> Dict[str, str]:
+    r"""The tags set in an INCAR, e.g. {"ENCUT" : "500", "ISMEAR" : "0"}.
+
+    The tags are upper case. Several tags in a line separated by ";" and
+    the comments starting with "!" or "#" are handled.
+    """
+    ret = {}
+    for line in incar.splitlines():
+        line = re.split("[!#]", line, maxsplit=1)[0]
+        for item in line.split(";"):
+            if "=" not in item:
+                continue
+            key, value = item.split("=", 1)
+            key = key.strip().upper()
+            if key:
+                ret[key] = value.strip()
+    return ret
+
+
+def irreducible_kpoints(
+        mesh : List[int],
+        kgamma : bool = True,
+        time_reversal : bool = True,
+) -> int:
+    r"""The number of k-points of a mesh reduced by the time reversal symmetry.
+
+    The k-points k and -k are the same by the time reversal symmetry, which
+    VASP uses unless ISYM = -1. The space group symmetry is not considered,
+    so it is an upper bound of the number of k-points computed.
+
+    Parameters
+    ----------
+    mesh : List[int]
+        The k-mesh.
+    kgamma : bool
+        The mesh is Gamma centered, otherwise Monkhorst-Pack.
+    time_reversal : bool
+        Reduce the k-points by the time reversal symmetry.
+    """
+    nk = int(np.prod(mesh))
+    if not time_reversal:
+        return nk
+    # the points equal to their inverse: 0 and 1/2 along each direction of
+    # a Gamma centered mesh, 0 if the number of points is odd for MP
+    nself = 1
+    for nn in mesh:
+        if nn % 2 == 0:
+            nself *= 2 if kgamma else 0
+    return (nk + nself) // 2
+
+
+def _divisors(nn):
+    return [ii for ii in range(1, nn + 1) if nn % ii == 0]
+
+
+def tune_incar(
+        tags : Dict[str, str],
+        natoms : int,
+        nkpts : int,
+        config : Dict[str, Any],
+) -> Dict[str, str]:
+    r"""The performance tags of a task by rules of thumb.
+
+    - KPAR: the largest divisor of the cores that is not larger than the
+      number of k-points and keeps at least "min_cores_per_kpar" cores in a
+      k-point group.
+    - NCORE: the divisor of the cores of a k-point group nearest to its
+      square root, increased while there are more band groups than atoms.
+    - LREAL: "Auto" for the systems of at least "lreal_natoms" atoms,
+      ".FALSE." otherwise.
+
+    The tags already set in the template, or conflicting with them, e.g.
+    NCORE and NPAR, are never changed.
+
+    Parameters
+    ----------
+    tags : Dict[str, str]
+        The tags of the template, see `incar_tags`.
+    natoms : int
+        The number of atoms.
+    nkpts : int
+        The number of k-points, see `irreducible_kpoints`.
+    config : Dict
+        The tuning config, see `VaspInputs`.
+
+    Returns
+    -------
+    tuned : Dict[str, str]
+        The tags to add to the INCAR.
+    """
+    ncores = int(config["ncores"])
+    if ncores < 1:
+        raise ValueError(f"the number of cores should be positive, got {ncores}")
+    tuned_tags = config.get("tags", INCAR_TUNING_TAGS)
+    for tt in tuned_tags:
+        if tt not in INCAR_TUNING_TAGS:
+            raise ValueError(f"cannot tune {tt}, should be one of {INCAR_TUNING_TAGS}")
+    def _tuned(tag):
+        return tag in tuned_tags and not any(ii in tags for ii in _CONFLICT_TAGS[tag])
+    ret = {}
+    # KPAR is decided first, NCORE divides the cores of a k-point group
+    kpar = int(tags.get("KPAR", 1))
+    if _tuned("KPAR"):
+        min_cores = min(ncores, config.get("min_cores_per_kpar", DEFAULT_MIN_CORES_PER_KPAR))
+        kpar = max([ii for ii in _divisors(ncores) if ii <= nkpts and ncores // ii >= min_cores] + [1])
+        ret["KPAR"] = str(kpar)
+    if _tuned("NCORE"):
+        cores = max(1, ncores // kpar)
+        divs = _divisors(cores)
+        idx = min(range(len(divs)), key=lambda ii: (abs(divs[ii] - math.sqrt(cores)), -divs[ii]))
+        while idx + 1 < len(divs) and cores // divs[idx] > natoms:
+            idx += 1
+        ret["NCORE"] = str(divs[idx])
+    if _tuned("LREAL"):
+        ret["LREAL"] = "Auto" if natoms >= config.get("lreal_natoms", DEFAULT_LREAL_NATOMS) else ".FALSE."
+    return ret
+
+
+def append_incar_tags(
+        incar : str,
+        tags : Dict[str, str],
+) -> str:
+    r"""Append tags to an INCAR, the template is kept verbatim."""
+    if not tags:
+        return incar
+    if incar and not incar.endswith("\n"):
+        incar += "\n"
+    return incar + "# performance tags set by fpop\n" + "".join(["%s = %s\n" % (kk, vv) for kk, vv in tags.items()])
@@ -0,0 +1,157 @@
+import hashlib
+from pathlib import Path
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Union,
+)
+from fpop.utils.shared_files import file_digest
+
+# the input files registered in this process, see `register_input_files`
+_input_files : List[Path] = []
+# the map from the digests to the registered files, built on the first lookup
+_input_files_index : Optional[Dict[str, Path]] = None
+# the contents of the files loaded in this process
+_input_files_cache : Dict[str, bytes] = {}
+
+class FileRef():
+    def __init__(
+            self,
+            fname : Union[str, Path],
+    ):
+        r"""A reference to an input file by the digest of its content.
+
+        Only the name, the source path and the digest of the file are kept,
+        so the object stays small when it is pickled with the Inputs. The
+        file is shipped to the prep step as the `input_files` artifact and
+        its content is loaded by the digest when it is first read.
+
+        Parameters
+        ----------
+        fname : str or Path
+            The path of the file.
+        """
+        self.name = Path(fname).name
+        self.path = str(Path(fname).absolute())
+        self.digest = file_digest(fname)
+
+    def read_bytes(self) -> bytes:
+        return load_input_file(self.digest, self.path)
+
+    def read_text(self) -> str:
+        return self.read_bytes().decode()
+
+
+def register_input_files(
+        fnames : Optional[List[Union[str, Path]]],
+):
+    r"""Register the files that `FileRef` objects are loaded from in this process.
+
+    Parameters
+    ----------
+    fnames : List[str or Path], optional
+        The files, typically the `input_files` artifact of PrepFp.
+    """
+    global _input_files, _input_files_index
+    _input_files = [Path(ii) for ii in (fnames or [])]
+    _input_files_index = None
+
+
+def load_input_file(
+        digest : str,
+        path : Optional[Union[str, Path]] = None,
+) -> bytes:
+    r"""Load the content of an input file by its digest.
+
+    The file is looked up in the registered input files. If it is not
+    registered, the file at `path` is used, e.g. when the Inputs are used
+    where they are created.
+
+    Parameters
+    ----------
+    digest : str
+        The sha256 digest of the content.
+    path : str or Path, optional
+        The source path of the file.
+
+    Returns
+    -------
+    content : bytes
+        The content of the file.
+    """
+    global _input_files_index
+    if digest in _input_files_cache:
+        return _input_files_cache[digest]
+    if _input_files_index is None:
+        _input_files_index = {file_digest(ii) : ii for ii in _input_files if ii.is_file()}
+    if digest in _input_files_index:
+        content = _input_files_index[digest].read_bytes()
+    elif path is not None and Path(path).is_file():
+        content = Path(path).read_bytes()
+        if hashlib.sha256(content).hexdigest() != digest:
+            raise FileNotFoundError(f"the input file {path} is changed, the digest is not {digest}")
+    else:
+        raise FileNotFoundError(f"cannot find the input file {path} ({digest}), is it given in input_files?")
+    _input_files_cache[digest] = content
+    return content
+
+
+def read_file(
+        fname : Union[str, Path],
+        reference : bool = False,
+) -> Union[str, FileRef]:
+    r"""The content of a file, or a `FileRef` to it if `reference` is True."""
+    if reference:
+        return FileRef(fname)
+    return Path(fname).read_text()
+
+
+def read_file_bytes(
+        fname : Union[str, Path],
+        reference : bool = False,
+) -> Union[bytes, FileRef]:
+    r"""The binary content of a file, or a `FileRef` to it if `reference` is True."""
+    if reference:
+        return FileRef(fname)
+    return Path(fname).read_bytes()
+
+
+def file_content(
+        content : Union[str, FileRef],
+) -> str:
+    r"""The content kept by `read_file`, loaded if it is a `FileRef`."""
+    if isinstance(content, FileRef):
+        return content.read_text()
+    return content
+
+
+def file_content_bytes(
+        content : Union[bytes, FileRef],
+) -> bytes:
+    r"""The binary content kept by `read_file_bytes`, loaded if it is a `FileRef`."""
+    if isinstance(content, FileRef):
+        return content.read_bytes()
+    return content
+
+
+def ref_files(
+        obj,
+) -> List[Path]:
+    r"""The source paths of all the `FileRef` held by an Inputs object.
+
+    These files are to be uploaded as the `input_files` artifact.
+    """
+    ret = []
+    def _collect(vv):
+        if isinstance(vv, FileRef):
+            if Path(vv.path) not in ret:
+                ret.append(Path(vv.path))
+        elif isinstance(vv, dict):
+            for ii in vv.values():
+                _collect(ii)
+        elif isinstance(vv, (list, tuple)):
+            for ii in vv:
+                _collect(ii)
+    _collect(vars(obj))
+    return ret
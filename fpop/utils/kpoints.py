@@ -0,0 +1,27 @@
+import numpy as np
+
+def make_kspacing_kpoints_mesh(cells, kspacing) -> np.ndarray:
+    r"""The k-mesh of a batch of cells.
+
+    The number of k-points along a reciprocal vector b is
+    max(1, ceil(2 pi |b| / kspacing)), the same convention as KSPACING
+    of VASP.
+
+    Parameters
+    ----------
+    cells : array_like
+        The cells of shape (nframes, 3, 3).
+    kspacing : float or List[float]
+        The kspacing, a number or one number for each direction.
+
+    Returns
+    -------
+    kpoints : np.ndarray
+        The k-mesh of each cell, of shape (nframes, 3).
+    """
+    cells = np.asarray(cells, dtype=float).reshape([-1, 3, 3])
+    kspacing = np.broadcast_to(np.asarray(kspacing, dtype=float), (3,))
+    rbox = np.swapaxes(np.linalg.inv(cells), -1, -2)
+    rnorm = np.sqrt(np.einsum("fij,fij->fi", rbox, rbox))
+    kpoints = np.ceil(2 * np.pi * rnorm / kspacing).astype(int)
+    return np.maximum(kpoints, 1)
@@ -0,0 +1,107 @@
+import os
+import numpy as np
+from pathlib import Path
+from typing import (
+    List,
+    Optional,
+    Union,
+)
+
+# the directory in backward_dir where the labels extracted by RunFp are written
+LABELS_DIR = "labels"
+# the arrays of the labels in a set
+_LABEL_KEYS = ["box", "coord", "energy", "force", "virial"]
+
+class LabelWriter():
+    def __init__(
+            self,
+            path : Union[str, Path],
+            atom_names : List[str],
+            atom_types : Union[List[int], np.ndarray],
+    ):
+        r"""Write labeled frames in the deepmd/npy layout, one frame at a time.
+
+        The frames are appended to raw binary files, so the memory does not
+        grow with the number of frames. The arrays are converted to
+        `set.000/*.npy` when the writer is closed, and the directory can be
+        loaded by `dpdata.LabeledSystem(path, fmt="deepmd/npy")`.
+
+        Parameters
+        ----------
+        path : str or Path
+            The directory of the labels.
+        atom_names : List[str]
+            The names of the atom types, written to type_map.raw.
+        atom_types : List[int]
+            The type of each atom, written to type.raw.
+        """
+        self.path = Path(path)
+        self.natoms = len(atom_types)
+        self.nframes = 0
+        self.has_virial = True
+        (self.path / "set.000").mkdir(parents=True, exist_ok=True)
+        (self.path / "type_map.raw").write_text("".join([ii + "\n" for ii in atom_names]))
+        (self.path / "type.raw").write_text("".join(["%d\n" % ii for ii in atom_types]))
+        self._files = {kk : open(self._raw_name(kk), "wb") for kk in _LABEL_KEYS}
+
+    def _raw_name(self, key):
+        return self.path / "set.000" / (key + ".raw.tmp")
+
+    def append(
+            self,
+            cell : np.ndarray,
+            coord : np.ndarray,
+            energy : float,
+            force : np.ndarray,
+            virial : Optional[np.ndarray] = None,
+    ):
+        r"""Append one frame. The units are Angstrom and eV.
+
+        If the virial of any frame is missing, no virial is written.
+        """
+        coord = np.asarray(coord, dtype=np.float64).reshape(-1)
+        force = np.asarray(force, dtype=np.float64).reshape(-1)
+        if coord.size != 3 * self.natoms or force.size != 3 * self.natoms:
+            raise ValueError(f"expect {self.natoms} atoms in a frame, got {coord.size // 3} coordinates and {force.size // 3} forces")
+        np.asarray(cell, dtype=np.float64).reshape(9).tofile(self._files["box"])
+        coord.tofile(self._files["coord"])
+        np.array([energy], dtype=np.float64).tofile(self._files["energy"])
+        force.tofile(self._files["force"])
+        if virial is None:
+            self.has_virial = False
+        elif self.has_virial:
+            np.asarray(virial, dtype=np.float64).reshape(9).tofile(self._files["virial"])
+        self.nframes += 1
+
+    def close(self) -> int:
+        r"""Convert the frames to npy files.
+
+        Returns
+        -------
+        nframes : int
+            The number of frames written.
+        """
+        shapes = {
+            "box" : [9],
+            "coord" : [3 * self.natoms],
+            "energy" : [],
+            "force" : [3 * self.natoms],
+            "virial" : [9],
+        }
+        for kk, ff in self._files.items():
+            ff.close()
+            raw = self._raw_name(kk)
+            if self.nframes > 0 and (kk != "virial" or self.has_virial):
+                data = np.memmap(raw, dtype=np.float64, mode="r", shape=tuple([self.nframes] + shapes[kk]))
+                np.save(self.path / "set.000" / (kk + ".npy"), data)
+                del data
+            os.remove(raw)
+        self._files = {}
+        return self.nframes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self._files:
+            self.close()
@@ -0,0 +1,146 @@
+import os, math, shlex
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Union,
+)
+
+# the key of the launcher spec in run_image_config, not passed to run_command
+LAUNCHER_KEY = "launcher"
+# the binding flags of each launcher, those of mpirun depend on the MPI flavor
+LAUNCHER_BINDING_FLAGS = {
+    "mpirun" : {},
+    "srun" : {
+        "core" : "--cpu-bind=cores",
+        "socket" : "--cpu-bind=sockets",
+        "none" : "--cpu-bind=none",
+    },
+    "none" : {},
+}
+# the binding flags of the mpirun of each MPI flavor
+MPI_BINDING_FLAGS = {
+    "openmpi" : {
+        "core" : "--bind-to core",
+        "socket" : "--bind-to socket",
+        "none" : "--bind-to none",
+    },
+    "intelmpi" : {
+        "core" : "-genv I_MPI_PIN_DOMAIN=core",
+        "socket" : "-genv I_MPI_PIN_DOMAIN=socket",
+        "none" : "-genv I_MPI_PIN=0",
+    },
+}
+
+def _cgroup_cpu_limit() -> Optional[int]:
+    # the cpu quota of the container, e.g. the cpu limit of a pod
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()[:2]
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+        return None
+    except:
+        pass
+    try:
+        quota = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us").read_text())
+        period = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us").read_text())
+        if quota > 0 and period > 0:
+            return max(1, math.ceil(quota / period))
+    except:
+        pass
+    return None
+
+
+def available_cpus() -> int:
+    r"""The number of cpus the tasks may use, bounded by the cpu affinity and the cgroup quota."""
+    ncpus = len(os.sched_getaffinity(0))
+    limit = _cgroup_cpu_limit()
+    if limit is not None:
+        ncpus = min(ncpus, limit)
+    return ncpus
+
+
+def make_launch_command(
+        spec : Dict[str, Any],
+        ncpus : Optional[int] = None,
+) -> str:
+    r"""Build the command line of an engine from a launcher spec.
+
+    Parameters
+    ----------
+    spec : Dict
+        The launcher spec, `run_image_config["launcher"]`, with keys
+        - "executable": The engine and its arguments, e.g. "vasp_std".
+        - "launcher": "mpirun" (default), "srun" or "none".
+        - "ranks": The number of MPI ranks, or "auto" (default) for as many as the cpus allow.
+        - "threads": The number of OpenMP threads per rank, or "auto" for as many as the cpus allow. Default 1.
+        - "mpi": The MPI flavor of mpirun, "openmpi" or "intelmpi". The binding flags differ between
+          the flavors, so a binding of mpirun is only translated if the flavor is given.
+        - "binding": "core", "socket" or "none", translated to the binding flags of the launcher. No flags if not given.
+        - "args": Other arguments of the launcher, e.g. "--allow-run-as-root".
+        - "env": The environment variables of the engine.
+        - "prefix": The command run before, e.g. "source /opt/intel/oneapi/setvars.sh".
+    ncpus : int, optional
+        The number of cpus to use, `available_cpus()` if not given.
+
+    Returns
+    -------
+    command : str
+        The command line.
+    """
+    if "executable" not in spec:
+        raise ValueError("the executable should be given in the launcher spec")
+    launcher = spec.get("launcher", "mpirun")
+    if launcher not in LAUNCHER_BINDING_FLAGS:
+        raise ValueError(f"unknown launcher {launcher}, should be one of {list(LAUNCHER_BINDING_FLAGS.keys())}")
+    if ncpus is None:
+        ncpus = available_cpus()
+    ranks = spec.get("ranks", "auto")
+    threads = spec.get("threads", 1)
+    if launcher == "none":
+        if ranks not in ["auto", 1]:
+            raise ValueError("only one rank is launched without a launcher")
+        ranks = 1
+    if threads == "auto":
+        threads = max(1, ncpus // ranks) if ranks != "auto" else 1
+    if ranks == "auto":
+        ranks = max(1, ncpus // threads)
+    ranks, threads = int(ranks), int(threads)
+
+    envs = {"OMP_NUM_THREADS" : str(threads)}
+    envs.update({kk : str(vv) for kk, vv in spec.get("env", {}).items()})
+    cmd = []
+    if spec.get("prefix"):
+        cmd.append(spec["prefix"] + " &&")
+    cmd.append("export " + " ".join(["%s=%s" % (kk, shlex.quote(vv)) for kk, vv in envs.items()]) + " &&")
+    binding = spec.get("binding")
+    binding_flags = LAUNCHER_BINDING_FLAGS[launcher]
+    if launcher == "mpirun" and binding is not None:
+        mpi = spec.get("mpi")
+        if mpi not in MPI_BINDING_FLAGS:
+            raise ValueError(f"the binding of mpirun needs the MPI flavor, mpi should be one of {list(MPI_BINDING_FLAGS.keys())}")
+        binding_flags = MPI_BINDING_FLAGS[mpi]
+    if binding is not None and launcher != "none" and binding not in binding_flags:
+        raise ValueError(f"unknown binding {binding} of {launcher}, should be one of {list(binding_flags.keys())}")
+    if launcher == "mpirun":
+        cmd.append("mpirun -np %d" % ranks)
+        if binding is not None:
+            if threads > 1 and binding == "core" and spec["mpi"] == "openmpi":
+                # each rank is bound to the cores of its threads
+                cmd.append("--map-by slot:PE=%d" % threads)
+                cmd.append(binding_flags[binding])
+            elif threads > 1 and binding == "core":
+                # the pin domain of each rank is the cores of its threads
+                cmd.append("-genv I_MPI_PIN_DOMAIN=omp")
+            else:
+                cmd.append(binding_flags[binding])
+    elif launcher == "srun":
+        cmd.append("srun -n %d -c %d" % (ranks, threads))
+        if binding is not None:
+            cmd.append(binding_flags[binding])
+    if launcher != "none" and spec.get("args"):
+        cmd.append(spec["args"])
+    cmd.append(spec["executable"])
+    return " ".join(cmd)
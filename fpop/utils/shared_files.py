@@ -0,0 +1,178 @@
+import os, json, hashlib, shutil
+from pathlib import Path
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Union,
+)
+
+# the pool of the shared files written by PrepFp, relative to its working directory
+SHARED_FILES_DIR = "shared_files"
+# the file in a task directory that maps the file names to the digests in the pool
+SHARED_FILES_MANIFEST = "shared_files.json"
+
+def file_digest(
+        fname : Union[str, Path],
+) -> str:
+    r"""The sha256 digest of the content of a file."""
+    hh = hashlib.sha256()
+    with open(fname, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            hh.update(block)
+    return hh.hexdigest()
+
+
+def pool_files(
+        fnames : List[str],
+        pool_dir : Union[str, Path],
+) -> Dict[str, str]:
+    r"""Move files of the current directory into a content-addressed pool.
+
+    Each file is stored once in `pool_dir` under the name of its digest.
+    The files are removed from the current directory and recorded in
+    the manifest `SHARED_FILES_MANIFEST`.
+
+    Parameters
+    ----------
+    fnames : List[str]
+        The names of the files. The names that are not regular files in
+        the current directory are ignored.
+    pool_dir : str or Path
+        The directory of the pool.
+
+    Returns
+    -------
+    manifest : Dict[str, str]
+        The map from the file names to the digests.
+    """
+    pool_dir = Path(pool_dir)
+    pool_dir.mkdir(parents=True, exist_ok=True)
+    manifest = {}
+    for fname in fnames:
+        if not os.path.isfile(fname) or os.path.islink(fname):
+            continue
+        digest = file_digest(fname)
+        target = pool_dir / digest
+        if target.is_file():
+            os.remove(fname)
+        else:
+            # concurrent writers move identical contents, os.replace is atomic
+            os.replace(fname, target)
+        manifest[fname] = digest
+    return record_shared_files(manifest)
+
+
+def record_shared_files(
+        entries : Dict[str, str],
+) -> Dict[str, str]:
+    r"""Record entries of the pool in the manifest of the current directory.
+
+    Parameters
+    ----------
+    entries : Dict[str, str]
+        The map from the names in the task directory to the names of the
+        entries in the pool. An entry may also be a directory that is
+        put in the pool by the prep op, e.g. the pseudopotential directory
+        shared by the ABACUS tasks.
+
+    Returns
+    -------
+    manifest : Dict[str, str]
+        The map from the names to the entries recorded in the manifest.
+    """
+    manifest = {}
+    if os.path.isfile(SHARED_FILES_MANIFEST):
+        manifest = json.loads(Path(SHARED_FILES_MANIFEST).read_text())
+    manifest.update(entries)
+    if manifest:
+        Path(SHARED_FILES_MANIFEST).write_text(json.dumps(manifest, indent=1))
+    return manifest
+
+
+def resolve_shared_files(
+        task_path : Union[str, Path],
+        shared_files : Optional[List[Path]],
+        staged_path : Union[str, Path],
+) -> Path:
+    r"""Resolve the files of a task that are stored in the pool of shared files.
+
+    If the task directory has no manifest, it is returned unchanged.
+    Otherwise a directory `staged_path` is created, where all the files
+    of the task and the pooled files are symbolic linked under their
+    original names.
+
+    Parameters
+    ----------
+    task_path : str or Path
+        The task directory prepared by PrepFp.
+    shared_files : List[Path], optional
+        The files in the pool.
+    staged_path : str or Path
+        The directory where the resolved task is staged.
+
+    Returns
+    -------
+    task_path : Path
+        The directory that contains all the files of the task.
+    """
+    task_path = Path(task_path)
+    manifest_file = task_path / SHARED_FILES_MANIFEST
+    if not manifest_file.is_file():
+        return task_path
+    manifest = json.loads(manifest_file.read_text())
+    pool = {Path(ii).name : Path(ii) for ii in (shared_files or [])}
+    staged_path = Path(staged_path)
+    staged_path.mkdir(parents=True, exist_ok=True)
+    for ii in task_path.iterdir():
+        if ii.name != SHARED_FILES_MANIFEST and not (staged_path / ii.name).exists():
+            (staged_path / ii.name).symlink_to(ii.resolve())
+    for name, digest in manifest.items():
+        if digest not in pool:
+            raise FileNotFoundError(f"cannot find the shared file {name} ({digest}) of {task_path}")
+        if not (staged_path / name).exists():
+            (staged_path / name).symlink_to(pool[digest].resolve())
+    return staged_path
+
+
+def cache_shared_file(
+        fname : Union[str, Path],
+        cache_dir : Union[str, Path],
+) -> Path:
+    r"""Copy a file or directory of the pool to a local cache once.
+
+    The tasks run in the same pod, e.g. a batch of tasks in a local scratch
+    directory, share the cached copy instead of copying the pool for each
+    task. The copy is moved into the cache atomically, so concurrent tasks
+    never see a partial copy.
+
+    Parameters
+    ----------
+    fname : str or Path
+        The file or directory in the pool, cached under its name.
+    cache_dir : str or Path
+        The directory of the cache.
+
+    Returns
+    -------
+    cached : Path
+        The cached copy.
+    """
+    fname = Path(fname)
+    cache_dir = Path(cache_dir)
+    cached = cache_dir / fname.name
+    if cached.exists():
+        return cached
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp = cache_dir / (".%s.%d.tmp" % (fname.name, os.getpid()))
+    if fname.is_dir():
+        shutil.copytree(fname, tmp)
+        try:
+            os.rename(tmp, cached)
+        except OSError:
+            # cached by another task meanwhile
+            shutil.rmtree(tmp)
+    else:
+        shutil.copyfile(fname, tmp)
+        os.replace(tmp, cached)
+    return cached
@@ -0,0 +1,87 @@
+import os, shutil, zipfile
+from pathlib import Path
+from typing import (
+    List,
+    Union,
+)
+
+def task_archive_name(
+        archive_index : int,
+) -> str:
+    r"""The name of the archive that packs the tasks of index `archive_index`."""
+    return 'tasks.%06d.zip' % archive_index
+
+
+def pack_tasks(
+        task_paths : List[Union[str, Path]],
+        archive : Union[str, Path],
+        remove : bool = True,
+) -> Path:
+    r"""Pack task directories into one zip archive.
+
+    The files are stored without compression, so that the central directory
+    of the zip file serves as an index of the offsets of the members and a
+    single task can be extracted without reading the others.
+
+    Parameters
+    ----------
+    task_paths : List[str or Path]
+        The task directories, relative to the current directory. The tasks
+        are stored under the names of the directories.
+    archive : str or Path
+        The path of the archive.
+    remove : bool
+        Remove the task directories after they are packed.
+
+    Returns
+    -------
+    archive : Path
+        The path of the archive.
+    """
+    archive = Path(archive)
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for task_path in task_paths:
+            task_path = Path(task_path)
+            zf.write(task_path, task_path.name)
+            for root, dirs, files in os.walk(task_path):
+                dirs.sort()
+                for ff in sorted(files):
+                    fname = Path(root) / ff
+                    zf.write(fname, (Path(task_path.name) / fname.relative_to(task_path)).as_posix())
+            if remove:
+                shutil.rmtree(task_path)
+    return archive
+
+
+def extract_task(
+        archive : Union[str, Path],
+        task_name : str,
+        dest : Union[str, Path] = ".",
+) -> Path:
+    r"""Extract one task from an archive written by `pack_tasks`.
+
+    Only the members of the task are read, located by the central directory
+    of the zip file.
+
+    Parameters
+    ----------
+    archive : str or Path
+        The path of the archive.
+    task_name : str
+        The name of the task.
+    dest : str or Path
+        The task is extracted to `dest / task_name`.
+
+    Returns
+    -------
+    task_path : Path
+        The path of the extracted task.
+    """
+    prefix = Path(task_name).as_posix().rstrip("/") + "/"
+    with zipfile.ZipFile(archive, "r") as zf:
+        members = [ii for ii in zf.infolist() if ii.filename.startswith(prefix)]
+        if not members:
+            raise FileNotFoundError(f"cannot find task {task_name} in {archive}")
+        for ii in members:
+            zf.extract(ii, dest)
+    return Path(dest) / task_name
@@ -0,0 +1,82 @@
+import json
+from pathlib import Path
+from typing import (
+    List,
+    Union,
+)
+
+# the directory of the manifests written by `PrepFp`
+TASK_MANIFEST_DIR = "task_manifests"
+
+def task_manifest_name(
+        start : int,
+) -> str:
+    r"""The name of the manifest of the tasks starting from global index `start`."""
+    return 'task_manifest.%06d.txt' % start
+
+
+def write_task_manifest(
+        task_names : List[str],
+        fname : Union[str, Path],
+        start : int = 0,
+) -> Path:
+    r"""Write the names of tasks to a manifest.
+
+    The first line of the manifest is a json header with the global index
+    of the first task (`start`), the number of tasks (`count`) and the
+    width of the entries (`width`). Each of the following lines holds one
+    task name padded to `width`, so the entry of a task is found by its
+    offset without reading the others.
+
+    Parameters
+    ----------
+    task_names : List[str]
+        The names of the tasks.
+    fname : str or Path
+        The path of the manifest.
+    start : int
+        The global index of the first task.
+
+    Returns
+    -------
+    fname : Path
+        The path of the manifest.
+    """
+    width = max([len(ii.encode()) for ii in task_names] + [1])
+    header = json.dumps({"start" : start, "count" : len(task_names), "width" : width})
+    with open(fname, "w") as f:
+        f.write(header + "\n")
+        for ii in task_names:
+            f.write(ii.ljust(width) + "\n")
+    return Path(fname)
+
+
+def read_task_name(
+        manifests : Union[str, Path, List[Union[str, Path]]],
+        index : int,
+) -> str:
+    r"""Read the name of the task of global index `index` from the manifests.
+
+    Parameters
+    ----------
+    manifests : str or Path or List
+        The manifest(s) written by `write_task_manifest`.
+    index : int
+        The global index of the task.
+
+    Returns
+    -------
+    task_name : str
+        The name of the task.
+    """
+    if not isinstance(manifests, list):
+        manifests = [manifests]
+    for manifest in manifests:
+        with open(manifest, "rb") as f:
+            header_line = f.readline()
+            header = json.loads(header_line)
+            if not header["start"] <= index < header["start"] + header["count"]:
+                continue
+            f.seek(len(header_line) + (index - header["start"]) * (header["width"] + 1))
+            return f.read(header["width"]).decode().rstrip()
+    raise KeyError(f"cannot find task {index} in the task manifests")
@@ -1,6 +1,22 @@
 from fpop.prep_fp import PrepFp
 from fpop.run_fp import RunFp
-import dpdata, sys, subprocess, os, shutil
+from fpop.utils.kpoints import make_kspacing_kpoints_mesh
+from fpop.utils.incar import (
+    incar_tags,
+    irreducible_kpoints,
+    tune_incar,
+    append_incar_tags,
+)
+from fpop.utils.labels import (
+    LabelWriter,
+    LABELS_DIR,
+)
+from fpop.utils.input_files import (
+    read_file,
+    file_content,
+    ref_files,
+)
+import dpdata, sys, subprocess, os, shutil, re
 from pathlib import Path
 from dflow.utils import run_command
 from typing import (
@@ -36,6 +52,8 @@ class VaspInputs():
             incar : str,
             pp_files : Dict[str, str],
             kgamma : bool = True,
+            reference : bool = False,
+            incar_tuning : Optional[Dict[str, Any]] = None,
     ):
         """
         Parameters
@@ -54,9 +72,24 @@ class VaspInputs():
                 }
         kgamma : bool
                 K-mesh includes the gamma point
+        reference : bool
+                Keep the potcar files by reference instead of by content. The
+                files given by `ref_files` should be passed to the prep step as
+                the `input_files` artifact, where they are loaded when used.
+        incar_tuning : Dict, optional
+                Add the performance tags NCORE, KPAR and LREAL to the INCAR of
+                each frame by its number of atoms and k-points, see
+                `fpop.utils.incar.tune_incar`. The keys are
+                - "ncores": The number of cores a task runs on, required.
+                - "tags": The tags to tune, all by default.
+                - "min_cores_per_kpar": The minimal cores of a k-point group, 4 by default.
+                - "lreal_natoms": The systems of at least this many atoms use LREAL = Auto, 20 by default.
+                The tags set in the template are never changed.
         """
         self.kspacing = kspacing
         self.kgamma = kgamma
+        self.reference = reference
+        self.incar_tuning = incar_tuning
         self.incar_from_file(incar)
         self.potcars_from_file(pp_files)
 
@@ -66,13 +99,37 @@ class VaspInputs():
 
     @property
     def potcars(self):
-        return self._potcars
+        return {kk : file_content(vv) for kk, vv in self._potcars.items()}
 
     def incar_from_file(
             self,
             fname : str,
     ):
         self._incar_template = Path(fname).read_text()
+        self._incar_tags = incar_tags(self._incar_template)
+
+    def make_incar(
+            self,
+            natoms : int,
+            box : np.ndarray,
+    ) -> str:
+        r"""The INCAR of a frame, the template with the tuned performance tags.
+
+        The template is returned unchanged if `incar_tuning` is not given.
+        The INCAR is generated once for each number of atoms and k-points.
+        """
+        if not self.incar_tuning:
+            return self.incar_template
+        mesh = make_kspacing_kpoints_mesh(box, self.kspacing)[0].tolist()
+        time_reversal = self._incar_tags.get("ISYM", "").strip() != "-1"
+        nkpts = irreducible_kpoints(mesh, self.kgamma, time_reversal)
+        if not hasattr(self, "_incar_cache"):
+            self._incar_cache = {}
+        key = (int(natoms), nkpts)
+        if key not in self._incar_cache:
+            tuned = tune_incar(self._incar_tags, natoms, nkpts, self.incar_tuning)
+            self._incar_cache[key] = append_incar_tags(self.incar_template, tuned)
+        return self._incar_cache[key]
 
     def potcars_from_file(
             self,
@@ -80,7 +137,11 @@ class VaspInputs():
     ):
         self._potcars = {}
         for kk,vv in dict_fnames.items():
-            self._potcars[kk] = Path(vv).read_text()            
+            self._potcars[kk] = read_file(vv, self.reference)
+
+    def ref_files(self) -> List[Path]:
+        r"""The files kept by reference, to be given as the `input_files` artifact."""
+        return ref_files(self)
 
     def make_potcar(
             self, 
@@ -88,14 +149,54 @@ class VaspInputs():
     ) -> str:        
         potcar_contents = []
         for nn in atom_names:
-            potcar_contents.append(self._potcars[nn])
+            potcar_contents.append(file_content(self._potcars[nn]))
         return "".join(potcar_contents)            
 
     def make_kpoints(
             self,
             box : np.ndarray,
     ) -> str:
-        return make_kspacing_kpoints(box, self.kspacing, self.kgamma)
+        r"""The KPOINTS of a cell.
+
+        The KPOINTS of the last cell is memoized, so consecutive frames of
+        a fixed cell do not generate the k-mesh again.
+        """
+        box = np.asarray(box, dtype=float)
+        key = (box.tobytes(), str(self.kspacing), self.kgamma)
+        last = getattr(self, "_last_kpoints", None)
+        if last is None or last[0] != key:
+            last = (key, self.make_kpoints_batch(box[None])[0])
+            self._last_kpoints = last
+        return last[1]
+
+    def make_kpoints_batch(
+            self,
+            cells : np.ndarray,
+    ) -> List[str]:
+        r"""The KPOINTS of a batch of cells.
+
+        Parameters
+        ----------
+        cells : np.ndarray
+            The cells of shape (nframes, 3, 3).
+
+        Returns
+        -------
+        kpoints : List[str]
+            The KPOINTS of each cell. The text is generated once for each
+            distinct k-mesh.
+        """
+        if not hasattr(self, "_kpoints_cache"):
+            self._kpoints_cache = {}
+        return make_kspacing_kpoints_batch(cells, self.kspacing, self.kgamma, cache=self._kpoints_cache)
+
+    def __getstate__(self):
+        # the memoized KPOINTS are not serialized with the inputs
+        state = self.__dict__.copy()
+        state.pop("_last_kpoints", None)
+        state.pop("_kpoints_cache", None)
+        state.pop("_incar_cache", None)
+        return state
 
     @staticmethod
     def args():
@@ -103,13 +204,56 @@ class VaspInputs():
         doc_incar = "The path to the template incar file"
         doc_kspacing = "The spacing of k-point sampling. `ksapcing` will overwrite the incar template"
         doc_kgamma = "If the k-mesh includes the gamma point. `kgamma` will overwrite the incar template"
+        doc_reference = "Keep the pseudopotential files by reference, they are shipped to the prep step by the `input_files` artifact"
+        doc_incar_tuning = 'Add the performance tags NCORE, KPAR and LREAL to the incar of each frame by its number of atoms and k-points, e.g. {"ncores" : 64}. The tags in the incar template are never changed'
         return [
             Argument("incar", str, optional=False, doc=doc_pp_files),
             Argument("pp_files", dict, optional=False, doc=doc_pp_files),
             Argument("kspacing", float, optional=False, doc=doc_kspacing),
             Argument("kgamma", bool, optional=True, default=True, doc=doc_kgamma),
+            Argument("reference", bool, optional=True, default=False, doc=doc_reference),
+            Argument("incar_tuning", dict, optional=True, default=None, doc=doc_incar_tuning),
         ]
 
+def make_poscar(
+        data : Dict[str, Any],
+        frame_idx : int = 0,
+) -> str:
+    r"""Render the POSCAR of a frame of a system.
+
+    The text is the same as written by `dpdata.System.to('vasp/poscar')`,
+    but rendered directly from the arrays of the system. The elements of
+    zero atoms are skipped.
+
+    Parameters
+    ----------
+    data : Dict
+        The data of a dpdata.System, without selective dynamics (`move`).
+    frame_idx : int
+        The index of the frame.
+
+    Returns
+    -------
+    poscar : str
+        The POSCAR of the frame.
+    """
+    atom_names = [nn for nn, cc in zip(data["atom_names"], data["atom_numbs"]) if cc > 0]
+    atom_numbs = [cc for cc in data["atom_numbs"] if cc > 0]
+    head = "".join(["%s%d " % (nn, cc) for nn, cc in zip(atom_names, atom_numbs)]) + "\n"
+    head += "1.0\n"
+    tail = "".join(["%s " % nn for nn in atom_names]) + "\n"
+    tail += "".join(["%d " % cc for cc in atom_numbs]) + "\n"
+    tail += "Cartesian\n"
+    # the atoms are sorted by the types, keeping the original order in a type
+    atom_types = np.asarray(data["atom_types"])
+    sort_idx = np.lexsort((np.arange(len(atom_types)), atom_types))
+    cell = np.asarray(data["cells"][frame_idx]).reshape(-1)
+    coord = np.asarray(data["coords"][frame_idx])[sort_idx].reshape(-1)
+    cell_fmt = "%.16e %.16e %.16e \n" * 3
+    coord_fmt = "%15.10f %15.10f %15.10f\n" * len(atom_types)
+    return head + cell_fmt % tuple(cell.tolist()) + tail + coord_fmt % tuple(coord.tolist())
+
+
 def make_kspacing_kpoints(box, kspacing, kgamma) :
     if type(kspacing) is not list:
         kspacing = [kspacing, kspacing, kspacing]
@@ -120,6 +264,36 @@ def make_kspacing_kpoints(box, kspacing, kgamma) :
     return ret
 
 
+def make_kspacing_kpoints_batch(cells, kspacing, kgamma, cache=None) -> List[str]:
+    r"""The KPOINTS of a batch of cells.
+
+    Parameters
+    ----------
+    cells : array_like
+        The cells of shape (nframes, 3, 3).
+    kspacing : float or List[float]
+        The kspacing, a number or one number for each direction.
+    kgamma : bool
+        K-mesh includes the gamma point.
+    cache : Dict, optional
+        The KPOINTS of the k-meshes generated before. The new ones are added.
+
+    Returns
+    -------
+    kpoints : List[str]
+        The KPOINTS of each cell.
+    """
+    if cache is None:
+        cache = {}
+    ret = []
+    for kp in map(tuple, make_kspacing_kpoints_mesh(cells, kspacing).tolist()):
+        key = kp + (bool(kgamma),)
+        if key not in cache:
+            cache[key] = _make_vasp_kpoints(kp, kgamma)
+        ret.append(cache[key])
+    return ret
+
+
 def _make_vasp_kp_gamma(kpoints):
     ret = ""
     ret += "Automatic mesh\n"
@@ -184,14 +358,17 @@ class PrepVasp(PrepFp):
             In vasp part, all the files which are given in optional_artifact will be copied to the work directory. In this example, "INCAR","POTCAR","POSCAR","KPOINTS" and "ICONST" will be copied to the same directory. "./iconst" is the path where the target file exists.
         """
 
-        conf_frame.to('vasp/poscar', 'POSCAR')
+        if conf_frame.data.get("move", None) is not None:
+            conf_frame.to('vasp/poscar', 'POSCAR')
+        else:
+            Path('POSCAR').write_text(make_poscar(conf_frame.data))
         Path('INCAR').write_text(
-            inputs.incar_template
+            inputs.make_incar(conf_frame.get_natoms(), conf_frame['cells'][0])
         )
         # fix the case when some element have 0 atom, e.g. H0O2
-        tmp_frame = dpdata.System('POSCAR', fmt='vasp/poscar')
+        atom_names = [nn for nn, cc in zip(conf_frame['atom_names'], conf_frame['atom_numbs']) if cc > 0]
         Path('POTCAR').write_text(
-            inputs.make_potcar(tmp_frame['atom_names'])
+            inputs.make_potcar(atom_names)
         )
         Path('KPOINTS').write_text(
             inputs.make_kpoints(conf_frame['cells'][0])
@@ -202,6 +379,138 @@ class PrepVasp(PrepFp):
                 content = file_path.read_text()
                 Path(file_name).write_text(content)
 
+    def shared_files(
+            self,
+            inputs: VaspInputs,
+            optional_artifact: Optional[Dict] = None,
+    ) -> List[str]:
+        r"""INCAR, POTCAR and the files of optional_artifact are shared by the tasks."""
+        return ["INCAR", "POTCAR"] + super().shared_files(inputs, optional_artifact)
+
+
+# convert the stress in kBar times the volume in Angstrom^3 to the virial in eV
+_KBAR_A3_TO_EV = 1e3 / 1.602176621e6
+
+def _outcar_atom_name(name):
+    # e.g. Sn_d -> Sn
+    return name.split("_")[0]
+
+def iter_outcar_frames(
+        fname : Union[str, Path],
+        convergence_check : bool = True,
+):
+    r"""Iterate over the labeled frames of an OUTCAR in one pass.
+
+    The OUTCAR is read line by line and only the current ionic step is
+    held in memory, so the memory does not depend on the size of the file.
+    The first item is the system info, the following are the frames.
+
+    Parameters
+    ----------
+    fname : str or Path
+        The OUTCAR file.
+    convergence_check : bool
+        Skip the ionic steps whose electronic steps reach NELM.
+
+    Yields
+    ------
+    info : Dict
+        The first item, with keys "atom_names" and "atom_types".
+    frame : Dict
+        Each of the following items, with keys "cell", "coord", "energy",
+        "force" and "virial" (None if the stress is not printed), in
+        Angstrom and eV.
+    """
+    titel_names, potcar_names = [], []
+    atom_numbs = None
+    nelm = None
+    info = None
+    cell, coord, force, stress, converged = None, None, None, None, True
+    with open(fname) as f:
+        for line in f:
+            if info is None:
+                if "TITEL" in line:
+                    titel_names.append(_outcar_atom_name(line.split()[3]))
+                elif "POTCAR:" in line:
+                    potcar_names.append(_outcar_atom_name(line.split()[2]))
+                elif nelm is None and "NELM" in line:
+                    mm = re.search(r"NELM\s*=\s*(\d+)", line)
+                    if mm:
+                        nelm = int(mm.group(1))
+                if "ions per type" in line:
+                    atom_numbs = [int(ii) for ii in line.split()[4:]]
+            mm = re.search(r"Iteration\s*\d+\(\s*(\d+)\)", line) if "Iteration" in line else None
+            if mm:
+                if info is None:
+                    # the header is read before the first electronic step
+                    if atom_numbs is None:
+                        raise ValueError("cannot find ion type info in OUTCAR")
+                    names = titel_names if titel_names else potcar_names[:len(potcar_names) // 2]
+                    if len(names) < len(atom_numbs):
+                        raise ValueError("cannot get atom names from potcar")
+                    info = {
+                        "atom_names" : names[:len(atom_numbs)],
+                        "atom_types" : np.repeat(np.arange(len(atom_numbs)), atom_numbs),
+                    }
+                    yield info
+                if nelm is not None and int(mm.group(1)) >= nelm:
+                    converged = False
+            elif "free  energy   TOTEN" in line:
+                energy = float(line.split()[4])
+                if cell is not None and force is not None and (converged or not convergence_check):
+                    virial = None
+                    if stress is not None:
+                        virial = stress * np.linalg.det(cell) * _KBAR_A3_TO_EV
+                    yield {"cell" : cell, "coord" : coord, "energy" : energy, "force" : force, "virial" : virial}
+                cell, coord, force, stress, converged = None, None, None, None, True
+            elif "VOLUME and BASIS" in line:
+                for _ in range(4):
+                    next(f)
+                cell = np.array([
+                    [float(ss) for ss in next(f).replace("-", " -").split()[0:3]]
+                    for _ in range(3)
+                ])
+            elif "FORCE on cell =-STRESS" in line:
+                kb_line = ""
+                for kb_line in f:
+                    if kb_line.split()[0:2] == ["in", "kB"]:
+                        break
+                else:
+                    raise ValueError("cannot find the stress in kB in OUTCAR")
+                vv = [float(ss) for ss in kb_line.split()[2:8]]
+                stress = np.array([
+                    [vv[0], vv[3], vv[5]],
+                    [vv[3], vv[1], vv[4]],
+                    [vv[5], vv[4], vv[2]],
+                ])
+            elif "TOTAL-FORCE" in line and "ML" not in line:
+                next(f)
+                natoms = len(info["atom_types"]) if info is not None else sum(atom_numbs or [])
+                data = np.array([[float(ss) for ss in next(f).split()[:6]] for _ in range(natoms)])
+                coord, force = data[:, :3], data[:, 3:6]
+
+
+def extract_outcar_labels(
+        fname : Union[str, Path],
+        path : Union[str, Path],
+        convergence_check : bool = True,
+) -> int:
+    r"""Extract the labels of an OUTCAR to the deepmd/npy layout in `path`, see `iter_outcar_frames`.
+
+    Returns
+    -------
+    nframes : int
+        The number of frames extracted.
+    """
+    frames = iter_outcar_frames(fname, convergence_check)
+    info = next(frames, None)
+    if info is None:
+        raise ValueError(f"cannot find any electronic step in {fname}")
+    with LabelWriter(path, info["atom_names"], info["atom_types"]) as writer:
+        for frame in frames:
+            writer.append(**frame)
+        return writer.close()
+
 
 class RunVasp(RunFp):
     def input_files(self, task_path) -> List[str]:
@@ -235,29 +544,29 @@ class RunVasp(RunFp):
             {
               "command": "source /opt/intel/oneapi/setvars.sh && mpirun -n 64 /opt/vasp.5.4.4/bin/vasp_std"
             }
+            Or "launcher" builds the command line that fits the cpus of the pod,
+            see `RunFp.engine_command`.
         optional_input:
             The parameters developers need in runtime.For example:
             {
                 "conf_format": "vasp/poscar"
             }
             optional_input["vasp/poscar"] is the format of the configurations that users give.
+            If "extract_labels" is True, the labels of OUTCAR are extracted to `labels`
+            in the backward directory in the deepmd/npy format. "backward_filter" are
+            the glob patterns of the files retained from the directories in
+            backward_list, and "backward_compress" is the compression of the backward
+            files, see `RunFp.collect_backward`.
         
         Returns
         -------
         backward_dir_name: str
             The directory name which containers the files users need.
         '''
-        if run_image_config:
-            command = run_image_config["command"]
-        else:
-            command = "vasp_std"
-        # run vasp
-        command = " ".join([command, ">", log_name])
-        kwargs = {"try_bash": True, "shell": True}
-        if run_image_config:
-            kwargs.update(run_image_config)
-            kwargs.pop("command", None)
-        ret, out, err = run_command(command, raise_error=False, **kwargs) # type: ignore
+        # run vasp, bound to a cpu slot if the tasks run concurrently in a pod
+        kwargs = self.run_command_kwargs(run_image_config)
+        with self.engine_command(run_image_config, log_name, "vasp_std") as command:
+            ret, out, err = run_command(command, raise_error=False, **kwargs) # type: ignore
         if ret != 0:
             raise TransientError(
                 "vasp failed\n", "out msg", out, "\n", "err msg", err, "\n"
@@ -266,16 +575,20 @@ class RunVasp(RunFp):
             raise TransientError(
                 "vasp failed , we could not check the exact cause . Please check log file ."
             )
+        if optional_input is None:
+            optional_input = {}
         os.makedirs(Path(backward_dir_name))
-        shutil.copyfile(log_name,Path(backward_dir_name)/log_name)
-        for ii in backward_list:
-            shutil.copyfile(ii,Path(backward_dir_name)/ii)
+        self.collect_backward(
+            [log_name] + backward_list, backward_dir_name,
+            patterns=optional_input.get("backward_filter"),
+            compress=optional_input.get("backward_compress"),
+        )
+        if optional_input.get("extract_labels", False):
+            try:
+                extract_outcar_labels("OUTCAR", Path(backward_dir_name)/LABELS_DIR)
+            except Exception as e:
+                raise FatalError(f"failed to extract the labels from OUTCAR: {e}")
         return backward_dir_name
     
     def check_run_success(self):
-        with open("OUTCAR","r") as f:
-            lines = f.readlines()
-        if "Voluntary" in lines[-1]:
-            return True
-        else:
-            return False
+        return self.check_tail("OUTCAR", "Voluntary", last_line=True)
@@ -18,9 +18,11 @@ setuptools.setup(
         "lbg",
         "dpdata",
         "numpy",
-        "ase",
         "dargs",
     ],
+    extras_require={
+        "zstd": ["zstandard"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: GNU Lesser General Public License v3 (LGPLv3)",
@@ -15,6 +15,7 @@ from typing import Tuple, List, Optional, Dict
 from context import fpop
 from fpop.vasp import RunVasp
 from fpop.run_fp import RunFp
+from fpop.utils.task_manifest import read_task_name
 
 class MockedRunVasp(RunVasp):
     @OP.exec_sign_check
@@ -23,11 +24,13 @@ class MockedRunVasp(RunVasp):
             op_in : OPIO,
     ) -> OPIO:
         task_name = op_in["task_name"]
+        if not task_name:
+            task_name = read_task_name(op_in["task_manifest"], int(op_in["task_index"]))
         task_path = op_in["task_path"]
 
         assert(op_in['task_path'].is_dir())
-        assert(re.match('task.[0-9][0-9][0-9][0-9][0-9][0-9]', op_in['task_name']))
-        assert(op_in['task_name'] in str(op_in['task_path']))
+        assert(re.match('task.[0-9][0-9][0-9][0-9][0-9][0-9]', task_name))
+        assert(task_name in str(op_in['task_path']))
         for ii in ['INCAR','POSCAR','POTCAR','KPOINTS']:
             assert((op_in['task_path']/ii).is_file())
 
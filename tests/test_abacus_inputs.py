@@ -3,7 +3,7 @@ import os,sys,json,glob,shutil,textwrap
 import dpdata
 import numpy as np
 import unittest
-from fpop.abacus import AbacusInputs,get_pporbdpks_from_stru
+from fpop.abacus import AbacusInputs,get_pporbdpks_from_stru,read_stru_blocks
 from pathlib import Path
 from constants import STRU1_content
 
@@ -133,6 +133,7 @@ class TestAbacusInputs(unittest.TestCase):
                                    kpt_file="../KPT")
         self.assertEqual(abacusinput.get_deepks_descriptor(),("jle.orb","tjle.orb"))
         self.assertEqual(abacusinput.get_deepks_model(),("model.ptg",bytes("tmodel.ptg",encoding="utf-8")))
+        self.assertEqual(abacusinput.get_file_names(),["H.upf","O.upf","H.orb","O.orb","jle.orb","model.ptg"])
 
         abacusinput.write_deepks()
         self.assertFalse(os.path.isfile("jle.orb"))
@@ -150,6 +151,49 @@ class TestAbacusInputs(unittest.TestCase):
         self.assertEqual(Path("jle.orb").read_text(),"tjle.orb")
         self.assertEqual(Path("model.ptg").read_bytes(),bytes("tmodel.ptg",encoding="utf-8"))
 
+    def test_kspacing(self):
+        with self.assertRaises(ValueError):
+            AbacusInputs(input_file="../INPUT", pp_files={"H": "../H.upf"}, kpt_file="../KPT", kspacing=0.1)
+        abacusinput = AbacusInputs(input_file="../INPUT",
+                                   pp_files= {"H": "../H.upf", "O": "../O.upf"},
+                                   kspacing=0.1)
+        box = np.array([[0., 6., 6.], [8., 0., 8.], [9., 9., 0.]])
+        # the same mesh as VaspInputs
+        self.assertEqual(abacusinput.make_kpt(box), "K_POINTS\n0\nGamma\n10 7 7 0 0 0\n")
+        abacusinput.write_kpt("KPT", box)
+        self.assertEqual(Path("KPT").read_text(), "K_POINTS\n0\nGamma\n10 7 7 0 0 0\n")
+        with self.assertRaises(ValueError):
+            abacusinput.write_kpt("KPT")
+        kpts = abacusinput.make_kpt_batch(np.array([box, box, box * 2.]))
+        self.assertIs(kpts[0], kpts[1])
+        self.assertEqual(kpts[2], "K_POINTS\n0\nGamma\n5 4 4 0 0 0\n")
+        abacusinput.kgamma = False
+        self.assertEqual(abacusinput.make_kpt(box), "K_POINTS\n0\nMP\n10 7 7 0 0 0\n")
+        self.assertNotIn("_kpt_cache", abacusinput.__getstate__())
+
+    def test_reference(self):
+        abacusinput = AbacusInputs(input_file="../INPUT",
+                                   pp_files= {"H": "../H.upf", "O": "../O.upf"},
+                                   orb_files= {"H": "../H.orb", "O": "../O.orb"},
+                                   deepks_descriptor="../jle.orb",
+                                   deepks_model="../model.ptg",
+                                   reference=True)
+        self.assertEqual(len(abacusinput.ref_files()), 6)
+        # the getters return the contents as without reference
+        self.assertEqual(abacusinput.get_pp()["H"],("H.upf","tH.upf"))
+        self.assertEqual(abacusinput.get_orb()["O"],("O.orb","tO.orb"))
+        self.assertEqual(abacusinput.get_deepks_descriptor(),("jle.orb","tjle.orb"))
+        self.assertEqual(abacusinput.get_deepks_model(),("model.ptg",bytes("tmodel.ptg",encoding="utf-8")))
+        abacusinput.set_input("basis_type","lcao")
+        abacusinput.set_input("deepks_scf",1)
+        pp, orb = abacusinput.write_pporb(["H"])
+        self.assertEqual((pp, orb), (["H.upf"], ["H.orb"]))
+        self.assertEqual(abacusinput.write_deepks(), "jle.orb")
+        self.assertEqual(Path("H.upf").read_text(),"tH.upf")
+        self.assertEqual(Path("H.orb").read_text(),"tH.orb")
+        self.assertEqual(Path("jle.orb").read_text(),"tjle.orb")
+        self.assertEqual(Path("model.ptg").read_bytes(),bytes("tmodel.ptg",encoding="utf-8"))
+
 
 class TestAbacusFunctions(unittest.TestCase):
     def setUp(self):
@@ -173,6 +217,29 @@ class TestAbacusFunctions(unittest.TestCase):
         self.assertTrue(stru_data["labels"],["Ga","As"])
         self.assertTrue(stru_data["mass"],[69.723,74.922])
 
+    def test_ReadStruBlocks(self):
+        blocks = read_stru_blocks("STRU")
+        self.assertEqual(list(blocks.keys()), ["ATOMIC_SPECIES","NUMERICAL_ORBITAL","LATTICE_CONSTANT","LATTICE_VECTORS","ATOMIC_POSITIONS","NUMERICAL_DESCRIPTOR"])
+        self.assertEqual([ii.split()[0] for ii in blocks["ATOMIC_SPECIES"]], ["Ga","As"])
+        self.assertEqual(blocks["LATTICE_CONSTANT"], ["1.889716\n"])
+        self.assertEqual(len(blocks["LATTICE_VECTORS"]), 3)
+        self.assertEqual(len(blocks["ATOMIC_POSITIONS"]), 15)
+        self.assertEqual(blocks["NUMERICAL_DESCRIPTOR"], ["jle.orb\n"])
+
+    def test_ReadStruBlocksComment(self):
+        # keywords with comments, repeated blocks, and a large structure
+        natoms = 10000
+        stru = "ATOMIC_SPECIES # the species\nH 1.0 H.upf\n\nATOMIC_POSITIONS\nCartesian\nH\n0.0\n%d\n" % natoms
+        stru += "0.0 0.0 0.0 1 1 1\n" * natoms
+        stru += "ATOMIC_SPECIES\nO 16.0 O.upf\n"
+        Path("STRU.big").write_text(stru)
+        stru_data = get_pporbdpks_from_stru(Path("STRU.big"))
+        self.assertEqual(stru_data["pp"], ["H.upf"])
+        self.assertEqual(stru_data["orb"], None)
+        self.assertEqual(stru_data["dpks"], None)
+        self.assertEqual(len(stru_data["blocks"]["ATOMIC_POSITIONS"]), natoms + 4)
+        self.assertEqual(get_pporbdpks_from_stru("STRU.none"), {})
+
 
 
 
@@ -0,0 +1,75 @@
+from context import fpop
+import os,shutil
+import unittest
+from pathlib import Path
+from fpop.utils.compression import (
+    compress_config,
+    compress_file,
+    open_backward,
+    decompress_file,
+    decompress_dir,
+    record_compressed,
+)
+
+try:
+    import zstandard
+    has_zstd = True
+except ImportError:
+    has_zstd = False
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        Path('compress_test').mkdir(exist_ok=True)
+        os.chdir('compress_test')
+        self.content = "".join(["line %d of OUTCAR\n" % ii for ii in range(10000)])
+        Path('OUTCAR').write_text(self.content)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree('compress_test')
+
+    def test_config(self):
+        self.assertIsNone(compress_config(None))
+        self.assertEqual(compress_config('zstd'), {'method' : 'zstd', 'threshold' : 1 << 20, 'level' : None})
+        self.assertEqual(compress_config({'threshold' : 10}), {'method' : 'gzip', 'threshold' : 10, 'level' : None})
+        with self.assertRaises(ValueError):
+            compress_config('bz2')
+
+    def _test_method(self, method, suffix):
+        compress_file('OUTCAR', 'OUTCAR' + suffix, method)
+        self.assertLess(os.path.getsize('OUTCAR' + suffix), len(self.content) / 5)
+        os.rename('OUTCAR', 'OUTCAR.orig')
+        with open_backward('OUTCAR', 'r') as f:
+            self.assertEqual(f.read(), self.content)
+        with open_backward('OUTCAR' + suffix) as f:
+            self.assertEqual(f.read(), self.content.encode())
+        decompress_file('OUTCAR' + suffix)
+        self.assertFalse(Path('OUTCAR' + suffix).exists())
+        self.assertEqual(Path('OUTCAR').read_text(), self.content)
+
+    def test_gzip(self):
+        self._test_method('gzip', '.gz')
+
+    @unittest.skipIf(not has_zstd, "zstandard is not installed")
+    def test_zstd(self):
+        self._test_method('zstd', '.zst')
+
+    def test_open_backward(self):
+        with open_backward('OUTCAR', 'r') as f:
+            self.assertEqual(f.readline(), 'line 0 of OUTCAR\n')
+        with self.assertRaises(FileNotFoundError):
+            open_backward('no_such_file')
+
+    def test_decompress_dir(self):
+        Path('backward/sub').mkdir(parents=True)
+        compress_file('OUTCAR', 'backward/OUTCAR.gz')
+        compress_file('OUTCAR', 'backward/sub/log.gz')
+        # not compressed by fpop, kept as it is
+        compress_file('OUTCAR', 'backward/staged.gz')
+        Path('backward/INPUT').write_text('input')
+        self.assertEqual(decompress_dir('backward'), [])
+        record_compressed('backward', ['backward/OUTCAR.gz', 'backward/sub/log.gz'])
+        self.assertEqual(decompress_dir('backward'), [Path('backward/OUTCAR'), Path('backward/sub/log')])
+        self.assertEqual(sorted(os.listdir('backward')), ['INPUT', 'OUTCAR', 'staged.gz', 'sub'])
+        self.assertEqual(Path('backward/sub/log').read_text(), self.content)
@@ -0,0 +1,92 @@
+from context import fpop
+import os,shutil
+import unittest
+from pathlib import Path
+from multiprocessing import Pool
+from unittest.mock import patch
+from fpop.utils.cpu_binding import (
+    format_cpu_list,
+    parse_cpu_list,
+    cpu_slots,
+    make_cpu_slots,
+    acquire_cpu_slot,
+    bind_cpus,
+    numa_nodes,
+    CpuSlot,
+)
+
+LOCK_DIR = 'cpu_slots_test'
+
+def _take_slot(ii):
+    import time
+    slots = make_cpu_slots({'slots' : 2, 'cpus' : '0-7'})
+    with acquire_cpu_slot(slots, LOCK_DIR) as slot:
+        time.sleep(0.3)
+        return slot.index
+
+class TestCpuBinding(unittest.TestCase):
+    def tearDown(self):
+        if Path(LOCK_DIR).is_dir():
+            shutil.rmtree(LOCK_DIR)
+
+    def test_cpu_list(self):
+        self.assertEqual(format_cpu_list([5, 0, 1, 2, 7, 8]), '0-2,5,7-8')
+        self.assertEqual(parse_cpu_list('0-2,5,7-8\n'), [0, 1, 2, 5, 7, 8])
+
+    def test_slots(self):
+        self.assertEqual(cpu_slots(3, list(range(8))), [[0, 1, 2], [3, 4, 5], [6, 7]])
+        with self.assertRaises(ValueError):
+            cpu_slots(9, list(range(8)))
+        slots = make_cpu_slots({'slots' : 4, 'cpus' : '0-15'})
+        self.assertEqual([ss.cpus for ss in slots], [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 10, 11], [12, 13, 14, 15]])
+        with self.assertRaises(ValueError):
+            make_cpu_slots({'cpus' : '0-15'})
+        with self.assertRaises(ValueError):
+            make_cpu_slots({'slots' : 2, 'method' : 'foo'})
+        slots = make_cpu_slots({'numa' : True})
+        self.assertTrue(len(slots) >= 1)
+        self.assertEqual(slots[0].numa_node, 0)
+
+    @patch('os.sched_getaffinity')
+    def test_numa_nodes(self, mocked_affinity):
+        for ii, cpus in enumerate(['0-3', '4-7', '8-11']):
+            Path(LOCK_DIR, 'node%d' % ii).mkdir(parents=True)
+            Path(LOCK_DIR, 'node%d' % ii, 'cpulist').write_text(cpus + '\n')
+        mocked_affinity.return_value = set(range(12))
+        self.assertEqual(numa_nodes(LOCK_DIR), {0 : [0, 1, 2, 3], 1 : [4, 5, 6, 7], 2 : [8, 9, 10, 11]})
+        # limited by the cpuset, node 1 has no cpu the process may run on
+        mocked_affinity.return_value = {2, 3, 8, 9}
+        self.assertEqual(numa_nodes(LOCK_DIR), {0 : [2, 3], 2 : [8, 9]})
+        self.assertEqual(numa_nodes(Path(LOCK_DIR, 'no_such_dir')), {0 : [2, 3, 8, 9]})
+
+    def test_pin(self):
+        slot = CpuSlot(1, [4, 5, 6, 7])
+        self.assertEqual(slot.pin('mpirun -np 4 vasp_std > log'), "taskset -c 4-7 bash -c 'mpirun -np 4 vasp_std > log'")
+        self.assertEqual(slot.pin('mpirun -np 4 vasp_std', 'numactl'), "numactl --physcpubind=4-7 bash -c 'mpirun -np 4 vasp_std'")
+        self.assertEqual(
+            slot.pin('mpirun -np {ncpus} --cpu-set {cpus} --bind-to core abacus', 'none'),
+            'mpirun -np 4 --cpu-set 4-7 --bind-to core abacus')
+        slot = CpuSlot(1, [4, 5, 6, 7], 1)
+        self.assertEqual(slot.pin('abacus', 'numactl'), "numactl --cpunodebind=1 --membind=1 bash -c abacus")
+
+    def test_acquire(self):
+        slots = make_cpu_slots({'slots' : 2, 'cpus' : '0-7'})
+        with acquire_cpu_slot(slots, LOCK_DIR) as s0:
+            with acquire_cpu_slot(slots, LOCK_DIR) as s1:
+                self.assertEqual([s0.index, s1.index], [0, 1])
+                with self.assertRaises(TimeoutError):
+                    with acquire_cpu_slot(slots, LOCK_DIR, timeout=0):
+                        pass
+        # released
+        with acquire_cpu_slot(slots, LOCK_DIR) as s0:
+            self.assertEqual(s0.index, 0)
+
+    def test_concurrent(self):
+        with Pool(2) as pool:
+            self.assertEqual(sorted(pool.map(_take_slot, range(2))), [0, 1])
+
+    def test_bind_cpus(self):
+        with bind_cpus('vasp_std > log', None) as command:
+            self.assertEqual(command, 'vasp_std > log')
+        with bind_cpus('vasp_std > log', {'slots' : 2, 'cpus' : '0-7', 'lock_dir' : LOCK_DIR}) as command:
+            self.assertEqual(command, "taskset -c 0-3 bash -c 'vasp_std > log'")
@@ -0,0 +1,83 @@
+from context import fpop
+import os,shutil
+import dpdata
+import numpy as np
+import unittest
+from fpop.utils.frame_stream import iter_frames, get_frame_info
+from pathlib import Path
+from constants import POSCAR_1_content
+
+class TestIterFrames(unittest.TestCase):
+    def setUp(self):
+        self.nframes = 5
+        Path('POSCAR_stream').write_text(POSCAR_1_content)
+        ss = dpdata.System('POSCAR_stream', fmt='vasp/poscar')
+        for ii in range(1, self.nframes):
+            tmp = dpdata.System('POSCAR_stream', fmt='vasp/poscar')
+            tmp.data['coords'] += 0.1 * ii
+            tmp.data['cells'] *= 1. + 0.01 * ii
+            ss.append(tmp)
+        self.system = ss
+        # 3 sets of 2, 2 and 1 frames
+        ss.to('deepmd/npy', 'data.stream', set_size=2)
+
+    def tearDown(self):
+        os.remove('POSCAR_stream')
+        if Path('data.stream').is_dir():
+            shutil.rmtree('data.stream')
+        if Path('data.stream.hdf5').is_file():
+            os.remove('data.stream.hdf5')
+
+    def check_frames(self, frames):
+        self.assertEqual(len(frames), self.nframes)
+        for ii, ff in enumerate(frames):
+            ref = self.system[ii]
+            self.assertEqual(ff.get_nframes(), 1)
+            self.assertEqual(ff['atom_names'], ref['atom_names'])
+            self.assertEqual(ff['atom_numbs'], ref['atom_numbs'])
+            np.testing.assert_equal(ff['atom_types'], ref['atom_types'])
+            np.testing.assert_allclose(ff['cells'], ref['cells'])
+            np.testing.assert_allclose(ff['coords'], ref['coords'])
+
+    def test_npy(self):
+        for chunk_size in [1, 2, 3, 100]:
+            frames = list(iter_frames('data.stream', 'deepmd/npy', chunk_size))
+            self.check_frames(frames)
+        ref = dpdata.System('data.stream', fmt='deepmd/npy')
+        for ii, ff in enumerate(iter_frames('data.stream', 'deepmd/npy', 2)):
+            np.testing.assert_equal(ff['coords'], ref['coords'][ii:ii+1])
+
+    def test_npy_range(self):
+        for start, stop in [(0, 5), (1, 4), (2, 3), (3, None), (4, 100), (5, None)]:
+            frames = list(iter_frames('data.stream', 'deepmd/npy', 2, start, stop))
+            ref = range(self.nframes)[start:stop]
+            self.assertEqual(len(frames), len(ref))
+            for ff, ii in zip(frames, ref):
+                np.testing.assert_allclose(ff['coords'], self.system[ii]['coords'])
+
+    def test_frame_info(self):
+        self.assertEqual(get_frame_info('data.stream', 'deepmd/npy'), (self.nframes, 1))
+        self.system.to('deepmd/hdf5', 'data.stream.hdf5', set_size=2)
+        self.assertEqual(get_frame_info('data.stream.hdf5', 'deepmd/hdf5'), (self.nframes, 1))
+        self.assertEqual(get_frame_info('POSCAR_stream', 'vasp/poscar'), (1, 1))
+
+    def test_npy_nopbc(self):
+        Path('data.stream/nopbc').write_text('')
+        frames = list(iter_frames('data.stream', 'deepmd/npy', 2))
+        self.assertEqual(len(frames), self.nframes)
+        for ff in frames:
+            self.assertTrue(ff.nopbc)
+            np.testing.assert_equal(ff['cells'], np.zeros((1, 3, 3)))
+
+    def test_hdf5(self):
+        self.system.to('deepmd/hdf5', 'data.stream.hdf5', set_size=2)
+        frames = list(iter_frames('data.stream.hdf5', 'deepmd/hdf5', 3))
+        self.check_frames(frames)
+        frames = list(iter_frames('data.stream.hdf5', 'deepmd/hdf5', 3, 1, 4))
+        self.assertEqual(len(frames), 3)
+        np.testing.assert_allclose(frames[0]['coords'], self.system[1]['coords'])
+
+    def test_fallback(self):
+        frames = list(iter_frames('POSCAR_stream', 'vasp/poscar'))
+        self.assertEqual(len(frames), 1)
+        np.testing.assert_allclose(frames[0]['cells'], self.system[0]['cells'])
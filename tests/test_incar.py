@@ -0,0 +1,52 @@
+from context import fpop
+import unittest
+from fpop.utils.incar import (
+    incar_tags,
+    irreducible_kpoints,
+    tune_incar,
+    append_incar_tags,
+)
+
+class TestIncarTuning(unittest.TestCase):
+    def test_incar_tags(self):
+        incar = "ENCUT = 500 # the cutoff\nismear=0; SIGMA = 0.05\n! NCORE = 4\nSYSTEM = foo\n"
+        self.assertEqual(incar_tags(incar), {'ENCUT' : '500', 'ISMEAR' : '0', 'SIGMA' : '0.05', 'SYSTEM' : 'foo'})
+
+    def test_irreducible_kpoints(self):
+        self.assertEqual(irreducible_kpoints([1, 1, 1]), 1)
+        # gamma centered 4x4x4: 64 points, 8 of them are their own inverse
+        self.assertEqual(irreducible_kpoints([4, 4, 4], True), 36)
+        self.assertEqual(irreducible_kpoints([4, 4, 4], False), 32)
+        self.assertEqual(irreducible_kpoints([3, 3, 1], False), 5)
+        self.assertEqual(irreducible_kpoints([4, 4, 4], True, time_reversal=False), 64)
+
+    def test_tune(self):
+        # one k-point, all the cores in one k-point group
+        tuned = tune_incar({}, 128, 1, {'ncores' : 64})
+        self.assertEqual(tuned, {'KPAR' : '1', 'NCORE' : '8', 'LREAL' : 'Auto'})
+        # many k-points of a small cell
+        tuned = tune_incar({}, 2, 36, {'ncores' : 64})
+        self.assertEqual(tuned, {'KPAR' : '16', 'NCORE' : '2', 'LREAL' : '.FALSE.'})
+        tuned = tune_incar({}, 2, 36, {'ncores' : 64, 'min_cores_per_kpar' : 8, 'lreal_natoms' : 2})
+        self.assertEqual(tuned, {'KPAR' : '8', 'NCORE' : '4', 'LREAL' : 'Auto'})
+        # few cores
+        self.assertEqual(tune_incar({}, 8, 10, {'ncores' : 1, 'tags' : ['KPAR', 'NCORE']}), {'KPAR' : '1', 'NCORE' : '1'})
+
+    def test_template_wins(self):
+        tuned = tune_incar({'NPAR' : '4', 'LREAL' : '.FALSE.'}, 128, 10, {'ncores' : 64})
+        self.assertEqual(tuned, {'KPAR' : '8'})
+        tuned = tune_incar({'KPAR' : '2'}, 128, 10, {'ncores' : 64, 'tags' : ['NCORE']})
+        self.assertEqual(tuned, {'NCORE' : '4'})
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            tune_incar({}, 2, 1, {'ncores' : 0})
+        with self.assertRaises(ValueError):
+            tune_incar({}, 2, 1, {'ncores' : 4, 'tags' : ['ENCUT']})
+
+    def test_append(self):
+        self.assertEqual(append_incar_tags('ENCUT = 500', {}), 'ENCUT = 500')
+        self.assertEqual(
+            append_incar_tags('ENCUT = 500', {'KPAR' : '2'}),
+            'ENCUT = 500\n# performance tags set by fpop\nKPAR = 2\n',
+        )
@@ -0,0 +1,65 @@
+from context import fpop
+import os,shutil
+import jsonpickle
+import unittest
+from fpop.utils.input_files import FileRef, register_input_files, load_input_file, ref_files
+from fpop.vasp import VaspInputs
+from pathlib import Path
+
+class TestReferenceInputs(unittest.TestCase):
+    def setUp(self):
+        self.path = Path('input_files_test')
+        self.path.mkdir(exist_ok=True)
+        Path('template.incar').write_text('foo')
+        (self.path/'POTCAR_H').write_text('input files H\n' * 1000)
+        (self.path/'POTCAR_O').write_text('input files O\n' * 1000)
+
+    def tearDown(self):
+        register_input_files([])
+        os.remove('template.incar')
+        if self.path.is_dir():
+            shutil.rmtree(self.path)
+        if Path('shipped').is_dir():
+            shutil.rmtree('shipped')
+
+    def test_reference(self):
+        vi = VaspInputs(0.16, 'template.incar', {'H' : self.path/'POTCAR_H', 'O' : self.path/'POTCAR_O'}, True, reference=True)
+        self.assertEqual(vi.make_potcar(['O', 'H']), 'input files O\n' * 1000 + 'input files H\n' * 1000)
+        self.assertEqual(vi.potcars['H'], 'input files H\n' * 1000)
+        self.assertEqual(sorted(vi.ref_files()), [(self.path/'POTCAR_H').absolute(), (self.path/'POTCAR_O').absolute()])
+        # the pickled inputs do not hold the contents
+        ref = VaspInputs(0.16, 'template.incar', {'H' : self.path/'POTCAR_H', 'O' : self.path/'POTCAR_O'}, True)
+        self.assertLess(len(jsonpickle.dumps(vi)), 2000)
+        self.assertGreater(len(jsonpickle.dumps(ref)), 20000)
+        self.assertEqual(ref.ref_files(), [])
+
+    def test_shipped(self):
+        Path('shipped').mkdir()
+        (self.path/'POTCAR_H').write_text('shipped H\n')
+        vi = VaspInputs(0.16, 'template.incar', {'H' : self.path/'POTCAR_H'}, True, reference=True)
+        vi = jsonpickle.loads(jsonpickle.dumps(vi))
+        # the files are shipped under other names, and the sources are gone
+        for ii, ff in enumerate(vi.ref_files()):
+            shutil.copyfile(ff, Path('shipped')/('%d' % ii))
+        shutil.rmtree(self.path)
+        with self.assertRaises(FileNotFoundError):
+            vi.make_potcar(['H'])
+        register_input_files(sorted(Path('shipped').iterdir()))
+        self.assertEqual(vi.make_potcar(['H']), 'shipped H\n')
+
+    def test_changed(self):
+        (self.path/'POTCAR_H').write_text('changed H\n')
+        fr = FileRef(self.path/'POTCAR_H')
+        (self.path/'POTCAR_H').write_text('changed again H\n')
+        with self.assertRaises(FileNotFoundError):
+            fr.read_text()
+
+    def test_ref_files(self):
+        class Foo():
+            pass
+        foo = Foo()
+        foo.a = FileRef(self.path/'POTCAR_H')
+        foo.b = {'x' : ('POTCAR_O', FileRef(self.path/'POTCAR_O')), 'y' : 'text'}
+        foo.c = [FileRef(self.path/'POTCAR_H')]
+        self.assertEqual(ref_files(foo), [(self.path/'POTCAR_H').absolute(), (self.path/'POTCAR_O').absolute()])
+        self.assertEqual(load_input_file(foo.a.digest, foo.a.path), ('input files H\n' * 1000).encode())
@@ -0,0 +1,40 @@
+from context import fpop
+import os,shutil
+import dpdata
+import numpy as np
+import unittest
+from fpop.utils.labels import LabelWriter
+from pathlib import Path
+
+class TestLabelWriter(unittest.TestCase):
+    def tearDown(self):
+        if Path('labels_test').is_dir():
+            shutil.rmtree('labels_test')
+
+    def test_write(self):
+        rng = np.random.default_rng(0)
+        cells = rng.normal(size=(4, 3, 3))
+        coords = rng.normal(size=(4, 3, 3))
+        forces = rng.normal(size=(4, 3, 3))
+        virials = rng.normal(size=(4, 3, 3))
+        with LabelWriter('labels_test', ['O', 'H'], [0, 1, 1]) as writer:
+            for ii in range(4):
+                writer.append(cells[ii], coords[ii], -1. * ii, forces[ii], virials[ii])
+        ss = dpdata.LabeledSystem('labels_test', fmt='deepmd/npy')
+        self.assertEqual(ss['atom_names'], ['O', 'H'])
+        self.assertEqual(ss['atom_numbs'], [1, 2])
+        np.testing.assert_equal(ss['cells'], cells)
+        np.testing.assert_equal(ss['coords'], coords)
+        np.testing.assert_equal(ss['forces'], forces)
+        np.testing.assert_equal(ss['virials'], virials)
+        np.testing.assert_equal(ss['energies'], [0., -1., -2., -3.])
+        self.assertEqual(len(list(Path('labels_test/set.000').glob('*.tmp'))), 0)
+
+    def test_without_virial(self):
+        writer = LabelWriter('labels_test', ['O', 'H'], [0, 1, 1])
+        writer.append(np.eye(3), np.zeros([3, 3]), 0., np.zeros([3, 3]), np.eye(3))
+        writer.append(np.eye(3), np.zeros([3, 3]), 0., np.zeros([3, 3]))
+        with self.assertRaises(ValueError):
+            writer.append(np.eye(3), np.zeros([2, 3]), 0., np.zeros([2, 3]))
+        self.assertEqual(writer.close(), 2)
+        self.assertEqual(sorted(os.listdir('labels_test/set.000')), ['box.npy', 'coord.npy', 'energy.npy', 'force.npy'])
@@ -0,0 +1,63 @@
+from context import fpop
+import unittest
+from unittest import mock
+from fpop.utils.launcher import (
+    available_cpus,
+    make_launch_command,
+)
+
+class TestLauncher(unittest.TestCase):
+    def test_auto_ranks(self):
+        cmd = make_launch_command({'executable' : 'vasp_std'}, 16)
+        self.assertEqual(cmd, 'export OMP_NUM_THREADS=1 && mpirun -np 16 vasp_std')
+        cmd = make_launch_command({'executable' : 'vasp_std', 'threads' : 4, 'mpi' : 'openmpi', 'binding' : 'core'}, 16)
+        self.assertEqual(cmd, 'export OMP_NUM_THREADS=4 && mpirun -np 4 --map-by slot:PE=4 --bind-to core vasp_std')
+
+    def test_auto_threads(self):
+        cmd = make_launch_command({'executable' : 'cp2k.psmp', 'ranks' : 4, 'threads' : 'auto', 'mpi' : 'openmpi', 'binding' : 'socket'}, 32)
+        self.assertEqual(cmd, 'export OMP_NUM_THREADS=8 && mpirun -np 4 --bind-to socket cp2k.psmp')
+
+    def test_available_cpus(self):
+        with mock.patch('fpop.utils.launcher._cgroup_cpu_limit', return_value=1):
+            self.assertEqual(available_cpus(), 1)
+            cmd = make_launch_command({'executable' : 'abacus'})
+            self.assertEqual(cmd, 'export OMP_NUM_THREADS=1 && mpirun -np 1 abacus')
+
+    def test_intelmpi(self):
+        cmd = make_launch_command({'executable' : 'vasp_std', 'threads' : 4, 'mpi' : 'intelmpi', 'binding' : 'core'}, 16)
+        self.assertEqual(cmd, 'export OMP_NUM_THREADS=4 && mpirun -np 4 -genv I_MPI_PIN_DOMAIN=omp vasp_std')
+        cmd = make_launch_command({'executable' : 'vasp_std', 'mpi' : 'intelmpi', 'binding' : 'socket'}, 16)
+        self.assertEqual(cmd, 'export OMP_NUM_THREADS=1 && mpirun -np 16 -genv I_MPI_PIN_DOMAIN=socket vasp_std')
+
+    def test_srun(self):
+        cmd = make_launch_command({
+            'executable' : 'vasp_std',
+            'launcher' : 'srun',
+            'threads' : 2,
+            'binding' : 'core',
+            'args' : '--mpi=pmi2',
+        }, 8)
+        self.assertEqual(cmd, 'export OMP_NUM_THREADS=2 && srun -n 4 -c 2 --cpu-bind=cores --mpi=pmi2 vasp_std')
+
+    def test_none(self):
+        cmd = make_launch_command({
+            'executable' : 'abacus',
+            'launcher' : 'none',
+            'threads' : 'auto',
+            'prefix' : 'source env.sh',
+            'env' : {'OMP_PROC_BIND' : 'close', 'FOO' : 'a b'},
+        }, 8)
+        self.assertEqual(cmd, "source env.sh && export OMP_NUM_THREADS=8 OMP_PROC_BIND=close FOO='a b' && abacus")
+        with self.assertRaises(ValueError):
+            make_launch_command({'executable' : 'abacus', 'launcher' : 'none', 'ranks' : 4}, 8)
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            make_launch_command({'launcher' : 'mpirun'}, 8)
+        with self.assertRaises(ValueError):
+            make_launch_command({'executable' : 'vasp_std', 'launcher' : 'aprun'}, 8)
+        with self.assertRaises(ValueError):
+            make_launch_command({'executable' : 'vasp_std', 'mpi' : 'openmpi', 'binding' : 'numa'}, 8)
+        with self.assertRaises(ValueError):
+            # the binding flags of mpirun depend on the MPI flavor
+            make_launch_command({'executable' : 'vasp_std', 'binding' : 'core'}, 8)
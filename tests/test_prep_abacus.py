@@ -78,6 +78,8 @@ class TestPrepAbacus(unittest.TestCase):
         for ii in self.confs:
             if ii.is_dir():
                 shutil.rmtree(ii)
+        if os.path.isdir('shared_files'):
+            shutil.rmtree('shared_files')
 
     def checkfile(self):
         tdirs = []
@@ -120,6 +122,57 @@ class TestPrepAbacusDpConf(TestPrepAbacus,unittest.TestCase):
         for ii in out['task_names']:
             self.assertEqual(Path(Path(ii)/'TEST').read_text(), "here test")
      
+    def testKspacing(self):
+        from fpop.utils.kpoints import make_kspacing_kpoints_mesh
+        abacus_inputs = AbacusInputs(
+            input_file=self.source_path/"INPUT",
+            pp_files={"Na":self.source_path/"Na.upf"},
+            orb_files={"Na":self.source_path/"Na.orb"},
+            kspacing=0.2,
+        )
+        op = PrepAbacus()
+        out = op.execute(
+            OPIO(
+                {
+                    "confs" : self.confs,
+                    "inputs" : abacus_inputs,
+                    "type_map" : self.type_map,
+                }
+            )
+        )
+        for ii, conf in zip(out['task_names'], self.confs):
+            cells = dpdata.System(conf, fmt='deepmd/npy')['cells']
+            kp = make_kspacing_kpoints_mesh(cells, 0.2)[0]
+            self.assertEqual((Path(ii)/'KPT').read_text(), "K_POINTS\n0\nGamma\n%d %d %d 0 0 0\n" % tuple(kp))
+
+    def testPpOrbDir(self):
+        from fpop.abacus import RunAbacus
+        from fpop.utils.shared_files import resolve_shared_files
+        op = PrepAbacus()
+        out = op.execute(
+            OPIO(
+                {
+                    "prep_image_config" : {"pp_orb_dir" : True},
+                    "confs" : self.confs,
+                    "inputs" : self.abacus_inputs,
+                    "type_map" : self.type_map,
+                }
+            )
+        )
+        self.assertEqual([ii.name for ii in out['shared_files']], ['pp_orb'])
+        self.assertEqual(sorted(os.listdir(out['shared_files'][0])), ['Na.orb', 'Na.upf'])
+        for ii in out['task_names']:
+            self.assertFalse((Path(ii)/'Na.upf').exists())
+            self.assertFalse((Path(ii)/'Na.orb').exists())
+            input_lines = (Path(ii)/'INPUT').read_text().split('\n')
+            self.assertIn('pseudo_dir ./pp_orb/', input_lines)
+            self.assertIn('orbital_dir ./pp_orb/', input_lines)
+            staged = resolve_shared_files(ii, out['shared_files'], Path('shared_files')/'staged'/ii)
+            self.assertEqual(sorted(RunAbacus().input_files(staged)), ['INPUT', 'KPT', 'STRU', 'pp_orb'])
+            self.assertEqual((staged/'pp_orb'/'Na.upf').read_text(), 'here upf')
+        # the template of the inputs is not changed
+        self.assertNotIn('pseudo_dir', self.abacus_inputs.get_input())
+
     def testWithoutOptionalArtifact(self):
         op = PrepAbacus()
         out = op.execute(
@@ -137,6 +190,36 @@ class TestPrepAbacusDpConf(TestPrepAbacus,unittest.TestCase):
         self.assertEqual(tdirs, out['task_names'])
         self.assertEqual(tdirs, [str(ii) for ii in out['task_paths']])
 
+
+class TestMakeStru(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.system = dpdata.System(data={
+            "atom_names" : ["H", "O", "C"],
+            "atom_numbs" : [3, 0, 2],
+            "atom_types" : np.array([2, 0, 0, 2, 0]),
+            "orig" : np.zeros(3),
+            "cells" : rng.normal(size=(3, 3, 3)) * 5.,
+            "coords" : rng.normal(size=(3, 5, 3)) * 3.,
+        })
+
+    def tearDown(self):
+        if os.path.isfile('STRU.ref'):
+            os.remove('STRU.ref')
+
+    def test_same_as_dpdata(self):
+        from fpop.abacus import make_stru
+        for kwargs in [
+            {"pp_file" : ["H.upf", "O.upf", "C.upf"]},
+            {"pp_file" : ["H.upf", "O.upf", "C.upf"], "numerical_orbital" : ["H.orb", "O.orb", "C.orb"],
+             "numerical_descriptor" : "jle.orb", "mass" : [1.008, 15.999, 12.011]},
+        ]:
+            for ii in range(3):
+                self.system.to('abacus/stru', 'STRU.ref', frame_idx=ii, **kwargs)
+                self.assertEqual(make_stru(self.system.data, frame_idx=ii, **kwargs), Path('STRU.ref').read_text())
+        with self.assertRaises(ValueError):
+            make_stru(self.system.data, ["H.upf"])
+
    
 @unittest.skipIf(skip_ut_with_dflow, skip_ut_with_dflow_reason)
 class TestPrepAbacusConf(TestPrepAbacus,unittest.TestCase):
@@ -101,6 +101,9 @@ class TestPrepCp2kDpConf(unittest.TestCase):
         tdirs = check_cp2k_tasks(self, self.ntasks)
         self.assertEqual(tdirs, out['task_names'])
         self.assertEqual(tdirs, [str(ii) for ii in out['task_paths']])
+        # no files other than the inputs are written to the task
+        for ii in tdirs:
+            self.assertEqual(sorted(os.listdir(ii)), ['CELL_PARAMETER','coord.xyz','input.inp'])
      
     def testWithoutOptionalParameter(self):
         op = PrepCp2k()
@@ -117,7 +120,40 @@ class TestPrepCp2kDpConf(unittest.TestCase):
         tdirs = check_cp2k_tasks(self, self.ntasks)
         self.assertEqual(tdirs, out['task_names'])
         self.assertEqual(tdirs, [str(ii) for ii in out['task_paths']])
+        # no files other than the inputs are written to the task
+        for ii in tdirs:
+            self.assertEqual(sorted(os.listdir(ii)), ['CELL_PARAMETER','coord.xyz','input.inp'])
     
+class TestMakeCoord(unittest.TestCase):
+    def setUp(self):
+        self.data = {
+            "atom_names" : ["H", "O", "C"],
+            "atom_numbs" : [2, 0, 1],
+            "atom_types" : np.array([2, 0, 0]),
+            "orig" : np.zeros(3),
+            "cells" : np.array([np.eye(3) * 10., np.diag([1., 2., 3.])]),
+            "coords" : np.array([
+                [[0., 0., 0.], [1., 2., 3.], [-1.5, 0.25, 1e-9]],
+                [[0.1, 0.2, 0.3], [4., 5., 6.], [7., 8., 9.]],
+            ]),
+        }
+
+    def test_coords(self):
+        from fpop.cp2k import make_coord
+        self.assertEqual(make_coord(self.data),
+            "H        1.00000000       2.00000000       3.00000000\n"
+            "H       -1.50000000       0.25000000       0.00000000\n"
+            "C        0.00000000       0.00000000       0.00000000\n")
+        self.assertEqual(make_coord(self.data, 1).splitlines()[0],
+            "H        4.00000000       5.00000000       6.00000000")
+
+    def test_cell_parameters(self):
+        from fpop.cp2k import make_cell_parameter
+        self.assertEqual(make_cell_parameter(self.data, 1),
+            "A     1.00000000     0.00000000     0.00000000\n"
+            "B     0.00000000     2.00000000     0.00000000\n"
+            "C     0.00000000     0.00000000     3.00000000\n")
+
 @unittest.skipIf(skip_ut_with_dflow, skip_ut_with_dflow_reason)
 class TestPrepRunCp2kPoscarConf(unittest.TestCase):
     '''
@@ -74,7 +74,7 @@ def dump_conf_from_poscar(
         for ii in range(len(conf_list)):
             ls = dpdata.System("POSCAR_%d"%ii, fmt="vasp/poscar")
             ls.to_deepmd_npy("data.%03d"%ii) # type: ignore
-            confs.append("data.%03d")
+            confs.append("data.%03d"%ii)
             os.remove("POSCAR_%d"%ii)
         return confs
     elif type == "vasp/poscar":
@@ -237,3 +237,112 @@ class TestPrepRunVasp(unittest.TestCase):
         task_names = ["task.%06d" % ii for ii in range(self.ntasks)]
         for ii in task_names:
             self.check_prep_run_vasp_output(ii)
+
+
+@unittest.skipIf(skip_ut_with_dflow, skip_ut_with_dflow_reason)
+class TestPrepRunVaspGroup(unittest.TestCase):
+    '''
+    The run-fp steps fanned out in groups of tasks, deepmd/npy confs.
+    '''
+    def setUp(self):
+        self.ntasks = 3
+        confs = dump_conf_from_poscar("deepmd/npy",[POSCAR_1_content, POSCAR_2_content, POSCAR_1_content])
+        self.confs = [Path(ii) for ii in confs]
+        self.incar = 'incar'
+        Path(self.incar).write_text("This is INCAR")
+        self.potcar = 'potcar'
+        Path(self.potcar).write_text('This is POTCAR')
+        self.type_map = ['Na']
+
+    def tearDown(self):
+        for ii in range(self.ntasks):
+            work_path = Path("task.%06d" % ii)
+            if work_path.is_dir():
+                shutil.rmtree(work_path)
+        for ii in [self.incar, self.potcar]:
+            if Path(ii).is_file():
+                os.remove(ii)
+        for ii in self.confs:
+            if ii.is_dir():
+                shutil.rmtree(ii)
+
+    def run_group(self, wf_name, **kwargs):
+        steps = PrepRunFp(
+            "prep-run-vasp",
+            PrepVasp,
+            MockedRunVasp,
+            prep_image = default_image,
+            run_image = default_image,
+            run_group_size = 2,
+            **kwargs,
+        )
+        vasp_inputs = VaspInputs(
+            0.3,
+            self.incar,
+            {'Na' : self.potcar},
+            True,
+        )
+        prep_run_step = Step(
+            'prep-run-step' , 
+            template = steps,
+            parameters = {
+                'type_map' : self.type_map,
+                'inputs' : vasp_inputs,
+                'backward_list' : ['POSCAR','POTCAR'],
+                'backward_dir_name' : 'my_backward',
+                'log_name' : 'my_log',
+            },
+            artifacts = {
+                "confs" : upload_artifact(self.confs),
+            },
+        )
+
+        wf = Workflow(name=wf_name)
+        wf.add(prep_run_step)
+        wf.submit()
+
+        while wf.query_status() in ["Pending", "Running"]:
+            time.sleep(4)
+
+        assert(wf.query_status() == 'Succeeded')
+        step = wf.query_step(name="prep-run-step")[0]
+        download_artifact(step.outputs.artifacts["backward_dirs"])
+
+        for ii in range(self.ntasks):
+            backward_dir = Path("task.%06d" % ii) / "my_backward"
+            for jj in ['POSCAR','POTCAR','my_log']:
+                self.assertTrue((backward_dir/jj).is_file())
+
+    def test(self):
+        self.run_group("prerunvaspgroup")
+
+    def test_manifest(self):
+        self.run_group("prerunvaspgroupmanifest", task_manifest = True)
+
+    def test_group_parameters(self):
+        steps = PrepRunFp(
+            "prep-run-vasp",
+            PrepVasp,
+            MockedRunVasp,
+            prep_image = default_image,
+            run_image = default_image,
+            run_group_size = 2,
+        )
+        # the groups read the task names from the manifest
+        group_step = steps.steps[-1]
+        self.assertNotIn("task_name", group_step.inputs.parameters)
+        self.assertNotIn("task_index", group_step.inputs.parameters)
+        self.assertIn("task_manifest", group_step.inputs.artifacts)
+
+    def test_shards(self):
+        with self.assertRaises(ValueError):
+            PrepRunFp(
+                "prep-run-vasp",
+                PrepVasp,
+                MockedRunVasp,
+                prep_image = default_image,
+                run_image = default_image,
+                run_group_size = 2,
+                prep_shards = 2,
+            )
+
@@ -24,6 +24,7 @@ from dflow.python import (
     OPIOSign,
     Artifact,
     upload_packages,
+    FatalError,
 )
 
 import time, shutil, dpdata
@@ -37,6 +38,7 @@ from context import (
         skip_ut_with_dflow_reason,
         )
 from fpop.vasp import PrepVasp,VaspInputs
+from fpop.utils.task_manifest import read_task_name, TASK_MANIFEST_DIR
 from typing import List
 from constants import POSCAR_1_content,POSCAR_2_content,dump_conf_from_poscar
 upload_packages.append("../fpop")
@@ -89,6 +91,14 @@ class TestPrepVaspDpConf(unittest.TestCase):
         for ii in self.confs:
             if ii.is_dir():
                 shutil.rmtree(ii)
+        if Path('shared_files').is_dir():
+            shutil.rmtree('shared_files')
+        for ii in Path('.').glob('tasks.*.zip'):
+            os.remove(ii)
+        if Path('unpacked').is_dir():
+            shutil.rmtree('unpacked')
+        for ii in Path('.').glob('bucket.*'):
+            shutil.rmtree(ii)
 
     def test(self):
         op = PrepVasp()
@@ -133,7 +143,262 @@ class TestPrepVaspDpConf(unittest.TestCase):
         tdirs = check_vasp_tasks(self, self.ntasks)
         self.assertEqual(tdirs, out['task_names'])
         self.assertEqual(tdirs, [str(ii) for ii in out['task_paths']])
-    
+
+    def testParallel(self):
+        op = PrepVasp()
+        vasp_inputs = VaspInputs(
+            0.3,
+            self.incar,
+            {'Na':self.potcar},
+            True,
+        )
+        out = op.execute(
+            OPIO(
+                {
+                    "prep_image_config" : {"n_parallel" : 2},
+                    "confs" : self.confs,
+                    "inputs" : vasp_inputs,
+                    "type_map" : self.type_map,
+                }
+            )
+        )
+        tdirs = check_vasp_tasks(self, self.ntasks)
+        self.assertEqual(tdirs, out['task_names'])
+        self.assertEqual(tdirs, [str(ii) for ii in out['task_paths']])
+        # the frames are dispatched in order
+        for ii, conf in zip(tdirs, self.confs):
+            ref = dpdata.System(conf, fmt='deepmd/npy')
+            ss = dpdata.System(Path(ii)/'POSCAR', fmt='vasp/poscar')
+            np.testing.assert_allclose(ss['cells'], ref['cells'], atol=1e-6)
+
+    def testShard(self):
+        vasp_inputs = VaspInputs(
+            0.3,
+            self.incar,
+            {'Na':self.potcar},
+            True,
+        )
+        tdirs = []
+        for ii in range(3):
+            op = PrepVasp()
+            op.slices = {"task_names" : ii, "task_paths" : ii, "n_tasks" : ii}
+            out = op.execute(
+                OPIO(
+                    {
+                        "confs" : self.confs,
+                        "inputs" : vasp_inputs,
+                        "type_map" : self.type_map,
+                        "shard_index" : ii,
+                        "n_shards" : 3,
+                    }
+                )
+            )
+            self.assertEqual(out['n_tasks'], len(out['task_names']))
+            # the outputs are stacked by the global task index
+            self.assertEqual(op.slices['task_names'], [int(nn.split('.')[-1]) for nn in out['task_names']])
+            self.assertEqual(op.slices['n_tasks'], ii)
+            tdirs += out['task_names']
+        self.assertEqual(tdirs, check_vasp_tasks(self, self.ntasks))
+
+    def testSharedFiles(self):
+        from fpop.utils.shared_files import resolve_shared_files, SHARED_FILES_MANIFEST
+        op = PrepVasp()
+        vasp_inputs = VaspInputs(
+            0.3,
+            self.incar,
+            {'Na':self.potcar},
+            True,
+        )
+        out = op.execute(
+            OPIO(
+                {
+                    "prep_image_config" : {"shared_files" : True},
+                    "confs" : self.confs,
+                    "inputs" : vasp_inputs,
+                    "type_map" : self.type_map,
+                }
+            )
+        )
+        # INCAR and POTCAR are stored once
+        self.assertEqual(len(out['shared_files']), 2)
+        for ii in out['task_names']:
+            self.assertFalse((Path(ii)/'INCAR').exists())
+            self.assertTrue((Path(ii)/'POSCAR').is_file())
+            self.assertTrue((Path(ii)/SHARED_FILES_MANIFEST).is_file())
+            staged = resolve_shared_files(ii, out['shared_files'], Path('shared_files')/'staged'/ii)
+            self.assertEqual((staged/'INCAR').read_text(), 'here incar')
+            self.assertEqual((staged/'POTCAR').read_text(), 'here potcar')
+            self.assertTrue((staged/'KPOINTS').is_file())
+
+    def testIncarTuning(self):
+        op = PrepVasp()
+        vasp_inputs = VaspInputs(
+            0.3,
+            self.incar,
+            {'Na':self.potcar},
+            True,
+            incar_tuning={'ncores' : 4},
+        )
+        out = op.execute(
+            OPIO(
+                {
+                    "confs" : self.confs,
+                    "inputs" : vasp_inputs,
+                    "type_map" : self.type_map,
+                }
+            )
+        )
+        for ii in out['task_names']:
+            incar = (Path(ii)/'INCAR').read_text()
+            self.assertTrue(incar.startswith('here incar\n'))
+            tags = dict([jj.split(' = ') for jj in incar.splitlines()[2:]])
+            self.assertEqual(set(tags.keys()), {'KPAR', 'NCORE', 'LREAL'})
+            self.assertEqual(tags['LREAL'], '.FALSE.')
+
+    def testPack(self):
+        from fpop.utils.task_archive import extract_task
+        vasp_inputs = VaspInputs(
+            0.3,
+            self.incar,
+            {'Na':self.potcar},
+            True,
+        )
+        op = PrepVasp()
+        out = op.execute(
+            OPIO(
+                {
+                    "confs" : self.confs,
+                    "inputs" : vasp_inputs,
+                    "type_map" : self.type_map,
+                    "pack_size" : 1,
+                }
+            )
+        )
+        self.assertEqual(out['task_names'], ['task.000000', 'task.000001'])
+        self.assertEqual([str(ii) for ii in out['task_paths']], ['tasks.000000.zip', 'tasks.000001.zip'])
+        self.assertFalse(Path('task.000000').exists())
+        for ii, archive in zip(out['task_names'], out['task_paths']):
+            extract_task(archive, ii, 'unpacked')
+        with self.assertRaises(FileNotFoundError):
+            extract_task(out['task_paths'][0], 'task.000001', 'unpacked')
+        os.chdir('unpacked')
+        try:
+            check_vasp_tasks(self, self.ntasks)
+        finally:
+            os.chdir('..')
+
+    def testTaskManifest(self):
+        vasp_inputs = VaspInputs(
+            0.3,
+            self.incar,
+            {'Na':self.potcar},
+            True,
+        )
+        manifests = []
+        for ii in range(2):
+            op = PrepVasp()
+            op.slices = {"task_names" : ii, "task_paths" : ii, "n_tasks" : ii, "task_manifest" : ii}
+            out = op.execute(
+                OPIO(
+                    {
+                        "confs" : self.confs,
+                        "inputs" : vasp_inputs,
+                        "type_map" : self.type_map,
+                        "shard_index" : ii,
+                        "n_shards" : 2,
+                        "list_task_names" : False,
+                        "write_manifest" : True,
+                    }
+                )
+            )
+            self.assertEqual(out['task_names'], [])
+            self.assertEqual(out['n_tasks'], 1)
+            self.assertEqual(op.slices['task_names'], [])
+            self.assertEqual(op.slices['task_paths'], [ii])
+            manifests += out['task_manifest']
+        tdirs = check_vasp_tasks(self, self.ntasks)
+        for ii in range(self.ntasks):
+            self.assertEqual(read_task_name(manifests, ii), tdirs[ii])
+        with self.assertRaises(KeyError):
+            read_task_name(manifests, self.ntasks)
+        shutil.rmtree(TASK_MANIFEST_DIR)
+
+    def testNoTaskManifest(self):
+        vasp_inputs = VaspInputs(
+            0.3,
+            self.incar,
+            {'Na':self.potcar},
+            True,
+        )
+        op_in = {
+            "confs" : self.confs,
+            "inputs" : vasp_inputs,
+            "type_map" : self.type_map,
+        }
+        # the manifest is only written on request
+        out = PrepVasp().execute(OPIO(op_in))
+        self.assertEqual(out['task_manifest'], [])
+        self.assertFalse(Path(TASK_MANIFEST_DIR).exists())
+        with self.assertRaises(FatalError):
+            PrepVasp().execute(OPIO({**op_in, "list_task_names" : False}))
+
+    def testNestedLayout(self):
+        vasp_inputs = VaspInputs(
+            0.3,
+            self.incar,
+            {'Na':self.potcar},
+            True,
+        )
+        op = PrepVasp()
+        out = op.execute(
+            OPIO(
+                {
+                    "confs" : self.confs,
+                    "inputs" : vasp_inputs,
+                    "type_map" : self.type_map,
+                    "task_name_width" : 9,
+                    "task_bucket_size" : 1,
+                    "group_size" : 1,
+                }
+            )
+        )
+        self.assertEqual(out['task_names'], ['task.000000000', 'task.000000001'])
+        self.assertEqual(out['task_paths'], [Path('bucket.000000/task.000000000'), Path('bucket.000001/task.000000001')])
+        self.assertEqual(out['task_groups'], [{"start" : 0, "count" : 1}, {"start" : 1, "count" : 1}])
+        for ii in out['task_paths']:
+            self.assertTrue((ii/'POSCAR').is_file())
+            self.assertEqual((ii/'INCAR').read_text(), 'here incar')
+
+    def testShardRange(self):
+        from fpop.prep_fp import _shard_range
+        frame_info = [(4, 1), (2, 3), (4, 1)]
+        ranges = [_shard_range(frame_info, ii, 3) for ii in range(3)]
+        self.assertEqual(ranges, [(0, 3), (3, 6), (6, 10)])
+        # 4 + 6 + 4 atoms
+        ranges = [_shard_range(frame_info, ii, 2, "atoms") for ii in range(2)]
+        self.assertEqual(ranges, [(0, 5), (5, 10)])
+        # aligned to archives of 4 tasks
+        ranges = [_shard_range(frame_info, ii, 3, "frames", 4) for ii in range(3)]
+        self.assertEqual(ranges, [(0, 0), (0, 4), (4, 10)])
+        ranges = [_shard_range(frame_info, ii, 12) for ii in range(12)]
+        self.assertEqual(sum([ee - bb for bb, ee in ranges]), 10)
+        self.assertEqual(ranges[-1][1], 10)
+
+class TestMakePoscar(unittest.TestCase):
+    def test_same_as_dpdata(self):
+        from fpop.vasp import make_poscar
+        rng = np.random.default_rng(0)
+        system = dpdata.System(data={
+            "atom_names" : ["H", "O", "C"],
+            "atom_numbs" : [3, 0, 2],
+            "atom_types" : np.array([2, 0, 0, 2, 0]),
+            "orig" : np.zeros(3),
+            "cells" : rng.normal(size=(3, 3, 3)) * 5.,
+            "coords" : rng.normal(size=(3, 5, 3)) * 3.,
+        })
+        for ii in range(3):
+            self.assertEqual(make_poscar(system.data, ii), system.to('vasp/string', frame_idx=ii))
+
 @unittest.skipIf(skip_ut_with_dflow, skip_ut_with_dflow_reason)
 class TestPrepRunVaspPoscarConf(unittest.TestCase):
     '''
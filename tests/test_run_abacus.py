@@ -1,6 +1,7 @@
 import unittest,os
 from dflow.python import OPIO,TransientError
 import shutil
+import numpy as np
 from pathlib import Path
 from mock import mock, patch, call
 from context import fpop
@@ -8,6 +9,29 @@ from fpop.abacus import RunAbacus
 from mocked_ops import MockedRunVasp
 from constants import STRU1_content
 
+def make_scf_log(converged = True):
+    # a minimal running_scf.log of the Ga4 As4 system in STRU1_content
+    rng = np.random.default_rng(0)
+    force = rng.normal(size=(8, 3))
+    stress = rng.normal(size=(3, 3))
+    ret = " READING GENERAL INFORMATION\n                           global_out_dir = OUT.ABACUS/\n\n"
+    ret += " ELEC=    1  --------------------------------\n"
+    if converged:
+        ret += "\n charge density convergence is achieved\n final etot is -1234.5678901 eV\n\n"
+    else:
+        ret += "\n !! convergence has not been achieved @_@\n\n"
+    ret += " ><><><><><><><><><><><><><><><><><><><><><><\n\n TOTAL-FORCE (eV/Angstrom)\n\n ><><><><><><><><><><><><><><><><><><><><><><\n\n"
+    ret += "                     atom              x              y              z\n"
+    for ii, ee in enumerate(["Ga"] * 4 + ["As"] * 4):
+        ret += "                     %s%d " % (ee, ii % 4 + 1) + " ".join(["%14.9f" % xx for xx in force[ii]]) + "\n"
+    ret += "\n ><><><><><><><><><><><><><><><><><><><><><><\n\n TOTAL-STRESS (KBAR)\n\n ><><><><><><><><><><><><><><><><><><><><><><\n\n"
+    for vv in stress:
+        ret += "    " + " ".join(["%14.9f" % xx for xx in vv]) + "\n"
+    ret += " TOTAL-PRESSURE: 0.0 KBAR\n\n"
+    ret += " Total  Time  : 1 h 0 mins 0 secs \n"
+    return ret
+
+
 class TestRunAbacus(unittest.TestCase):
     def setUp(self):
 
@@ -39,6 +63,7 @@ class TestRunAbacus(unittest.TestCase):
     def test_inputfiles(self):
         op = RunAbacus()
         inputfiles = op.input_files(self.task_path)
+        self.assertEqual(os.getcwd(), self.cwd)
         ref = ["INPUT","KPT","STRU","Ga_ONCV_PBE-1.0.upf","As_ONCV_PBE-1.0.upf","Ga_gga_9au_100Ry_2s2p2d.orb","As_gga_8au_100Ry_2s2p1d.orb","jle.orb"]
         ref.sort()
         inputfiles.sort()
@@ -136,3 +161,57 @@ class TestRunAbacus(unittest.TestCase):
             call(' '.join(['myabacus', '>', 'log']), raise_error=False, try_bash=True, shell=True),
         ]
         mocked_run.assert_has_calls(calls)
+
+    def test_extract_labels(self):
+        import dpdata
+        from fpop.abacus import extract_abacus_labels
+        (self.task_path/'OUT.ABACUS').mkdir()
+        (self.task_path/'OUT.ABACUS'/'running_scf.log').write_text(make_scf_log())
+        self.assertEqual(extract_abacus_labels(self.task_path, self.task_path/'labels'), 1)
+        ref = dpdata.LabeledSystem(str(self.task_path), fmt='abacus/scf')
+        ss = dpdata.LabeledSystem(str(self.task_path/'labels'), fmt='deepmd/npy')
+        self.assertEqual(ss['atom_names'], ref['atom_names'])
+        np.testing.assert_equal(ss['atom_types'], ref['atom_types'])
+        for kk in ['cells', 'coords', 'energies', 'forces', 'virials']:
+            np.testing.assert_allclose(ss[kk], ref[kk], err_msg=kk)
+
+    def test_extract_labels_not_converged(self):
+        from fpop.abacus import extract_abacus_labels
+        (self.task_path/'OUT.ABACUS').mkdir()
+        (self.task_path/'OUT.ABACUS'/'running_scf.log').write_text(make_scf_log(converged=False).replace(
+            'convergence has not', 'final etot is -1.0 eV\n convergence has not'))
+        self.assertEqual(extract_abacus_labels(self.task_path, self.task_path/'labels'), 0)
+        self.assertEqual(extract_abacus_labels(self.task_path, self.task_path/'labels.all', convergence_check=False), 1)
+
+    @patch('fpop.abacus.run_command')
+    def test_success_backward_filter(self, mocked_run):
+        mocked_run.side_effect = [ (0, 'out\n', '') ]
+        out_dir = Path(self.task_name)/'OUT.ABACUS'
+        out_dir.mkdir()
+        (out_dir/'running_scf.log').write_text(make_scf_log())
+        (out_dir/'SPIN1_CHG.cube').write_text('here chg')
+        (out_dir/'WFC').mkdir()
+        (out_dir/'WFC'/'WFC_NAO_K1.txt').write_text('here wfc')
+        op = RunAbacus()
+        def new_check_run_success(obj,logfile):
+            return True
+        with mock.patch.object(RunAbacus, "check_run_success", new=new_check_run_success):
+            out = op.execute(
+                OPIO({
+                    'run_image_config' :{
+                        'command' : 'myabacus',
+                    },
+                    'task_name' : self.task_name,
+                    'task_path' : self.task_path,
+                    'backward_list' : ['OUT.*', 'STRU'],
+                    'backward_dir_name' : 'our_backward',
+                    'log_name' : 'our_log',
+                    'optional_input' : {'backward_filter' : ['running_*.log'], 'extract_labels' : True},
+                })
+            )
+        backward = out['backward_dir']
+        self.assertEqual(sorted(os.listdir(backward)), ['OUT.ABACUS', 'STRU', 'labels', 'our_log'])
+        self.assertEqual(sorted(os.listdir(backward/'OUT.ABACUS')), ['WFC', 'running_scf.log'])
+        self.assertEqual(os.listdir(backward/'OUT.ABACUS'/'WFC'), [])
+        self.assertEqual((backward/'labels'/'type_map.raw').read_text(), 'Ga\nAs\n')
+        self.assertEqual(np.load(backward/'labels'/'set.000'/'force.npy').shape, (1, 24))
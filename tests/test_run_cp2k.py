@@ -1,12 +1,59 @@
 import unittest,os
 from dflow.python import OPIO,TransientError
 import shutil
+import numpy as np
 from pathlib import Path
 from mock import mock, patch, call
 from context import fpop
 from fpop.cp2k import RunCp2k
 
 
+def make_cp2k_log(new_format = False, converged = True):
+    # a minimal CP2K log of an O1 H2 system with forces and the stress tensor
+    rng = np.random.default_rng(0)
+    cell = np.eye(3) * 10. + rng.normal(size=(3, 3)) * 0.1
+    coord = rng.normal(size=(3, 3)) + 5.
+    force = rng.normal(size=(3, 3)) * 0.1
+    stress = rng.normal(size=(3, 3))
+    ret = " CP2K| Multiplication driver                                                 BLAS\n\n"
+    for ii, vv in zip("abc", cell):
+        ret += " CELL| Vector %s [angstrom]: " % ii + " ".join(["%10.3f" % xx for xx in vv]) + "    |%s| =  10.000\n" % ii
+    ret += "\n"
+    for ii, ee in enumerate(["O", "H"]):
+        ret += "   %d. Atomic kind: %s                               Number of atoms:   1\n" % (ii + 1, ee)
+    ret += "\n MODULE QUICKSTEP: ATOMIC COORDINATES IN ANGSTROM\n\n"
+    ret += "   Atom  Kind  Element       X           Y           Z          Z(eff)       Mass\n\n"
+    for ii, (kk, ee, zz) in enumerate(zip([1, 2, 2], ["O", "H", "H"], [8, 1, 1])):
+        ret += "      %d     %d %s   %d " % (ii + 1, kk, ee, zz) + " ".join(["%11.6f" % xx for xx in coord[ii]]) + "      1.0000      1.0080\n"
+    ret += "\n"
+    if converged:
+        ret += "  *** SCF run converged in    10 steps ***\n\n"
+    else:
+        ret += "  *** SCF run NOT converged ***\n\n"
+    if new_format:
+        ret += " ENERGY| Total FORCE_EVAL ( QS ) energy [hartree]           -17.165383034186315\n\n"
+        ret += " FORCES| Atomic forces [hartree/bohr]\n FORCES| Atom x y z |f|\n"
+        for ii in range(3):
+            ret += " FORCES| %5d " % (ii + 1) + " ".join(["%15.8E" % xx for xx in force[ii]]) + " %15.8E\n" % np.linalg.norm(force[ii])
+        ret += " FORCES| Sum " + " ".join(["%15.8E" % xx for xx in force.sum(0)]) + "\n\n"
+        ret += " STRESS| Analytical stress tensor [GPa]\n STRESS|                        x                   y                   z\n"
+        for ii, vv in zip("xyz", stress):
+            ret += " STRESS|      %s " % ii + " ".join(["%19.12E" % xx for xx in vv]) + "\n"
+        ret += " STRESS| 1/3 Trace                                             1.0\n"
+    else:
+        ret += " ENERGY| Total FORCE_EVAL ( QS ) energy (a.u.):              -17.165383034186315\n\n"
+        ret += " ATOMIC FORCES in [a.u.]\n\n # Atom   Kind   Element          X              Y              Z\n"
+        for ii, (kk, ee) in enumerate(zip([1, 2, 2], ["O", "H", "H"])):
+            ret += "      %d      %d      %s   " % (ii + 1, kk, ee) + " ".join(["%14.8f" % xx for xx in force[ii]]) + "\n"
+        ret += " SUM OF ATOMIC FORCES          " + " ".join(["%14.8f" % xx for xx in force.sum(0)]) + "\n\n"
+        ret += " STRESS TENSOR [GPa]\n\n                  X               Y               Z\n"
+        for ii, vv in zip("XYZ", stress):
+            ret += "  %s    " % ii + " ".join(["%15.8f" % xx for xx in vv]) + "\n"
+        ret += "\n"
+    ret += " The number of warnings for this run is : 0\n"
+    return ret
+
+
 class TestRunCp2k(unittest.TestCase):
     def setUp(self):
         self.cwd = os.getcwd()
@@ -147,3 +194,49 @@ class TestRunCp2k(unittest.TestCase):
             call(' '.join(['myCp2k', '>', 'log']), raise_error=False, try_bash=True, shell=True),
         ]
         mocked_run.assert_has_calls(calls)
+
+    def test_extract_labels(self):
+        import dpdata
+        from dpdata.formats.cp2k.output import get_frames
+        from fpop.cp2k import extract_cp2k_labels
+        Path('task/log').write_text(make_cp2k_log())
+        Path('task/log.new').write_text(make_cp2k_log(new_format=True))
+        names, numbs, types, cells, coords, energies, forces, virials = get_frames('task/log')
+        for log in ['task/log', 'task/log.new']:
+            labels = Path(log + '.labels')
+            self.assertEqual(extract_cp2k_labels(log, labels), 1)
+            ss = dpdata.LabeledSystem(labels, fmt='deepmd/npy')
+            self.assertEqual(ss['atom_names'], names)
+            np.testing.assert_equal(ss['atom_types'], types)
+            for kk, vv in zip(['cells', 'coords', 'energies', 'forces', 'virials'], [cells, coords, energies, forces, virials]):
+                np.testing.assert_allclose(ss[kk], vv, rtol=1e-6, err_msg=kk)
+
+    def test_extract_labels_not_converged(self):
+        from fpop.cp2k import extract_cp2k_labels
+        Path('task/log').write_text(make_cp2k_log(converged=False))
+        self.assertEqual(extract_cp2k_labels('task/log', 'task/labels'), 0)
+        self.assertEqual(os.listdir('task/labels/set.000'), [])
+        self.assertEqual(extract_cp2k_labels('task/log', 'task/labels.all', convergence_check=False), 1)
+
+    @patch('fpop.cp2k.run_command')
+    def test_success_extract_labels(self, mocked_run):
+        mocked_run.side_effect = [ (0, 'out\n', '') ]
+        (Path(self.task_name)/'our_log').write_text(make_cp2k_log())
+        op = RunCp2k()
+        out = op.execute(
+            OPIO({
+                'run_image_config' :{
+                    'command' : 'myCp2k',
+                },
+                'task_name' : self.task_name,
+                'task_path' : self.task_path,
+                'backward_list' : [],
+                'backward_dir_name' : 'our_backward',
+                'log_name' : 'our_log',
+                'optional_input' : {'extract_labels' : True},
+            })
+        )
+        labels = out['backward_dir'] / 'labels'
+        self.assertEqual((labels/'type_map.raw').read_text(), 'O\nH\n')
+        self.assertEqual((labels/'type.raw').read_text(), '0\n1\n1\n')
+        self.assertEqual(sorted(os.listdir(labels/'set.000')), ['box.npy', 'coord.npy', 'energy.npy', 'force.npy', 'virial.npy'])
@@ -1,4 +1,6 @@
 from mocked_ops import TestInputFiles, TestInputFiles2
+import os
+from mock import patch
 from pathlib import Path
 import unittest
 import shutil
@@ -30,3 +32,116 @@ class TestRunInputFiles(unittest.TestCase):
         ref.sort()
         result.sort()
         self.assertEqual(result,ref)
+
+class TestCheckTail(unittest.TestCase):
+    def setUp(self):
+        self.fname = Path('tail_test.log')
+        self.fname.write_text('head line\n' + 'x' * 100000 + '\nmiddle line\nVoluntary context switches\n')
+
+    def tearDown(self):
+        if self.fname.is_file():
+            self.fname.unlink()
+
+    def test_read_tail(self):
+        from fpop.run_fp import RunFp
+        self.assertEqual(RunFp.read_tail(self.fname, 40), ['middle line\n', 'Voluntary context switches\n'])
+        lines = RunFp.read_tail(self.fname, 10**6)
+        self.assertEqual(lines[0], 'head line\n')
+        self.assertEqual(len(lines), 4)
+
+    def test_check_tail(self):
+        from fpop.run_fp import RunFp
+        self.assertTrue(RunFp.check_tail(self.fname, 'Voluntary', last_line=True))
+        self.assertFalse(RunFp.check_tail(self.fname, 'middle', last_line=True))
+        self.assertTrue(RunFp.check_tail(self.fname, ['foo', 'middle']))
+        # out of the bound
+        self.assertFalse(RunFp.check_tail(self.fname, 'head line'))
+        self.assertTrue(RunFp.check_tail(self.fname, 'head line', max_bytes=10**6))
+        self.assertFalse(RunFp.check_tail('no_such_file', 'Voluntary'))
+        # a trailing blank line is the last line
+        with open(self.fname, 'a') as f:
+            f.write('\n')
+        self.assertFalse(RunFp.check_tail(self.fname, 'Voluntary', last_line=True))
+
+    def test_engines(self):
+        from fpop.vasp import RunVasp
+        from fpop.abacus import RunAbacus
+        from fpop.cp2k import RunCp2k
+        self.fname.write_text('foo\n' * 10000 + ' The number of warnings for this run is : 0\n' + 'timing\n' * 10000)
+        self.assertTrue(RunCp2k().check_run_success(self.fname))
+        self.assertFalse(RunAbacus().check_run_success(self.fname))
+        self.fname.write_text('foo\n' * 10000 + ' SEE INFORMATION IN : OUT.ABACUS/\n')
+        self.assertTrue(RunAbacus().check_run_success(self.fname))
+        self.assertFalse(RunCp2k().check_run_success(self.fname))
+
+class TestCopyBackward(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        Path('copy_test/OUT.foo/sub').mkdir(parents=True, exist_ok=True)
+        Path('copy_test/OUT.foo/running_scf.log').write_text('log')
+        Path('copy_test/OUT.foo/CHG.cube').write_text('chg')
+        Path('copy_test/OUT.foo/sub/STRU_ION_D').write_text('stru')
+        Path('copy_test/OUT.bar').mkdir(parents=True, exist_ok=True)
+        Path('copy_test/OUT.bar/running_scf.log').write_text('log')
+        Path('copy_test/INPUT').write_text('input')
+        os.chdir('copy_test')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        if Path('copy_test').is_dir():
+            shutil.rmtree('copy_test')
+
+    def test_all(self):
+        from fpop.run_fp import RunFp
+        RunFp.collect_backward(['INPUT', 'OUT.foo', 'OUT.bar/running_scf.log'], 'backward')
+        self.assertEqual(sorted(os.listdir('backward')), ['INPUT', 'OUT.bar', 'OUT.foo'])
+        self.assertEqual(sorted(os.listdir('backward/OUT.foo')), ['CHG.cube', 'running_scf.log', 'sub'])
+        self.assertEqual(os.listdir('backward/OUT.bar'), ['running_scf.log'])
+
+    def test_patterns(self):
+        from fpop.run_fp import RunFp
+        RunFp.collect_backward(['OUT.*'], 'backward', ['running_*.log', 'sub/STRU_*'])
+        self.assertEqual(sorted(os.listdir('backward')), ['OUT.bar', 'OUT.foo'])
+        self.assertEqual(sorted(os.listdir('backward/OUT.foo')), ['running_scf.log', 'sub'])
+        self.assertEqual(os.listdir('backward/OUT.foo/sub'), ['STRU_ION_D'])
+        self.assertEqual(os.listdir('backward/OUT.bar'), ['running_scf.log'])
+
+    def test_link(self):
+        from fpop.run_fp import RunFp
+        RunFp.collect_backward(['INPUT', 'OUT.foo'], 'backward')
+        self.assertEqual(os.stat('backward/INPUT').st_ino, os.stat('INPUT').st_ino)
+        self.assertEqual(os.stat('backward/OUT.foo/sub/STRU_ION_D').st_ino, os.stat('OUT.foo/sub/STRU_ION_D').st_ino)
+        # a symbolic link is resolved
+        os.symlink('INPUT', 'INPUT.link')
+        RunFp.collect_backward(['INPUT.link'], 'backward')
+        self.assertFalse(os.path.islink('backward/INPUT.link'))
+        self.assertEqual(os.stat('backward/INPUT.link').st_ino, os.stat('INPUT').st_ino)
+        # collected again
+        RunFp.collect_backward(['INPUT', 'OUT.foo'], 'backward')
+        self.assertEqual(Path('backward/INPUT').read_text(), 'input')
+        self.assertEqual(Path('backward/OUT.foo/sub/STRU_ION_D').read_text(), 'stru')
+
+    def test_copy(self):
+        from fpop.run_fp import RunFp
+        with patch('os.link', side_effect=OSError(18, 'Invalid cross-device link')):
+            RunFp.collect_backward(['INPUT', 'OUT.foo'], 'backward')
+        self.assertNotEqual(os.stat('backward/INPUT').st_ino, os.stat('INPUT').st_ino)
+        self.assertEqual(Path('backward/OUT.foo/sub/STRU_ION_D').read_text(), 'stru')
+        RunFp.collect_backward(['OUT.bar'], 'backward', link=False)
+        self.assertNotEqual(os.stat('backward/OUT.bar/running_scf.log').st_ino, os.stat('OUT.bar/running_scf.log').st_ino)
+
+    def test_compress(self):
+        from fpop.run_fp import RunFp
+        from fpop.utils.compression import open_backward, decompress_dir
+        Path('OUT.foo/CHG.cube').write_text('chg' * 1000)
+        RunFp.collect_backward(['INPUT', 'OUT.foo'], 'backward', compress={'method' : 'gzip', 'threshold' : 1000})
+        self.assertEqual(sorted(os.listdir('backward/OUT.foo')), ['CHG.cube.gz', 'running_scf.log', 'sub'])
+        # the small files are linked
+        self.assertEqual(os.stat('backward/INPUT').st_ino, os.stat('INPUT').st_ino)
+        with open_backward('backward/OUT.foo/CHG.cube', 'r') as f:
+            self.assertEqual(f.read(), 'chg' * 1000)
+        # only the files compressed by the collection are decompressed
+        Path('backward/staged.gz').write_text('staged')
+        self.assertEqual(decompress_dir('backward'), [Path('backward/OUT.foo/CHG.cube')])
+        self.assertEqual(Path('backward/OUT.foo/CHG.cube').read_text(), 'chg' * 1000)
+        self.assertEqual(Path('backward/staged.gz').read_text(), 'staged')
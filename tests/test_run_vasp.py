@@ -6,6 +6,50 @@ from mock import mock, patch, call
 from context import fpop
 from fpop.vasp import RunVasp
 from mocked_ops import MockedRunVasp
+import numpy as np
+
+def make_outcar(nsteps = 3, nelm = 3):
+    # a minimal OUTCAR of an O1 H2 system, the last ionic step does not converge
+    rng = np.random.default_rng(0)
+    ret = " POTCAR:    PAW_PBE O 08Apr2002\n POTCAR:    PAW_PBE H 15Jun2001\n"
+    ret += "   TITEL  = PAW_PBE O 08Apr2002\n   TITEL  = PAW_PBE H 15Jun2001\n"
+    ret += "   ions per type =               1   2\n"
+    ret += "   NELM   =      %d;   NELMIN=  2; NELMDL= -5     elect.SC-steps\n" % nelm
+    ret += "   NWRITE =      2    write-flag\n"
+    for ii in range(nsteps):
+        nscf = 2 if ii < nsteps - 1 else nelm
+        for jj in range(nscf):
+            ret += "--------------------------------------- Iteration %6d(%4d)  ---------------------------------------\n" % (ii + 1, jj + 1)
+            ret += "  free energy    TOTEN  =       -10.00000000 eV\n"
+        stress = rng.normal(size=6)
+        ret += "  FORCE on cell =-STRESS in cart. coord.  units (eV):\n"
+        ret += "  Direction    XX          YY          ZZ          XY          YZ          ZX\n"
+        ret += "  --------------------------------------------------------------------------------------\n"
+        for kk in ["Alpha Z", "Ewald", "Hartree", "E(xc)", "Local", "n-local", "augment", "Kinetic", "Fock"]:
+            ret += "  %-9s" % kk + "     0.00000" * 6 + "\n"
+        ret += "  -------------------------------------------------------------------------------------\n"
+        ret += "  Total   " + " ".join(["%11.5f" % vv for vv in stress]) + "\n"
+        ret += "  in kB   " + " ".join(["%11.5f" % vv for vv in stress]) + "\n"
+        ret += "  external pressure =        0.00 kB  Pullay stress =        0.00 kB\n\n"
+        cell = np.eye(3) * (10. + ii) + rng.normal(size=(3, 3)) * 0.1
+        ret += " VOLUME and BASIS-vectors are now :\n"
+        ret += " -----------------------------------------------------------------------------\n"
+        ret += "  energy-cutoff  :      400.00\n"
+        ret += "  volume of cell :     %10.2f\n" % np.linalg.det(cell)
+        ret += "      direct lattice vectors                 reciprocal lattice vectors\n"
+        for vv in cell:
+            ret += "   " + " ".join(["%12.9f" % xx for xx in vv]) + "   0.100000000  0.000000000  0.000000000\n"
+        ret += "\n POSITION                                       TOTAL-FORCE (eV/Angst)\n"
+        ret += " -----------------------------------------------------------------------------------\n"
+        for vv in rng.normal(size=(3, 6)):
+            ret += "   " + " ".join(["%12.5f" % xx for xx in vv]) + "\n"
+        ret += " -----------------------------------------------------------------------------------\n\n"
+        ret += "  FREE ENERGIE OF THE ION-ELECTRON SYSTEM (eV)\n"
+        ret += "  ---------------------------------------------------\n"
+        ret += "  free  energy   TOTEN  =       %.8f eV\n\n" % (-14.2 - ii)
+    ret += " General timing and accounting informations for this job:\n"
+    ret += "                       Voluntary context switches:          0\n"
+    return ret
 
 class TestRunVasp(unittest.TestCase):
     def setUp(self):
@@ -28,6 +72,14 @@ class TestRunVasp(unittest.TestCase):
             shutil.rmtree('task')
         if Path(self.task_name).is_dir():
             shutil.rmtree(self.task_name)
+        if Path('staged_inputs').is_dir():
+            shutil.rmtree('staged_inputs')
+        if Path('unpacked_inputs').is_dir():
+            shutil.rmtree('unpacked_inputs')
+        if Path('scratch').is_dir():
+            shutil.rmtree('scratch')
+        if Path('task_001').is_dir():
+            shutil.rmtree('task_001')
     
     @patch('fpop.vasp.run_command')
     def test_success(self, mocked_run):
@@ -106,6 +158,306 @@ class TestRunVasp(unittest.TestCase):
         self.assertEqual((work_dir/'TEST1').read_text(), 'here test1')
         self.assertEqual((work_dir/'TEST2').read_text(), 'here test2')
 
+    @patch('fpop.vasp.run_command')
+    def test_shared_files(self, mocked_run):
+        from fpop.utils.shared_files import pool_files, SHARED_FILES_MANIFEST
+        mocked_run.side_effect = [ (0, 'out\n', '') ]
+        os.chdir(self.task_path)
+        manifest = pool_files(['INCAR', 'POTCAR', 'TEST1'], '../pool')
+        os.chdir(self.cwd)
+        self.assertEqual(sorted(manifest.keys()), ['INCAR', 'POTCAR', 'TEST1'])
+        self.assertFalse((self.task_path/'INCAR').exists())
+        self.assertTrue((self.task_path/SHARED_FILES_MANIFEST).is_file())
+        op = RunVasp()
+        def new_check_run_success(obj):
+            return True
+        with mock.patch.object(RunVasp, "check_run_success", new=new_check_run_success):
+            out = op.execute(
+                OPIO({
+                    'run_image_config' :{
+                        'command' : 'myvasp',
+                    },
+                    'task_name' : self.task_name,
+                    'task_path' : self.task_path,
+                    'backward_list' : ['POSCAR','TEST1'],
+                    'backward_dir_name' : 'our_backward',
+                    'log_name' : 'our_log',
+                    'optional_artifact' : {'TEST1':Path(''),'TEST2':Path('')},
+                    'shared_files' : sorted(Path('task/pool').iterdir()),
+                })
+            )
+        work_dir = Path(self.task_name)
+        for ii in ['POSCAR','TEST1','our_log']:
+            self.assertTrue(Path(Path(work_dir/'our_backward')/ ii).is_file())
+        self.assertEqual((work_dir/'POSCAR').read_text(), 'here poscar')
+        self.assertEqual((work_dir/'INCAR').read_text(), 'here incar')
+        self.assertEqual((work_dir/'POTCAR').read_text(), 'here potcar')
+        self.assertEqual((work_dir/'TEST1').read_text(), 'here test1')
+        self.assertEqual((work_dir/'TEST2').read_text(), 'here test2')
+        self.assertFalse((work_dir/SHARED_FILES_MANIFEST).exists())
+
+    @patch('fpop.vasp.run_command')
+    def test_packed(self, mocked_run):
+        from fpop.utils.task_archive import pack_tasks
+        mocked_run.side_effect = [ (0, 'out\n', '') ]
+        other_task = Path('task/other')
+        shutil.copytree(self.task_path, other_task)
+        (other_task/'POSCAR').write_text('other poscar')
+        os.chdir('task')
+        archive = pack_tasks(['path', 'other'], 'tasks.zip').absolute()
+        os.chdir(self.cwd)
+        work_dir = Path('other')
+        work_dir.mkdir()
+        (work_dir/'our_log').write_text('here log')
+        op = RunVasp()
+        def new_check_run_success(obj):
+            return True
+        with mock.patch.object(RunVasp, "check_run_success", new=new_check_run_success):
+            out = op.execute(
+                OPIO({
+                    'run_image_config' :{
+                        'command' : 'myvasp',
+                    },
+                    'task_name' : 'other',
+                    'task_path' : archive,
+                    'backward_list' : ['POSCAR','TEST1'],
+                    'backward_dir_name' : 'our_backward',
+                    'log_name' : 'our_log',
+                    'optional_artifact' : {'TEST1':Path(''),'TEST2':Path('')},
+                })
+            )
+        try:
+            self.assertEqual(out["backward_dir"], work_dir/'our_backward')
+            self.assertEqual((work_dir/'POSCAR').read_text(), 'other poscar')
+            self.assertEqual((work_dir/'INCAR').read_text(), 'here incar')
+            self.assertEqual((work_dir/'TEST2').read_text(), 'here test2')
+            self.assertFalse(Path('unpacked_inputs/path').exists())
+        finally:
+            shutil.rmtree(work_dir)
+
+    @patch('fpop.vasp.run_command')
+    def test_task_manifest(self, mocked_run):
+        from fpop.utils.task_manifest import write_task_manifest
+        mocked_run.side_effect = [ (0, 'out\n', '') ]
+        manifest = write_task_manifest(['task_999', self.task_name], 'task/manifest.txt', 11)
+        op = RunVasp()
+        def new_check_run_success(obj):
+            return True
+        with mock.patch.object(RunVasp, "check_run_success", new=new_check_run_success):
+            out = op.execute(
+                OPIO({
+                    'run_image_config' :{
+                        'command' : 'myvasp',
+                    },
+                    'task_index' : '000012',
+                    'task_manifest' : [manifest],
+                    'task_path' : self.task_path,
+                    'backward_list' : ['POSCAR'],
+                    'backward_dir_name' : 'our_backward',
+                    'log_name' : 'our_log',
+                })
+            )
+        work_dir = Path(self.task_name)
+        self.assertEqual(out["backward_dir"], work_dir/'our_backward')
+        self.assertEqual((work_dir/'POSCAR').read_text(), 'here poscar')
+
+    def test_extract_labels(self):
+        import dpdata
+        from fpop.vasp import extract_outcar_labels
+        Path('task/OUTCAR').write_text(make_outcar())
+        nframes = extract_outcar_labels('task/OUTCAR', 'task/labels')
+        self.assertEqual(nframes, 2)
+        # dpdata.LabeledSystem rotates the cell, compare with the frames it reads
+        from dpdata.formats.vasp.outcar import get_frames
+        names, numbs, types, cells, coords, energies, forces, virials = get_frames('task/OUTCAR')
+        virials = virials * (np.linalg.det(cells) * 1e3 / 1.602176621e6)[:, None, None]
+        ss = dpdata.LabeledSystem('task/labels', fmt='deepmd/npy')
+        self.assertEqual(ss['atom_names'], names)
+        np.testing.assert_equal(ss['atom_types'], types)
+        for kk, vv in zip(['cells', 'coords', 'energies', 'forces', 'virials'], [cells, coords, energies, forces, virials]):
+            np.testing.assert_allclose(ss[kk], vv, err_msg=kk)
+        # the unconverged step is kept without the check
+        self.assertEqual(extract_outcar_labels('task/OUTCAR', 'task/labels.all', convergence_check=False), 3)
+
+    @patch('fpop.vasp.run_command')
+    def test_success_extract_labels(self, mocked_run):
+        mocked_run.side_effect = [ (0, 'out\n', '') ]
+        (Path(self.task_name)/'OUTCAR').write_text(make_outcar())
+        op = RunVasp()
+        out = op.execute(
+            OPIO({
+                'run_image_config' :{
+                    'command' : 'myvasp',
+                },
+                'task_name' : self.task_name,
+                'task_path' : self.task_path,
+                'backward_list' : [],
+                'backward_dir_name' : 'our_backward',
+                'log_name' : 'our_log',
+                'optional_input' : {'extract_labels' : True},
+            })
+        )
+        labels = out['backward_dir'] / 'labels'
+        self.assertEqual((labels/'type_map.raw').read_text(), 'O\nH\n')
+        self.assertEqual(np.load(labels/'set.000'/'force.npy').shape, (2, 9))
+        self.assertEqual(np.load(labels/'set.000'/'energy.npy').shape, (2,))
+        self.assertEqual(sorted(os.listdir(labels/'set.000')), ['box.npy', 'coord.npy', 'energy.npy', 'force.npy', 'virial.npy'])
+
+    @patch('fpop.vasp.run_command')
+    def test_scratch_dir(self, mocked_run):
+        run_dirs = []
+        def fake_run(*args, **kwargs):
+            run_dirs.append(os.getcwd())
+            # the inputs are copied, not linked
+            self.assertFalse(os.path.islink('POSCAR'))
+            self.assertEqual(Path('TEST1').read_text(), 'here test1')
+            Path('our_log').write_text('scratch log')
+            Path('WAVECAR').write_text('here wavecar')
+            Path('OUTCAR').write_text(' Voluntary context switches: 0\n')
+            return (0, 'out\n', '')
+        mocked_run.side_effect = fake_run
+        # the backward directory left by a previous try is replaced
+        (Path(self.task_name)/'our_backward').mkdir(parents=True)
+        (Path(self.task_name)/'our_backward'/'stale').write_text('stale')
+        op = RunVasp()
+        out = op.execute(
+            OPIO({
+                'run_image_config' :{
+                    'command' : 'myvasp',
+                },
+                'task_name' : self.task_name,
+                'task_path' : self.task_path,
+                'backward_list' : ['OUTCAR'],
+                'backward_dir_name' : 'our_backward',
+                'log_name' : 'our_log',
+                'optional_input' : {'scratch_dir' : 'scratch'},
+                'optional_artifact' : {'TEST1':Path('')},
+            })
+        )
+        self.assertEqual(len(run_dirs), 1)
+        self.assertEqual(Path(run_dirs[0]).parent, Path('scratch').absolute())
+        # only the backward directory is kept
+        self.assertEqual(out['backward_dir'], Path(self.task_name)/'our_backward')
+        self.assertEqual(sorted(os.listdir(out['backward_dir'])), ['OUTCAR', 'our_log'])
+        self.assertEqual((out['backward_dir']/'our_log').read_text(), 'scratch log')
+        self.assertFalse((Path(self.task_name)/'WAVECAR').exists())
+        self.assertEqual(os.listdir('scratch'), [])
+
+    @patch('fpop.vasp.run_command')
+    def test_scratch_dir_batch(self, mocked_run):
+        from fpop.utils.shared_files import pool_files
+        from fpop.run_fp import SCRATCH_SHARED_DIR
+        os.chdir(self.task_path)
+        manifest = pool_files(['INCAR', 'POTCAR'], '../pool')
+        os.chdir(self.cwd)
+        potcar_inodes = []
+        def fake_run(*args, **kwargs):
+            potcar_inodes.append(os.stat('POTCAR').st_ino)
+            self.assertEqual(Path('POTCAR').read_text(), 'here potcar')
+            Path('our_log').write_text('log')
+            Path('OUTCAR').write_text(' Voluntary context switches: 0\n')
+            return (0, 'out\n', '')
+        mocked_run.side_effect = fake_run
+        op = RunVasp()
+        # a batch of tasks run in one process
+        for task_name in [self.task_name, 'task_001']:
+            out = op.execute(
+                OPIO({
+                    'run_image_config' :{
+                        'command' : 'myvasp',
+                    },
+                    'task_name' : task_name,
+                    'task_path' : self.task_path,
+                    'backward_list' : ['POSCAR'],
+                    'backward_dir_name' : 'our_backward',
+                    'log_name' : 'our_log',
+                    'optional_input' : {'scratch_dir' : 'scratch'},
+                    'shared_files' : sorted(Path('task/pool').iterdir()),
+                })
+            )
+            self.assertEqual(out['backward_dir'], Path(task_name)/'our_backward')
+            self.assertEqual((out['backward_dir']/'POSCAR').read_text(), 'here poscar')
+        shutil.rmtree('task_001')
+        # the shared files are copied to the scratch once and linked to the tasks
+        cache = Path('scratch')/SCRATCH_SHARED_DIR
+        self.assertEqual(sorted(os.listdir(cache)), sorted(manifest.values()))
+        self.assertEqual(potcar_inodes, [os.stat(cache/manifest['POTCAR']).st_ino] * 2)
+        self.assertEqual(os.listdir('scratch'), [SCRATCH_SHARED_DIR])
+
+    @patch('fpop.vasp.run_command')
+    def test_cpu_binding(self, mocked_run):
+        mocked_run.side_effect = [ (0, 'out\n', '') ]
+        op = RunVasp()
+        def new_check_run_success(obj):
+            return True
+        with mock.patch.object(RunVasp, "check_run_success", new=new_check_run_success):
+            out = op.execute(
+                OPIO({
+                    'run_image_config' :{
+                        'command' : 'mpirun -np {ncpus} vasp_std',
+                        'cpu_binding' : {'slots' : 2, 'cpus' : '0-7', 'lock_dir' : 'task/cpu_slots'},
+                    },
+                    'task_name' : self.task_name,
+                    'task_path' : self.task_path,
+                    'backward_list' : [],
+                    'log_name' : 'our_log',
+                })
+            )
+        calls = [
+            call("taskset -c 0-3 bash -c 'mpirun -np 4 vasp_std > our_log'", raise_error=False, try_bash=True, shell=True),
+        ]
+        mocked_run.assert_has_calls(calls)
+
+    @patch('fpop.vasp.run_command')
+    def test_launcher(self, mocked_run):
+        mocked_run.side_effect = [ (0, 'out\n', '') ]
+        op = RunVasp()
+        def new_check_run_success(obj):
+            return True
+        with mock.patch.object(RunVasp, "check_run_success", new=new_check_run_success):
+            out = op.execute(
+                OPIO({
+                    'run_image_config' :{
+                        'command' : 'myvasp',
+                        'launcher' : {'executable' : 'vasp_std', 'threads' : 2, 'mpi' : 'openmpi', 'binding' : 'core'},
+                        'cpu_binding' : {'slots' : 2, 'cpus' : '0-7', 'lock_dir' : 'task/cpu_slots'},
+                        'env' : {'FOO' : 'bar'},
+                    },
+                    'task_name' : self.task_name,
+                    'task_path' : self.task_path,
+                    'backward_list' : [],
+                    'log_name' : 'our_log',
+                })
+            )
+        command = 'export OMP_NUM_THREADS=2 && mpirun -np 2 --map-by slot:PE=2 --bind-to core vasp_std > our_log'
+        calls = [
+            call("taskset -c 0-3 bash -c '%s'" % command, raise_error=False, try_bash=True, shell=True, env={'FOO' : 'bar'}),
+        ]
+        mocked_run.assert_has_calls(calls)
+
+    @patch('fpop.vasp.run_command')
+    def test_scratch_dir_error(self, mocked_run):
+        def fake_run(*args, **kwargs):
+            Path('our_log').write_text('error log')
+            return (1, 'out\n', '')
+        mocked_run.side_effect = fake_run
+        op = RunVasp()
+        with self.assertRaises(TransientError):
+            op.execute(
+                OPIO({
+                    'run_image_config' :{
+                        'command' : 'myvasp',
+                    },
+                    'task_name' : self.task_name,
+                    'task_path' : self.task_path,
+                    'backward_list' : ['OUTCAR'],
+                    'log_name' : 'our_log',
+                    'optional_input' : {'scratch_dir' : 'scratch'},
+                })
+            )
+        self.assertEqual(os.listdir('scratch'), [])
+        self.assertEqual((Path(self.task_name)/'our_log').read_text(), 'error log')
+
     @patch('fpop.vasp.run_command')
     def test_error(self, mocked_run):
         mocked_run.side_effect = [ (1, 'out\n', '') ]
@@ -3,7 +3,7 @@ import os,sys,json,glob,shutil,textwrap
 import dpdata
 import numpy as np
 import unittest
-from fpop.vasp import make_kspacing_kpoints, VaspInputs
+from fpop.vasp import make_kspacing_kpoints, make_kspacing_kpoints_batch, make_kspacing_kpoints_mesh, VaspInputs
 from pathlib import Path
 
 class TestVASPInputs(unittest.TestCase):
@@ -32,6 +32,51 @@ class TestVASPInputs(unittest.TestCase):
             kp_ref = list(np.loadtxt(os.path.join(ii, 'kp.ref'), dtype = int))
             self.assertTrue(kp == kp_ref)
 
+    def test_make_kp_batch(self):
+        rng = np.random.default_rng(0)
+        cells = rng.normal(size=(50, 3, 3)) * 5.
+        for kspacing in [0.16, [0.1, 0.2, 0.3]]:
+            for gamma in [True, False]:
+                ret = make_kspacing_kpoints_batch(cells, kspacing, gamma)
+                self.assertEqual(len(ret), 50)
+                for ii in range(50):
+                    self.assertEqual(ret[ii], make_kspacing_kpoints(cells[ii], kspacing, gamma))
+        mesh = make_kspacing_kpoints_mesh(np.diag([2., 4., 1000.])[None], 0.5)
+        np.testing.assert_equal(mesh, [[7, 4, 1]])
+
+    def test_make_kp_batch_cache(self):
+        cells = np.array([np.eye(3) * 10.] * 3 + [np.eye(3) * 5.])
+        cache = {}
+        ret = make_kspacing_kpoints_batch(cells, 0.16, True, cache=cache)
+        self.assertEqual(len(cache), 2)
+        self.assertIs(ret[0], ret[2])
+        self.assertNotEqual(ret[0], ret[3])
+
+    def test_vasp_input_kp_memo(self):
+        vi = VaspInputs(0.16, 'template.incar', {'H' : 'POTCAR_H'}, True)
+        box = np.eye(3) * 10.
+        kps = vi.make_kpoints(box)
+        self.assertIs(vi.make_kpoints(box.copy()), kps)
+        self.assertEqual(vi.make_kpoints_batch(np.array([box, box * 2.]))[0], kps)
+        vi.kgamma = False
+        self.assertTrue(vi.make_kpoints(box).startswith('K-Points'))
+        # the memoized KPOINTS are not serialized
+        self.assertNotIn('_last_kpoints', vi.__getstate__())
+        self.assertNotIn('_kpoints_cache', vi.__getstate__())
+
+    def test_vasp_input_incar_tuning(self):
+        vi = VaspInputs(0.16, 'template.incar', {'H' : 'POTCAR_H'}, True)
+        self.assertEqual(vi.make_incar(2, np.eye(3) * 10.), 'foo')
+        Path('template.incar').write_text('ENCUT = 500\nLREAL = .FALSE.\n')
+        vi = VaspInputs(0.16, 'template.incar', {'H' : 'POTCAR_H'}, True, incar_tuning={'ncores' : 16})
+        # 4x4x4 gamma centered mesh, 36 k-points
+        incar = vi.make_incar(2, np.eye(3) * 10.)
+        self.assertEqual(incar, 'ENCUT = 500\nLREAL = .FALSE.\n# performance tags set by fpop\nKPAR = 4\nNCORE = 2\n')
+        self.assertIs(vi.make_incar(2, np.eye(3) * 10.), incar)
+        # one k-point
+        incar = vi.make_incar(64, np.eye(3) * 40.)
+        self.assertEqual(incar, 'ENCUT = 500\nLREAL = .FALSE.\n# performance tags set by fpop\nKPAR = 1\nNCORE = 4\n')
+
     def test_vasp_input_incar_potcar(self):
         iincar = 'template.incar'
         ipotcar = {'H' : 'POTCAR_H', 'O' : 'POTCAR_O'}